@@ -1,7 +1,17 @@
-import os, argparse, csv, datetime, time
+import os, argparse, csv, datetime, time, hashlib, asyncio, re, queue, threading, itertools
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from functools import lru_cache
 import boto3
 from botocore import UNSIGNED
 from botocore.config import Config
+from boto3.s3.transfer import TransferConfig, create_transfer_manager
+
+# 可选依赖：--async 模式需要 aioboto3
+try:
+    import aioboto3
+    HAS_AIOBOTO3 = True
+except ImportError:
+    HAS_AIOBOTO3 = False
 
 # 配置超时和重试
 S3_CONFIG = Config(
@@ -13,10 +23,20 @@ S3_CONFIG = Config(
         'mode': 'adaptive'     # 自适应重试
     }
 )
+try:
+    # 长连接开启 TCP keepalive，空闲连接不易被中间设备断开而重新握手（旧版 botocore 不支持则忽略）
+    S3_CONFIG = S3_CONFIG.merge(Config(tcp_keepalive=True))
+except TypeError:
+    pass
 
 MAX_DOWNLOAD_RETRIES = 3       # 下载失败重试次数
 RETRY_DELAY = 5                # 重试间隔秒数
+MULTIPART_THRESHOLD = 8 * 1024 * 1024  # 大于8MB的文件使用分段并行 Range 下载
+CSV_FLUSH_EVERY = 100          # CSV 每写入多少行刷新一次（兼顾崩溃安全）
+CAP_SKIP_LIMIT = 10000         # --stop-at-cap 时，配额满后连续跳过这么多对象就停止列举
+ASYNC_SELECT_BATCH = 1000      # --async 模式每次在线程中取出的待处理项数（约一页 list_objects_v2）
 
+@lru_cache(maxsize=1 << 16)  # 对象大小大量重复（如同尺寸的 JSON），缓存格式化结果
 def human(n: int) -> str:
     u = ["B","KB","MB","GB","TB"]; i=0; s=float(n)
     while s>=1024 and i<len(u)-1: s/=1024; i+=1
@@ -25,133 +45,559 @@ def human(n: int) -> str:
 def ensure_dir(p: str):
     os.makedirs(os.path.dirname(p), exist_ok=True)
 
-def write_csv_header_if_needed(csv_path: str):
-    if not csv_path: return
-    need_header = (not os.path.exists(csv_path)) or (os.path.getsize(csv_path)==0)
-    if need_header:
-        with open(csv_path, "w", newline="", encoding="utf-8") as f:
-            w = csv.writer(f)
-            w.writerow([
-                "timestamp_iso",
-                "bucket",
-                "key",
-                "size_bytes",
-                "size_human",
-                "etag",
-                "last_modified_iso",
-                "local_path",
-                "status"  # downloaded | already_present
-            ])
+def _local_size(path: str) -> int:
+    """一次 stat 取本地文件大小，不存在（或无法访问）返回 -1"""
+    try:
+        return os.stat(path).st_size
+    except OSError:
+        return -1
 
-def append_csv_row(csv_path: str, row: list):
-    if not csv_path: return
-    with open(csv_path, "a", newline="", encoding="utf-8") as f:
-        csv.writer(f).writerow(row)
+def open_csv_with_header(csv_path: str, append: bool):
+    """
+    整个运行只打开一次 CSV（覆盖或追加），文件为空时写入表头
+    返回持久的文件句柄（64KB 缓冲），未指定路径返回 None
+    """
+    if not csv_path: return None
+    fh = open(csv_path, "a" if append else "w", newline="", encoding="utf-8", buffering=1 << 16)
+    fh.seek(0, os.SEEK_END)
+    if fh.tell() == 0:
+        csv.writer(fh).writerow([
+            "timestamp_iso",
+            "bucket",
+            "key",
+            "size_bytes",
+            "size_human",
+            "etag",
+            "last_modified_iso",
+            "local_path",
+            "status"  # downloaded | already_present
+        ])
+    return fh
 
-def main():
-    ap = argparse.ArgumentParser("Download from S3 with total-size cap, export CSV for downloaded files")
-    ap.add_argument("--bucket", default="umbra-open-data-catalog")
-    ap.add_argument("--prefix", default="sar-data/tasks")
-    ap.add_argument("--region", default="us-west-2")
-    ap.add_argument("--out", default="/home/hjl/data/umbra/tasks")  # Linux路径
-    ap.add_argument("--cap-gb", type=float, default=100000.0, help="max total GB to fetch this run")
-    ap.add_argument("--exclude-ext", default="", help="comma sep, e.g. .json,.xml")
-    ap.add_argument("--dryrun", action="store_true")
-    ap.add_argument("--csv", help="CSV path to log downloaded/already_present files of THIS RUN")
-    ap.add_argument("--append", action="store_true", help="append to CSV if exists (default overwrite)")
-    args = ap.parse_args()
+@lru_cache(maxsize=4096)  # 同一批文件的 LastModified 常常相同，datetime 按值比较可直接作缓存键
+def _iso(lm) -> str:
+    return lm.isoformat() if hasattr(lm, "isoformat") else ""
 
-    exclude = tuple(e.strip().lower() for e in args.exclude_ext.split(",") if e.strip())
-    cap_bytes = int(args.cap_gb * 1024**3)
+def scan_local(root: str) -> dict:
+    """
+    用 os.scandir 一次性遍历本地输出目录，构建 {相对路径: 大小} 索引
+    DirEntry 的类型信息来自目录读取本身，避免选文件时对每个 key 单独 stat
+    """
+    index = {}
+    stack = [root]
+    while stack:
+        d = stack.pop()
+        try:
+            with os.scandir(d) as it:
+                for e in it:
+                    try:
+                        if e.is_dir(follow_symlinks=False):
+                            stack.append(e.path)
+                        else:
+                            index[os.path.relpath(e.path, root)] = e.stat().st_size
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+    return index
+
+def _md5_matches(path: str, etag: str) -> bool:
+    """
+    计算本地文件 MD5，与单段上传对象的 ETag 比较
+    Python 3.11+ 用 hashlib.file_digest：读文件和计算都在 C 层循环完成（OpenSSL 实现）；
+    更早的版本按 1MB 分块 readinto 到同一块缓冲区，不再每块新建 bytes
+    """
+    try:
+        with open(path, "rb", buffering=0) as f:
+            if hasattr(hashlib, "file_digest"):
+                return hashlib.file_digest(f, "md5").hexdigest() == etag
+            h = hashlib.md5()
+            buf = bytearray(1 << 20)
+            view = memoryview(buf)
+            n = f.readinto(buf)
+            while n:
+                h.update(view[:n])
+                n = f.readinto(buf)
+    except OSError:
+        return False
+    return h.hexdigest() == etag
+
+def iter_pages(s3, bucket: str, prefix: str):
+    """
+    直接循环调用 list_objects_v2（不经 paginator 的包装层），逐页产出响应
+    FetchOwner=False 不返回 Owner 字段，缩小每页 XML 的体积与解析量
+    """
+    kwargs = {"Bucket": bucket, "Prefix": prefix, "FetchOwner": False}
+    while True:
+        resp = s3.list_objects_v2(**kwargs)
+        yield resp
+        if not resp.get("IsTruncated"):
+            break
+        kwargs["ContinuationToken"] = resp["NextContinuationToken"]
+
+def list_shards(s3, bucket: str, prefix: str):
+    """
+    用 Delimiter="/" 列出 prefix 下一层的子前缀，作为并行列举的分片
+    只有唯一子前缀且没有直接对象时继续向下一层（如 "sar-data/tasks" -> "sar-data/tasks/"）
+    返回 (子前缀列表, 本层直接对象所在的页)
+    """
+    while True:
+        subs, pages = [], []
+        kwargs = {"Bucket": bucket, "Prefix": prefix, "Delimiter": "/", "FetchOwner": False}
+        while True:
+            resp = s3.list_objects_v2(**kwargs)
+            subs.extend(cp["Prefix"] for cp in resp.get("CommonPrefixes", []) or [])
+            if resp.get("Contents"):
+                pages.append(resp)
+            if not resp.get("IsTruncated"):
+                break
+            kwargs["ContinuationToken"] = resp["NextContinuationToken"]
+        if len(subs) == 1 and not pages:
+            prefix = subs[0]
+            continue
+        return subs, pages
+
+def iter_pages_parallel(s3, bucket: str, prefix: str, threads: int):
+    """
+    按子前缀分片，多个线程同时列举，各分片每列到一页就放进有界队列，主线程按到达顺序产出
+    列举的 RTT 并行化，内存中最多缓存 threads * 2 页；产出顺序不再是全局字典序
+    """
+    subs, pages = list_shards(s3, bucket, prefix)
+    yield from pages
+    if not subs:
+        return
+    pages_q = queue.Queue(maxsize=threads * 2)
+    stop = threading.Event()
+    done = object()
 
-    s3 = boto3.client("s3", config=S3_CONFIG, region_name=args.region)
-    paginator = s3.get_paginator("list_objects_v2")
-    pages = paginator.paginate(Bucket=args.bucket, Prefix=args.prefix)
+    def put(item) -> bool:
+        # 消费方提前停止时不再阻塞在满队列上
+        while not stop.is_set():
+            try:
+                pages_q.put(item, timeout=1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def list_shard(sp):
+        try:
+            for page in iter_pages(s3, bucket, sp):
+                if not put(page):
+                    return
+        except Exception as e:
+            put(e)
+        finally:
+            put(done)
 
-    total=0
-    selected = []  # (key, size, etag, last_modified)
+    ex = ThreadPoolExecutor(max_workers=threads)
+    try:
+        for sp in subs:
+            ex.submit(list_shard, sp)
+        remaining = len(subs)
+        while remaining:
+            item = pages_q.get()
+            if item is done:
+                remaining -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        # 提前停止（如配额已满）时不再等待尚未开始的分片，正在列举的分片在下一次 put 时退出
+        stop.set()
+        ex.shutdown(wait=False, cancel_futures=True)
 
-    # 选文件（累计到 cap 以内；跳过本地已存在且大小一致的文件，不占用配额）
+def compile_exclude(exts: str):
+    """把逗号分隔的后缀编译成一个忽略大小写、锚定结尾的正则，无后缀时返回 None"""
+    exclude = [e.strip() for e in exts.split(",") if e.strip()]
+    if not exclude:
+        return None
+    return re.compile(r"(?i)(?:" + "|".join(re.escape(e) for e in exclude) + r")\Z")
+
+def iter_selected(pages, prefix: str, out: str, exclude, cap_bytes: int, verify: str = "size",
+                  local_index: dict = None, stop_at_cap: bool = False):
+    """
+    流式选文件：逐页解析，边列举边产出 (key, size, etag, last_modified_iso, local, status)
+    累计到 cap 以内；本地已存在的文件不占用配额；配额用满后立即停止列举
+    verify: none=存在即跳过, size=大小一致才跳过, etag=大小一致且 MD5 与 ETag 一致才跳过
+            （MD5 校验放到下载线程里做，这里标记为 to_verify；分段上传的 ETag 含 "-"，退化为 size）
+    exclude: compile_exclude 生成的后缀正则（None 表示不过滤）
+    local_index: scan_local 预建的本地索引，提供时用字典查找代替逐个 stat
+    配额一旦放不下某个对象即进入 cap_full 状态：之后比剩余配额大的对象直接跳过（不再 stat、不记 already_present）；
+    stop_at_cap=True 时累计跳过 CAP_SKIP_LIMIT 个对象后直接停止列举
+    """
+    total = 0
+    cap_full = False
+    skipped_for_cap = 0
     for page in pages:
-        for obj in page.get("Contents", []) or []:
-            key = obj["Key"]
+        contents = page.get("Contents", []) or []
+        # 后缀过滤按页批量完成；正则在 C 层忽略大小写，不再为每个 key 生成小写副本
+        if exclude is not None:
+            contents = [obj for obj in contents if not exclude.search(obj["Key"])]
+        for obj in contents:
             size = int(obj["Size"])
-            etag = (obj.get("ETag") or "").strip('"')
-            last_modified = obj.get("LastModified")  # datetime or None
- 
-            # 后缀过滤
-            if key.lower().endswith(exclude):
+            if cap_full and size > cap_bytes - total:
+                skipped_for_cap += 1
+                if stop_at_cap and skipped_for_cap >= CAP_SKIP_LIMIT:
+                    return  # 尾部基本都放不下了，不再继续列举
                 continue
+            key = obj["Key"]
+            etag = (obj.get("ETag") or "").strip('"')
+            last_modified = _iso(obj.get("LastModified"))  # datetime or None -> ISO 字符串（只格式化一次）
 
             # 如果本地已存在且大小一致，就不占配额，直接标记为 already_present
-            rel = key[len(args.prefix):].lstrip("/") if args.prefix else key
-            local = os.path.join(args.out, rel)
-            if os.path.exists(local) and os.path.getsize(local) == size:
-                selected.append((key, size, etag, last_modified, local, "already_present"))
+            rel = key[len(prefix):].lstrip("/") if prefix else key
+            local = os.path.join(out, rel)
+            local_size = local_index.get(rel, -1) if local_index is not None else _local_size(local)
+            if verify == "none" and local_size >= 0:
+                yield (key, size, etag, last_modified, local, "already_present")
+                continue
+            if local_size == size:
+                if verify == "etag" and etag and "-" not in etag:
+                    yield (key, size, etag, last_modified, local, "to_verify")
+                else:
+                    yield (key, size, etag, last_modified, local, "already_present")
                 continue
 
-            # 需要下载的才累计配额
+            # 需要下载的才累计配额，超出配额的跳过
             if total + size <= cap_bytes:
-                selected.append((key, size, etag, last_modified, local, "to_download"))
                 total += size
+                yield (key, size, etag, last_modified, local, "to_download")
+                if total >= cap_bytes:
+                    return  # 配额已满，后续对象不可能再被选中
             else:
-                # 超出配额的跳过
-                continue
-
-    # 汇总与展示
-    to_dl = [x for x in selected if x[5] == "to_download"]
-    already = [x for x in selected if x[5] == "already_present"]
-    print(f"将下载文件数: {len(to_dl)}, 预计总量: {human(sum(x[1] for x in to_dl))}（上限 {args.cap_gb} GB）")
-    print(f"已存在且跳过: {len(already)}")
-    if args.dryrun:
-        # 只展示前 20 条
-        for t in to_dl[:20]:
-            print(" -", t[0], "->", human(t[1]))
-        if len(to_dl) > 20:
-            print(f"... 其余 {len(to_dl)-20} 个省略")
-        return
+                cap_full = True
+                skipped_for_cap += 1
 
-    # CSV 头（覆盖/追加）
-    if args.csv and not args.append and os.path.exists(args.csv):
-        os.remove(args.csv)
-    write_csv_header_if_needed(args.csv)
+def _commit_part(part: str, local: str, do_fsync: bool = True):
+    """.part 文件落盘（可选 fsync）后原子重命名为最终文件，崩溃时不会留下大小碰巧一致的残缺文件"""
+    if do_fsync:
+        fd = os.open(part, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    os.replace(part, local)
 
-    now_iso = datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
+def _discard_part(part: str):
+    """失败时删除残留的 .part 文件，不存在则忽略"""
+    try:
+        os.remove(part)
+    except OSError:
+        pass
 
-    # 先把 already_present 也记到 CSV（方便合并统计）
-    for key, size, etag, lm, local, status in already:
-        append_csv_row(args.csv, [
-            now_iso, args.bucket, key, size, human(size),
-            etag, (lm.isoformat() if hasattr(lm, "isoformat") else ""),
-            os.path.abspath(local), "already_present"
-        ])
+def _download_one(tm, bucket: str, key: str, local: str, size: int, verify_etag: str = None,
+                  do_fsync: bool = True):
+    """
+    带重试的单文件下载（在线程池中执行），目标目录需已创建
+    tm 为整个运行共享的 TransferManager，避免每次 download_file 都新建/销毁一个
+    先下载到 local + ".part"，完成后经 _commit_part 原子替换；重试用尽时删除残留的 .part
+    传入 verify_etag 时先校验本地文件 MD5，一致则不下载
+    返回 "downloaded" / "already_present"，失败返回 None
+    """
+    if verify_etag and _md5_matches(local, verify_etag):
+        return "already_present"
+    for attempt in range(MAX_DOWNLOAD_RETRIES):
+        try:
+            part = local + ".part"
+            tm.download(bucket, key, part).result()
+            _commit_part(part, local, do_fsync)
+            return "downloaded"
+        except Exception as e:
+            if attempt < MAX_DOWNLOAD_RETRIES - 1:
+                print(f"  {key} 下载失败 (尝试 {attempt+1}/{MAX_DOWNLOAD_RETRIES}): {e}")
+                print(f"  {RETRY_DELAY}秒后重试...")
+                time.sleep(RETRY_DELAY)
+            else:
+                print(f"  {key} 下载失败，已跳过: {e}")
+                _discard_part(part)
+    return None
 
-    # 正式下载 & 记录 CSV
-    for i, (key, size, etag, lm, local, status) in enumerate(to_dl):
-        ensure_dir(local)
-        print(f"[{i+1}/{len(to_dl)}] Downloading: {key} -> {local} ({human(size)})")
-        
-        # 带重试的下载
+async def _download_one_async(s3, sem: asyncio.Semaphore, bucket: str, key: str, local: str,
+                              verify_etag: str = None, do_fsync: bool = True):
+    """_download_one 的异步版本，由 Semaphore 控制在途请求数"""
+    async with sem:
+        if verify_etag and await asyncio.to_thread(_md5_matches, local, verify_etag):
+            return "already_present"
         for attempt in range(MAX_DOWNLOAD_RETRIES):
             try:
-                s3.download_file(args.bucket, key, local)
-                break  # 成功则跳出重试循环
+                part = local + ".part"
+                await s3.download_file(bucket, key, part)
+                await asyncio.to_thread(_commit_part, part, local, do_fsync)
+                return "downloaded"
             except Exception as e:
                 if attempt < MAX_DOWNLOAD_RETRIES - 1:
-                    print(f"  下载失败 (尝试 {attempt+1}/{MAX_DOWNLOAD_RETRIES}): {e}")
+                    print(f"  {key} 下载失败 (尝试 {attempt+1}/{MAX_DOWNLOAD_RETRIES}): {e}")
                     print(f"  {RETRY_DELAY}秒后重试...")
-                    time.sleep(RETRY_DELAY)
+                    await asyncio.sleep(RETRY_DELAY)
                 else:
-                    print(f"  下载失败，已跳过: {e}")
-                    continue  # 跳过这个文件
+                    print(f"  {key} 下载失败，已跳过: {e}")
+                    await asyncio.to_thread(_discard_part, part)
+    return None
+
+async def _run_async(args, selected, workers: int, log_row, now_iso: str):
+    """
+    异步模式：单个事件循环上并发数千个 GET，适合海量小文件
+    选文件仍复用同步的 iter_selected，但列举（阻塞的 list_objects_v2）和建目录都经 asyncio.to_thread
+    按批在线程里完成，事件循环在等待下一批时继续推进在途下载；CSV 行经 asyncio.Queue 交给单个写入任务
+    """
+    queue = asyncio.Queue()
+    sem = asyncio.Semaphore(workers)
+    pending = set()
+    made_dirs = set()
+    dl_cnt, already_cnt, fail_cnt = 0, 0, 0
+    selected = iter(selected)
+
+    def next_batch():
+        """在工作线程中取下一批待处理项（可能触发列举下一页），并预先建好目标目录"""
+        batch = list(itertools.islice(selected, ASYNC_SELECT_BATCH))
+        for key, size, etag, lm, local, status in batch:
+            if status != "already_present":
+                d = os.path.dirname(local)
+                if d and d not in made_dirs:
+                    os.makedirs(d, exist_ok=True)
+                    made_dirs.add(d)
+        return batch
+
+    async def csv_writer():
+        while True:
+            row = await queue.get()
+            if row is None:
+                break
+            log_row(row)
+
+    async def one(key, size, etag, lm, local, status):
+        nonlocal dl_cnt, already_cnt, fail_cnt
+        if status == "already_present":
+            result = status
+        else:
+            verify_etag = etag if status == "to_verify" else None
+            result = await _download_one_async(s3, sem, args.bucket, key, local, verify_etag, not args.no_fsync)
+        if result is None:
+            fail_cnt += 1
+            return
+        if result == "downloaded":
+            dl_cnt += 1
+            print(f"[{dl_cnt}] Downloaded: {key} -> {local} ({human(size)})")
         else:
-            continue  # 所有重试都失败，跳过记录CSV
-            
-        append_csv_row(args.csv, [
+            already_cnt += 1
+            if not args.log_skipped:
+                return
+        await queue.put([
             now_iso, args.bucket, key, size, human(size),
-            etag, (lm.isoformat() if hasattr(lm, "isoformat") else ""),
-            os.path.abspath(local), "downloaded"
+            etag, lm,
+            os.path.abspath(local), result
         ])
 
+    # max_pool_connections 即 aiohttp connector 的 limit，所有请求复用同一组 TCP 连接
+    config = S3_CONFIG.merge(Config(max_pool_connections=workers))
+    async with aioboto3.Session().client("s3", config=config, region_name=args.region) as s3:
+        writer_task = asyncio.create_task(csv_writer())
+        while True:
+            batch = await asyncio.to_thread(next_batch)
+            if not batch:
+                break
+            for key, size, etag, lm, local, status in batch:
+                task = asyncio.create_task(one(key, size, etag, lm, local, status))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+                # 在途任务过多时让出事件循环，避免一次性为百万对象创建任务
+                if len(pending) >= workers * 4:
+                    await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        if pending:
+            await asyncio.gather(*pending)
+        await queue.put(None)
+        await writer_task
+
+    print(f"完成: 下载 {dl_cnt} 文件, 已存在 {already_cnt}, 失败 {fail_cnt}")
+
+def main():
+    ap = argparse.ArgumentParser("Download from S3 with total-size cap, export CSV for downloaded files")
+    ap.add_argument("--bucket", default="umbra-open-data-catalog")
+    ap.add_argument("--prefix", default="sar-data/tasks")
+    ap.add_argument("--region", default="us-west-2")
+    ap.add_argument("--out", default="/home/hjl/data/umbra/tasks")  # Linux路径
+    ap.add_argument("--cap-gb", type=float, default=100000.0, help="max total GB to fetch this run")
+    ap.add_argument("--exclude-ext", default="", help="comma sep, e.g. .json,.xml")
+    ap.add_argument("--dryrun", action="store_true")
+    ap.add_argument("--csv", help="CSV path to log files downloaded in THIS RUN")
+    ap.add_argument("--append", action="store_true", help="append to CSV if exists (default overwrite)")
+    ap.add_argument("--workers", type=int, default=16, help="concurrent download threads")
+    ap.add_argument("--multipart-chunksize-mb", type=int, default=16, help="byte-range part size for large files")
+    ap.add_argument("--part-concurrency", type=int, default=16, help="parallel range GETs per large file")
+    ap.add_argument("--verify", choices=["none", "size", "etag"], default="size",
+                    help="skip criterion for existing local files (etag: compare MD5 for single-part objects)")
+    ap.add_argument("--prebuild-index", action="store_true",
+                    help="scan --out once with os.scandir and check existing files via an in-memory index")
+    ap.add_argument("--no-fsync", action="store_true",
+                    help="skip fsync before renaming .part files (faster, less crash-safe)")
+    ap.add_argument("--list-workers", type=int, default=0,
+                    help="list first-level sub-prefixes in parallel with N threads (0 = serial listing in key order)")
+    ap.add_argument("--stop-at-cap", action="store_true",
+                    help=f"stop listing after {CAP_SKIP_LIMIT} objects are skipped for exceeding the cap")
+    ap.add_argument("--log-skipped", action="store_true",
+                    help="also log already_present files to the CSV")
+    ap.add_argument("--async", dest="use_async", action="store_true",
+                    help="use aioboto3/asyncio instead of threads (many small files); --workers sets in-flight GETs")
+    args = ap.parse_args()
+
+    if args.use_async and not HAS_AIOBOTO3:
+        print("警告: 未安装 aioboto3，--async 不可用，改用线程池下载")
+        args.use_async = False
+
+    exclude = compile_exclude(args.exclude_ext)
+    cap_bytes = int(args.cap_gb * 1024**3)
+
+    workers = max(1, args.workers)
+    part_concurrency = max(1, args.part_concurrency)
+    # 大文件拆成多个 Range 请求并行下载
+    # 所有文件共用一个 TransferManager，其线程池即全局的分段请求池，按 文件并发 × 分段并发 设定
+    transfer_cfg = TransferConfig(
+        multipart_threshold=MULTIPART_THRESHOLD,
+        multipart_chunksize=args.multipart_chunksize_mb * 1024 * 1024,
+        max_concurrency=workers * part_concurrency,
+        use_threads=True
+    )
+    # 连接池覆盖 文件并发 × 分段并发，避免 "Connection pool is full" 警告
+    s3 = boto3.client("s3", config=S3_CONFIG.merge(Config(max_pool_connections=workers * part_concurrency)),
+                      region_name=args.region)
+    if args.list_workers > 0:
+        pages = iter_pages_parallel(s3, args.bucket, args.prefix, args.list_workers)
+    else:
+        pages = iter_pages(s3, args.bucket, args.prefix)
+    local_index = None
+    if args.prebuild_index:
+        print("正在建立本地文件索引...")
+        local_index = scan_local(args.out)
+        print(f"本地已有文件: {len(local_index)}")
+    selected = iter_selected(pages, args.prefix, args.out, exclude, cap_bytes, args.verify, local_index,
+                             args.stop_at_cap)
+
+    if args.dryrun:
+        # 只展示前 20 条
+        dl_cnt, dl_size, already_cnt, verify_cnt = 0, 0, 0, 0
+        for key, size, etag, lm, local, status in selected:
+            if status == "already_present":
+                already_cnt += 1
+                continue
+            if status == "to_verify":
+                verify_cnt += 1
+                continue
+            if dl_cnt < 20:
+                print(" -", key, "->", human(size))
+            dl_cnt += 1
+            dl_size += size
+        if dl_cnt > 20:
+            print(f"... 其余 {dl_cnt-20} 个省略")
+        print(f"将下载文件数: {dl_cnt}, 预计总量: {human(dl_size)}（上限 {args.cap_gb} GB）")
+        print(f"已存在且跳过: {already_cnt}")
+        if verify_cnt:
+            print(f"待 ETag 校验: {verify_cnt}")
+        return
+
+    now_iso = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    # CSV 头（覆盖/追加）；整个运行期间只打开一次 CSV，依赖缓冲 I/O 合并写入
+    csv_fh = open_csv_with_header(args.csv, args.append)
+    csv_w = csv.writer(csv_fh) if csv_fh else None
+    # 单独的写入线程负责格式化与写盘，主线程（列举 + 提交）只需 put 一行即可
+    csv_q = queue.Queue(maxsize=10000)
+
+    def csv_writer():
+        rows = 0
+        while True:
+            row = csv_q.get()
+            if row is None:
+                break
+            csv_w.writerow(row)
+            rows += 1
+            if rows % CSV_FLUSH_EVERY == 0:
+                csv_fh.flush()
+
+    writer = None
+    if csv_w is not None:
+        writer = threading.Thread(target=csv_writer, name="csv-writer", daemon=True)
+        writer.start()
+
+    def log_row(row: list):
+        if writer is not None:
+            csv_q.put(row)
+
+    try:
+        if args.use_async:
+            asyncio.run(_run_async(args, selected, workers, log_row, now_iso))
+            return
+
+        # 列举与下载流水线：每选中一个文件立即提交到线程池，列举的 RTT 与下载重叠
+        # CSV 行交给写入线程，主线程不做磁盘 I/O
+        made_dirs = set()  # 每个唯一目录只 makedirs 一次（也避免多线程争抢同一父目录）
+        futures = {}  # 只保存在途任务，完成即弹出，内存占用与 workers 而非对象总数成正比
+        submitted, done = 0, 0
+        dl_size, already_cnt, verify_cnt = 0, 0, 0
+
+        def finish(fut):
+            nonlocal done
+            key, size, etag, lm, local = futures.pop(fut)
+            done += 1
+            result = fut.result()
+            if result is None:
+                return  # 所有重试都失败，跳过记录CSV
+            if result == "already_present" and not args.log_skipped:
+                return
+            if result == "downloaded":
+                print(f"[{done}/{submitted}] Downloaded: {key} -> {local} ({human(size)})")
+            log_row([
+                now_iso, args.bucket, key, size, human(size),
+                etag, lm,
+                os.path.abspath(local), result
+            ])
+
+        with create_transfer_manager(s3, transfer_cfg) as tm, ThreadPoolExecutor(max_workers=workers) as ex:
+            for key, size, etag, lm, local, status in selected:
+                if status == "already_present":
+                    # already_present 默认不记 CSV；--log-skipped 时也记（方便合并统计），写盘由写入线程完成
+                    already_cnt += 1
+                    if args.log_skipped:
+                        log_row([
+                            now_iso, args.bucket, key, size, human(size),
+                            etag, lm,
+                            os.path.abspath(local), "already_present"
+                        ])
+                    continue
+                d = os.path.dirname(local)
+                if d and d not in made_dirs:
+                    os.makedirs(d, exist_ok=True)
+                    made_dirs.add(d)
+                # to_verify 的文件在下载线程里先做 MD5 校验，与其他下载重叠
+                verify_etag = etag if status == "to_verify" else None
+                fut = ex.submit(_download_one, tm, args.bucket, key, local, size, verify_etag,
+                                not args.no_fsync)
+                futures[fut] = (key, size, etag, lm, local)
+                submitted += 1
+                if status == "to_download":
+                    dl_size += size
+                else:
+                    verify_cnt += 1
+                # 在途任务过多时先处理已完成的，避免为全部对象积压 future
+                if len(futures) >= workers * 4:
+                    finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for f in finished:
+                        finish(f)
+
+            print(f"将下载文件数: {submitted - verify_cnt}, 预计总量: {human(dl_size)}（上限 {args.cap_gb} GB）")
+            print(f"已存在且跳过: {already_cnt}")
+            if verify_cnt:
+                print(f"待 ETag 校验: {verify_cnt}（不一致的将重新下载）")
+
+            for fut in as_completed(list(futures)):
+                finish(fut)
+    finally:
+        if writer is not None:
+            csv_q.put(None)
+            writer.join()
+        if csv_fh:
+            csv_fh.close()
+
 if __name__ == "__main__":
     main()
@@ -1,19 +1,35 @@
-import os, argparse, csv, datetime, time, signal, sys, threading, socket, shutil, hashlib, json, fcntl
-from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
-from pathlib import Path
+import os, argparse, csv, datetime, time, signal, sys, threading, socket, shutil, hashlib, struct, fcntl, re, errno, gzip, json
+import asyncio, queue
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from typing import Optional, Tuple, Dict
-from collections import defaultdict
+from collections import deque
+from functools import lru_cache
+from contextlib import nullcontext
 import boto3
 from botocore import UNSIGNED
 from botocore.config import Config
+from boto3.s3.transfer import TransferConfig, ProgressCallbackInvoker, create_transfer_manager
+from s3transfer.utils import S3_RETRYABLE_DOWNLOAD_ERRORS
 from botocore.exceptions import ClientError, BotoCoreError, EndpointConnectionError, ConnectionError as BotoConnectionError
 
+# 可选依赖：--async-list 需要 aioboto3
+try:
+    import aioboto3
+    HAS_AIOBOTO3 = True
+except ImportError:
+    HAS_AIOBOTO3 = False
+
 # 配置超时和重试
+# 连接超时取短值：死连接尽快失败重试，而不是白等 15 秒
+# 请求阶段的瞬时错误和 503 SlowDown 交给 SDK 的 adaptive 模式：按实际限流情况自动降速重试
+# SDK 的重试只覆盖请求本身，收到响应后读 StreamingBody 时的中断（读超时、连接断开）不在其内，
+# 由 ranged_download 的分段就地重试和外层重试循环处理（见 STREAM_RETRYABLE_EXC_TYPES）
 S3_CONFIG = Config(
     signature_version=UNSIGNED,
-    connect_timeout=15,
-    read_timeout=60,
-    retries={'max_attempts': 2, 'mode': 'adaptive'}
+    connect_timeout=3,
+    read_timeout=30,
+    tcp_keepalive=True,  # 长时间复用的连接开启 keepalive，避免被中间设备静默断开
+    retries={'max_attempts': 10, 'mode': 'adaptive'}
 )
 
 # 重试配置
@@ -22,51 +38,124 @@ MAX_FILE_RETRIES = 3  # 文件错误（如404）只重试3次
 MAX_RETRY_TIME = 48 * 3600  # 单文件最大重试时间：48小时
 RETRY_DELAYS = [5, 10, 30, 60, 300]  # 指数退避：5s, 10s, 30s, 1min, 5min（之后保持5min）
 CSV_BATCH_SIZE = 50
+CSV_FSYNC_EVERY = 10  # CSVBatchWriter 每刷新多少次做一次 fsync
 DOWNLOAD_TIMEOUT = 600  # 单文件下载超时（秒）
 PROGRESS_THRESHOLD = 10 * 1024 * 1024  # 大于10MB的文件显示进度
 RESUME_THRESHOLD = 5 * 1024 * 1024  # 大于5MB的文件支持断点续传
 TEMP_FILE_CLEANUP_AGE = 48 * 3600  # 临时文件清理时间：48小时
 MIN_DISK_SPACE_GB = 10  # 最小磁盘剩余空间（GB）
+# .meta 元数据格式：etag（分段上传的 ETag 带 "-N" 后缀，预留 64 字节）、总大小、已下载大小、时间戳
+META_ETAG_LEN = 64
+META_STRUCT = struct.Struct(f'<{META_ETAG_LEN}sQQd')
+CONNECTION_REAP_INTERVAL = 600  # 每隔多少秒回收一次连接池中的空闲连接（防止 CLOSE_WAIT 堆积）
+MULTIPART_THRESHOLD = 8 * 1024 * 1024  # 大于8MB的文件拆成多个 Range 请求并行下载
+MULTIPART_CHUNKSIZE = 16 * 1024 * 1024  # 每个 Range 请求的大小
+PART_CONCURRENCY = 8  # 单个文件同时进行的 Range 请求数
+PART_RETRIES = 3  # 单个分段的就地重试次数
+
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=MULTIPART_THRESHOLD,
+    multipart_chunksize=MULTIPART_CHUNKSIZE,
+    max_concurrency=PART_CONCURRENCY,
+    num_download_attempts=5,  # s3transfer 内部对读流中断的重试次数
+    use_threads=True
+)
+
+def make_transfer_manager(s3, workers: int):
+    """
+    所有文件共用一个 TransferManager：s3.download_file 每次调用都会新建一个带线程池的 TransferManager，
+    小文件多时这部分开销比下载本身还大；共用后其线程池按 文件并发 × 分段并发 设定
+    """
+    config = TransferConfig(
+        multipart_threshold=MULTIPART_THRESHOLD,
+        multipart_chunksize=MULTIPART_CHUNKSIZE,
+        max_concurrency=workers * PART_CONCURRENCY,
+        num_download_attempts=5,
+        use_threads=True
+    )
+    return create_transfer_manager(s3, config)
 
 # 全局变量用于优雅退出
-_shutdown_requested = False
+_shutdown_event = threading.Event()  # 收到退出信号后置位；等待中的线程立即被唤醒
 _csv_writer = None
+_s3_slots = nullcontext()  # 同时进行的 S3 请求上限；--max-inflight 指定时换成 BoundedSemaphore
+
+# 磁盘空间 / 网络连通性检查的短期缓存：{key: (monotonic 时间, ...)}
+DISK_CHECK_TTL = 1.0
+NETWORK_CHECK_TTL = 5.0
+UNSAFE_REL_RE = re.compile(r'(^|/)\.\.(/|$)')  # 路径中作为独立一段出现的 ".."（"a..b.tif" 之类的文件名不算）
+LIST_PREFETCH_PAGES = 4  # --async-list 时预取的页数
+LIST_CACHE_PAGE_SIZE = 1000  # 从列举缓存回放时每页的对象数（与 ListObjectsV2 一致）
+_disk_space_cache: Dict[str, tuple] = {}
+_network_check_cache: Dict[tuple, tuple] = {}
+
+SIGNAL_NAMES = {sig.value: sig.name for sig in signal.Signals}
 
 def signal_handler(signum, frame):
     """捕获信号，优雅退出"""
-    global _shutdown_requested
-    if _shutdown_requested:
+    if _shutdown_event.is_set():
         # 第二次信号强制退出
         print("\n强制退出...")
         if _csv_writer:
             try:
-                # 兼容两种类型的 writer
-                if hasattr(_csv_writer, 'write_csv'):
-                    _csv_writer.write_csv(force=True)
-                elif hasattr(_csv_writer, 'flush'):
-                    _csv_writer.flush()
+                # 两种 writer 都提供 close()：停止后台写入并把剩余数据落盘
+                _csv_writer.close()
             except Exception:
                 pass
         sys.exit(1)
-    sig_name = signal.Signals(signum).name if hasattr(signal, 'Signals') else str(signum)
+    sig_name = SIGNAL_NAMES.get(signum, str(signum))
     print(f"\n收到信号 {sig_name}，等待当前下载完成后退出（再按一次强制退出）...")
-    _shutdown_requested = True
+    _shutdown_event.set()
+
+HUMAN_UNITS = ("B", "KB", "MB", "GB", "TB")
 
+@lru_cache(maxsize=8192)  # 文件夹大小/文件大小高度重复，缓存格式化结果
 def human(n: int) -> str:
     if n < 0:
         return "0 B"
-    u = ["B","KB","MB","GB","TB"]; i=0; s=float(n)
-    while s>=1024 and i<len(u)-1: s/=1024; i+=1
-    return f"{s:.2f} {u[i]}"
+    n = int(n)
+    if n < 1024:
+        return f"{n:.2f} B"
+    # 1024 = 2^10，单位下标直接由二进制位数算出，不用循环做浮点除法
+    i = min((n.bit_length() - 1) // 10, len(HUMAN_UNITS) - 1)
+    return f"{n / (1 << (10 * i)):.2f} {HUMAN_UNITS[i]}"
+
+_created_dirs = set()  # 已确认存在的目录（含各级父目录）
+_created_dirs_lock = threading.Lock()
 
 def ensure_dir(p: str):
+    """确保 p 的父目录存在；同一目录下的大量文件只 makedirs 一次"""
     d = os.path.dirname(p)
-    if d:
+    if not d or d in _created_dirs:
+        return
+    try:
+        os.makedirs(d, exist_ok=True)
+    except OSError as e:
+        print(f"  创建目录失败 {d}: {e}")
+        raise
+    with _created_dirs_lock:
+        # 父目录也一并记下，兄弟目录创建时 makedirs 仍会自己检查，但同一目录不再重复调用
+        while d and d not in _created_dirs:
+            _created_dirs.add(d)
+            parent = os.path.dirname(d)
+            if parent == d:
+                break
+            d = parent
+
+def stat_or_none(path: str) -> Optional[os.stat_result]:
+    """一次 stat 同时得到"是否存在"和大小等信息，不存在返回 None"""
+    try:
+        return os.stat(path)
+    except FileNotFoundError:
+        return None
+
+def remove_quietly(*paths: str):
+    """删除文件，不存在或删除失败都忽略（不再先 exists 再 remove）"""
+    for path in paths:
         try:
-            os.makedirs(d, exist_ok=True)
-        except OSError as e:
-            print(f"  创建目录失败 {d}: {e}")
-            raise
+            os.remove(path)
+        except OSError:
+            pass
 
 def file_size_if_exists(path: str) -> int:
     """返回文件大小，不存在返回-1，其他错误返回-2"""
@@ -77,122 +166,370 @@ def file_size_if_exists(path: str) -> int:
     except OSError:
         return -2  # 权限问题等
 
-def is_network_error(e: Exception) -> bool:
-    """判断是否为网络错误（可重试）"""
+LOCAL_STAT_CACHE_NAME = ".local_stat.cache"
+# 上次运行保存的目录索引 {目录: (目录 mtime_ns, {文件名: (大小, mtime_ns)})}；只在 --local-stat-cache 时启用（否则为 None，不占内存）
+# 目录 mtime 不变说明没有增删文件，可省去 readdir；但原地改写文件不会改变目录 mtime，
+# 所以每个条目仍要 stat 一次，只信任大小和 mtime_ns 都与记录一致的条目
+_dir_size_cache: Optional[Dict[str, Tuple[int, dict]]] = None
+
+@lru_cache(maxsize=1024)
+def _dir_sizes(directory: str) -> dict:
+    """
+    用 os.scandir 读一次目录，返回 {文件名: 大小}；目录不存在返回空字典
+    S3 key 按字典序列举，同一目录下的文件基本连续出现，按目录缓存即可覆盖绝大多数查找
+    目录 mtime 与 _dir_size_cache 中记录的一致时不再读目录，只逐个核对记录过的条目（见 _verify_cached_entries）
+    """
+    cache = _dir_size_cache
+    mtime = None
+    if cache is not None:
+        try:
+            mtime = os.stat(directory).st_mtime_ns  # 先取 mtime 再扫描：扫描期间的改动会让下次校验失败
+        except OSError:
+            return {}
+        cached = cache.get(directory)
+        if cached is not None and cached[0] == mtime:
+            _created_dirs.add(directory)
+            return _verify_cached_entries(directory, cached[1])
+    sizes = {}
+    entries = {}
+    try:
+        with os.scandir(directory) as it:
+            for e in it:
+                try:
+                    if e.is_file():
+                        st = e.stat()
+                        sizes[e.name] = st.st_size
+                        if cache is not None:
+                            entries[e.name] = (st.st_size, st.st_mtime_ns)
+                except OSError:
+                    pass
+        # 能打开说明目录已存在，之后 ensure_dir 不必再 makedirs（set.add 本身是原子的）
+        _created_dirs.add(directory)
+    except OSError:
+        pass
+    if cache is not None:
+        cache[directory] = (mtime, entries)
+    return sizes
+
+def _verify_cached_entries(directory: str, entries: dict) -> dict:
+    """
+    逐个 stat 缓存中记录的文件，大小和 mtime_ns 与记录不一致（被原地改写）时以实际值为准并更新记录，
+    已消失的文件从记录中删除；返回 {文件名: 大小}
+    """
+    sizes = {}
+    for name, (size, mtime_ns) in list(entries.items()):
+        try:
+            st = os.stat(os.path.join(directory, name))
+        except OSError:
+            del entries[name]
+            continue
+        if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+            entries[name] = (st.st_size, st.st_mtime_ns)
+        sizes[name] = st.st_size
+    return sizes
+
+def load_local_stat_cache(out_dir: str):
+    """启用目录索引缓存并加载上次运行保存的内容；文件不存在或损坏时从空缓存开始"""
+    global _dir_size_cache
+    _dir_size_cache = {}
+    try:
+        with gzip.open(os.path.join(out_dir, LOCAL_STAT_CACHE_NAME), "rt", encoding="utf-8") as f:
+            for directory, (mtime, entries) in json.load(f).items():
+                _dir_size_cache[directory] = (mtime, {name: (size, mtime_ns)
+                                                      for name, (size, mtime_ns) in entries.items()})
+    except (OSError, ValueError, TypeError, AttributeError):
+        _dir_size_cache.clear()  # 旧格式或损坏的缓存整体丢弃，不部分信任
+
+def save_local_stat_cache(out_dir: str):
+    """把目录索引写到临时文件再原子替换，中途中断不会留下半个缓存"""
+    path = os.path.join(out_dir, LOCAL_STAT_CACHE_NAME)
+    tmp = path + ".tmp"
+    try:
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            json.dump(dict(_dir_size_cache), f)
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"警告: 保存本地索引缓存失败: {e}")
+        remove_quietly(tmp)
+
+def local_size(path: str) -> int:
+    """按目录批量查本地文件大小（见 _dir_sizes），不存在返回-1；用于列举时判断是否已下载"""
+    directory, name = os.path.split(path)
+    return _dir_sizes(directory).get(name, -1)
+
+# keepalive 探测参数（仅 Linux 提供这些常量）：空闲 60 秒开始探测，每 10 秒一次，3 次无响应判定断开
+TCP_KEEPALIVE_OPTS = (('TCP_KEEPIDLE', 60), ('TCP_KEEPINTVL', 10), ('TCP_KEEPCNT', 3))
+
+def _tune_socket_options(s3):
+    """
+    在 botocore 已有的 TCP_NODELAY / SO_KEEPALIVE 之外补上 keepalive 探测参数
+    socket_options 列表在连接池创建时按引用传入，必须在第一个请求之前修改
+    """
+    try:
+        opts = s3._endpoint.http_session._socket_options
+    except AttributeError:
+        return
+    if (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) not in opts:
+        opts.append((socket.IPPROTO_TCP, socket.TCP_NODELAY, 1))
+    for name, value in TCP_KEEPALIVE_OPTS:
+        opt = getattr(socket, name, None)
+        if opt is not None:
+            opts.append((socket.IPPROTO_TCP, opt, value))
+
+def make_s3_client(region: str, workers: int, max_inflight: int = 0):
+    """
+    创建 S3 客户端（boto3 客户端线程安全，整个进程只建一个，所有下载线程共用），连接池大小与并发数保持一致
+    每个下载线程最多同时发 PART_CONCURRENCY 个分段请求；池子小于实际并发时，多出来的请求用完即关，
+    下次又要重新握手（TLS + 慢启动），所以按 文件并发 × 分段并发 设定（--max-inflight 限制了总数时按它来）
+    """
+    peak = workers * PART_CONCURRENCY
+    if max_inflight > 0:
+        peak = min(peak, max_inflight)
+    config = S3_CONFIG.merge(Config(max_pool_connections=max(64, peak)))
+    s3 = boto3.client("s3", config=config, region_name=region)
+    _tune_socket_options(s3)
+    return s3
+
+def reap_idle_connections(s3):
+    """关闭连接池中的所有连接，后续请求会自动重建；用于清理长时间运行后残留的 CLOSE_WAIT 连接"""
+    try:
+        s3._endpoint.http_session.close()
+    except AttributeError:
+        pass
+
+class PartLengthMismatch(Exception):
+    """Range 响应体提前结束，收到的字节数少于请求的分段长度"""
+
+# is_network_error 用到的常量：模块加载时构建一次
+# 读响应体过程中的中断（读超时、连接断开、响应体不完整）：SDK 的重试只覆盖请求本身，不覆盖读 StreamingBody，
+# 需要由调用方重试；与 s3transfer 内部重试的异常集合一致，再加上分段长度不匹配
+STREAM_RETRYABLE_EXC_TYPES = (*S3_RETRYABLE_DOWNLOAD_ERRORS, PartLengthMismatch)
+
+NETWORK_EXC_TYPES = (EndpointConnectionError, BotoConnectionError, socket.timeout, socket.gaierror,
+                     TimeoutError, ConnectionError)
+# 网络相关的 errno（用 errno 模块的符号常量，不依赖 Linux 的具体数值）
+NETWORK_ERRNOS = frozenset({errno.ECONNREFUSED, errno.ETIMEDOUT, errno.ENETUNREACH, errno.EHOSTUNREACH,
+                            errno.ECONNRESET, errno.EPIPE})
+# 明确的网络/服务器错误
+NETWORK_ERROR_CODES = frozenset({'RequestTimeout', 'ServiceUnavailable', 'SlowDown', 'InternalError',
+                                 'RequestTimeTooSkewed', 'OperationAborted'})
+# 404, 403 等是文件错误，不是网络错误
+FILE_ERROR_CODES = frozenset({'NoSuchKey', 'AccessDenied', 'InvalidObjectState', 'NoSuchBucket'})
+# 更严格的关键词匹配，避免误判文件名
+NETWORK_KEYWORDS_RE = re.compile('|'.join(map(re.escape, (
+    'timed out', 'connection refused', 'connection reset',
+    'network unreachable', 'host unreachable', 'connection aborted',
+    'connection error', 'socket error'))), re.IGNORECASE)
+
+def _net_by_errno(e: Exception) -> bool:
+    # OSError（含 socket.timeout、ConnectionError 等子类）需要进一步检查 errno
+    return getattr(e, 'errno', None) in NETWORK_ERRNOS
+
+def _net_always(e: Exception) -> bool:
     # 明确的网络错误类型
-    if isinstance(e, (EndpointConnectionError, BotoConnectionError, socket.timeout, socket.gaierror, 
-                      TimeoutError, FuturesTimeoutError, ConnectionError, OSError)):
-        # OSError 需要进一步检查 errno
-        if isinstance(e, OSError):
-            # 网络相关的 errno: ECONNREFUSED(111), ETIMEDOUT(110), ENETUNREACH(101), etc.
-            if hasattr(e, 'errno') and e.errno in [110, 111, 101, 113]:
-                return True
-            return False
-        return True
-    
-    if isinstance(e, ClientError):
-        error_code = e.response.get('Error', {}).get('Code', '')
-        # 明确的网络/服务器错误
-        if error_code in ['RequestTimeout', 'ServiceUnavailable', 'SlowDown', 'InternalError', 
-                          'RequestTimeTooSkewed', 'OperationAborted']:
-            return True
-        # 404, 403 等是文件错误，不是网络错误
-        if error_code in ['NoSuchKey', 'AccessDenied', 'InvalidObjectState', 'NoSuchBucket']:
-            return False
-        status_code = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
-        if status_code >= 500:  # 5xx 服务器错误
-            return True
-        if status_code == 429:  # 限流
-            return True
-    
+    return True
+
+def _net_by_message(e: Exception) -> bool:
     # 最后才检查异常消息（避免误判）
-    err_msg = str(e).lower()
-    # 更严格的关键词匹配，避免误判文件名
-    network_keywords = ['timed out', 'connection refused', 'connection reset', 
-                       'network unreachable', 'host unreachable', 'connection aborted',
-                       'connection error', 'socket error']
-    if any(kw in err_msg for kw in network_keywords):
+    return NETWORK_KEYWORDS_RE.search(str(e)) is not None
+
+def _net_by_client_error(e: ClientError) -> bool:
+    resp = getattr(e, 'response', None) or {}
+    error_code = (resp.get('Error') or {}).get('Code', '')
+    if error_code in NETWORK_ERROR_CODES:
         return True
-    
-    return False
+    if error_code in FILE_ERROR_CODES:
+        return False
+    status_code = (resp.get('ResponseMetadata') or {}).get('HTTPStatusCode', 0)
+    if status_code >= 500 or status_code == 429:  # 5xx 服务器错误 / 限流
+        return True
+    return _net_by_message(e)
+
+def _resolve_network_handler(tp: type):
+    """按异常类型选出判定函数（判断顺序与原来的 isinstance 链一致）"""
+    # 读流中断必须排在 OSError 之前：ReadTimeoutError 等同时是 OSError 子类，但 errno 为 None
+    if issubclass(tp, STREAM_RETRYABLE_EXC_TYPES):
+        return _net_always
+    if issubclass(tp, OSError):
+        return _net_by_errno
+    if issubclass(tp, NETWORK_EXC_TYPES):
+        return _net_always
+    if issubclass(tp, ClientError):
+        return _net_by_client_error
+    return _net_by_message
+
+# type(e) -> 判定函数；常见类型预先填好，其他类型第一次出现时解析一次后缓存
+_NETWORK_HANDLERS = {tp: _resolve_network_handler(tp)
+                     for tp in (*STREAM_RETRYABLE_EXC_TYPES, *NETWORK_EXC_TYPES, OSError, ClientError)}
+
+def is_network_error(e: Exception) -> bool:
+    """判断是否为网络错误（可重试）；按 type(e) 查表分派，不再逐个 isinstance"""
+    tp = type(e)
+    handler = _NETWORK_HANDLERS.get(tp)
+    if handler is None:
+        handler = _NETWORK_HANDLERS[tp] = _resolve_network_handler(tp)
+    return handler(e)
 
 def check_network_connectivity(host: str = "s3.amazonaws.com", port: int = 443, timeout: int = 5) -> bool:
-    """检查网络连接"""
+    """检查网络连接；结果缓存 NETWORK_CHECK_TTL 秒，大量线程同时失败时不会反复发起 TCP 连接"""
+    now = time.monotonic()
+    cached = _network_check_cache.get((host, port))
+    if cached is not None and now - cached[0] < NETWORK_CHECK_TTL:
+        return cached[1]
     try:
         socket.create_connection((host, port), timeout=timeout).close()
-        return True
+        ok = True
     except (socket.timeout, socket.error):
-        return False
+        ok = False
+    _network_check_cache[(host, port)] = (time.monotonic(), ok)
+    return ok
 
-def cleanup_temp_files(output_dir: str) -> int:
-    """清理历史临时文件，返回清理数量"""
+def _cleanup_tree(root: str, now: float) -> int:
+    """
+    用 os.scandir 遍历 root 子树，删除过期的临时文件；DirEntry 自带类型信息，mtime 只 stat 一次
+    每个目录只打开一次目录 fd，stat/unlink 都相对该 fd 进行（fstatat/unlinkat），不再逐个解析完整路径
+    """
     count = 0
-    try:
-        for root, dirs, files in os.walk(output_dir):
-            for f in files:
-                if f.endswith('.tmp') or f.endswith('.tmp.meta'):
-                    tmp_path = os.path.join(root, f)
+    stack = [root]
+    while stack:
+        dirpath = stack.pop()
+        try:
+            dfd = os.open(dirpath, os.O_RDONLY | os.O_DIRECTORY)
+        except OSError:
+            continue
+        try:
+            with os.scandir(dfd) as it:
+                for entry in it:
                     try:
-                        # 检查文件修改时间，超过48小时的才删除
-                        if time.time() - os.path.getmtime(tmp_path) > TEMP_FILE_CLEANUP_AGE:
-                            # 检查是否有文件锁
-                            if not is_file_locked(tmp_path):
-                                os.remove(tmp_path)
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(os.path.join(dirpath, entry.name))
+                            continue
+                        name = entry.name
+                        if name.endswith('.lock'):
+                            if now - entry.stat(follow_symlinks=False).st_mtime > TEMP_FILE_CLEANUP_AGE \
+                                    and remove_stale_lock(os.path.join(dirpath, name)):
                                 count += 1
+                            continue
+                        if not (name.endswith('.tmp') or name.endswith('.tmp.meta')):
+                            continue
+                        # 检查文件修改时间，超过48小时的才删除；再检查是否有文件锁
+                        if now - entry.stat(follow_symlinks=False).st_mtime > TEMP_FILE_CLEANUP_AGE \
+                                and not is_file_locked(os.path.join(dirpath, name)):
+                            os.unlink(name, dir_fd=dfd)
+                            count += 1
                     except OSError:
                         pass
-    except OSError:
-        pass
+        except OSError:
+            pass
+        finally:
+            os.close(dfd)
     return count
 
-def is_file_locked(filepath: str) -> bool:
-    """检查文件是否被锁定（正在使用）"""
-    lock_file = filepath + '.lock'
+def cleanup_temp_files(output_dir: str) -> int:
+    """清理历史临时文件，返回清理数量；各顶层子目录相互独立，用小线程池并行扫描"""
+    now = time.time()
+    count = 0
+    subdirs = []
     try:
-        # 检查锁文件是否存在且新鲜（5分钟内）
-        if os.path.exists(lock_file):
-            if time.time() - os.path.getmtime(lock_file) < 300:
-                return True
-            else:
-                # 过期的锁文件，删除
+        with os.scandir(output_dir) as it:
+            for entry in it:
                 try:
-                    os.remove(lock_file)
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.name.endswith('.lock'):
+                        if now - entry.stat(follow_symlinks=False).st_mtime > TEMP_FILE_CLEANUP_AGE \
+                                and remove_stale_lock(entry.path):
+                            count += 1
+                    elif (entry.name.endswith('.tmp') or entry.name.endswith('.tmp.meta')) \
+                            and now - entry.stat(follow_symlinks=False).st_mtime > TEMP_FILE_CLEANUP_AGE \
+                            and not is_file_locked(entry.path):
+                        os.remove(entry.path)
+                        count += 1
                 except OSError:
                     pass
-        return False
     except OSError:
-        return False
+        return count
+    if subdirs:
+        with ThreadPoolExecutor(max_workers=min(4, len(subdirs))) as ex:
+            count += sum(ex.map(lambda d: _cleanup_tree(d, now), subdirs))
+    return count
 
-def create_file_lock(filepath: str) -> bool:
-    """创建文件锁，返回是否成功"""
-    lock_file = filepath + '.lock'
+def is_file_locked(filepath: str) -> bool:
+    """检查文件是否被锁定（正在被某个进程下载）：试着对锁文件加 flock，加不上即被占用"""
     try:
-        # 使用 O_CREAT | O_EXCL 原子性创建
-        fd = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
-        os.write(fd, str(os.getpid()).encode())
-        os.close(fd)
+        fd = os.open(filepath + '.lock', os.O_RDONLY)
+    except OSError:
+        return False  # 没有锁文件
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return False
+    except OSError:
         return True
-    except FileExistsError:
+    finally:
+        os.close(fd)
+
+def remove_stale_lock(lock_file: str) -> bool:
+    """
+    删除崩溃遗留的锁文件：能加上 flock 说明没有进程持有，持锁期间删除后再关闭 fd
+    与 acquire_file_lock 的 inode 校验配合，正在抢锁的进程会发现锁文件已被换掉并重试
+    """
+    try:
+        fd = os.open(lock_file, os.O_RDONLY)
+    except OSError:
         return False
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        os.remove(lock_file)
+        return True
     except OSError:
         return False
+    finally:
+        os.close(fd)
 
-def remove_file_lock(filepath: str):
-    """删除文件锁"""
+def acquire_file_lock(filepath: str) -> Optional[int]:
+    """
+    对 filepath + '.lock' 加 fcntl.flock 独占锁，成功返回持有锁的 fd，已被占用返回 None
+    锁由内核维护，进程退出（包括崩溃）时自动释放，不需要过期时间
+    """
     lock_file = filepath + '.lock'
-    try:
-        if os.path.exists(lock_file):
-            os.remove(lock_file)
-    except OSError:
-        pass
+    while True:
+        try:
+            fd = os.open(lock_file, os.O_CREAT | os.O_WRONLY, 0o644)
+        except OSError:
+            return None
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+        # 锁文件可能在我们 open 之后被上一个持有者删除；确认锁住的仍是路径上的那个文件，否则重试
+        try:
+            st, cur = os.fstat(fd), os.stat(lock_file)
+            if (st.st_dev, st.st_ino) == (cur.st_dev, cur.st_ino):
+                return fd
+        except FileNotFoundError:
+            pass
+        os.close(fd)
+
+def release_file_lock(filepath: str, fd: int):
+    """释放锁：先删锁文件再关闭 fd（顺序不能反，否则可能删掉别人刚锁上的锁文件）"""
+    remove_quietly(filepath + '.lock')
+    os.close(fd)
 
 def get_disk_space(path: str) -> Tuple[int, int]:
-    """获取磁盘空间（总空间，剩余空间），单位字节"""
+    """获取磁盘空间（总空间，剩余空间），单位字节；同一路径 DISK_CHECK_TTL 秒内复用上次的 statvfs 结果"""
+    now = time.monotonic()
+    cached = _disk_space_cache.get(path)
+    if cached is not None and now - cached[0] < DISK_CHECK_TTL:
+        return cached[1], cached[2]
     try:
         stat = shutil.disk_usage(path)
-        return stat.total, stat.free
     except OSError:
         return 0, 0
+    if len(_disk_space_cache) > 1024:
+        _disk_space_cache.clear()  # 目录很多时防止缓存无限增长
+    _disk_space_cache[path] = (now, stat.total, stat.free)
+    return stat.total, stat.free
 
 def check_disk_space(path: str, required_bytes: int) -> bool:
     """检查磁盘空间是否足够"""
@@ -201,91 +538,293 @@ def check_disk_space(path: str, required_bytes: int) -> bool:
     return free >= (required_bytes + min_free)
 
 def save_download_meta(temp_local: str, etag: str, size: int, downloaded: int):
-    """保存下载元数据（用于断点续传校验）"""
+    """保存下载元数据（用于断点续传校验）；定长二进制，一次 os.write 写完"""
     meta_file = temp_local + '.meta'
     try:
-        meta = {
-            'etag': etag,
-            'size': size,
-            'downloaded': downloaded,
-            'timestamp': time.time()
-        }
-        with open(meta_file, 'w') as f:
-            json.dump(meta, f)
+        data = META_STRUCT.pack(etag.encode()[:META_ETAG_LEN], size, downloaded, time.time())
+        fd = os.open(meta_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
     except (OSError, IOError):
         pass
 
 def load_download_meta(temp_local: str) -> Optional[dict]:
-    """加载下载元数据"""
+    """加载下载元数据；格式不符（如旧版 JSON 元数据）时返回 None"""
     meta_file = temp_local + '.meta'
     try:
-        if os.path.exists(meta_file):
-            with open(meta_file, 'r') as f:
-                return json.load(f)
-    except (OSError, IOError, json.JSONDecodeError):
+        with open(meta_file, 'rb') as f:
+            data = f.read(META_STRUCT.size + 1)
+        if len(data) != META_STRUCT.size:
+            return None
+        etag, size, downloaded, timestamp = META_STRUCT.unpack(data)
+        return {
+            'etag': etag.rstrip(b'\0').decode(),
+            'size': size,
+            'downloaded': downloaded,
+            'timestamp': timestamp
+        }
+    except (OSError, IOError, UnicodeDecodeError):
         pass
     return None
 
-def verify_partial_file(temp_local: str, expected_size: int, etag: Optional[str]) -> bool:
-    """验证部分下载文件的完整性"""
-    if not os.path.exists(temp_local):
-        return False
+def verify_partial_file(temp_local: str, expected_size: int, etag: Optional[str],
+                        actual_size: Optional[int] = None) -> bool:
+    """验证部分下载文件的完整性；actual_size 为调用方已 stat 得到的大小（省去重复 stat）"""
+    if actual_size is None:
+        st = stat_or_none(temp_local)
+        if st is None:
+            return False
+        actual_size = st.st_size
     
-    actual_size = os.path.getsize(temp_local)
     if actual_size > expected_size:
         # 文件大小超过预期，损坏
         return False
     
-    # 加载元数据
+    # 加载元数据；非空临时文件没有元数据时无法确认内容（可能是分段乱序写入时被强杀留下的空洞），不可信
     meta = load_download_meta(temp_local)
-    if meta:
-        # 检查 ETag 是否匹配
-        if etag and meta.get('etag') != etag:
-            return False
-        # 检查大小是否匹配
-        if meta.get('size') != expected_size:
-            return False
-        if meta.get('downloaded') != actual_size:
-            return False
-    
-    return True
+    if meta is None:
+        return actual_size == 0
+    # 检查 ETag 是否匹配
+    if etag and meta.get('etag') != etag:
+        return False
+    # 检查大小是否匹配
+    if meta.get('size') != expected_size:
+        return False
+    return meta.get('downloaded') == actual_size
+
+# copy_file_range 不可用时（内核过旧、跨文件系统类型、文件系统不支持）的 errno，遇到后退回 sendfile
+COPY_RANGE_FALLBACK_ERRNOS = frozenset({errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP})
+
+def _kernel_copy(src: str, dst: str):
+    """
+    在内核中复制文件内容，数据不经过用户态缓冲区：
+    优先 os.copy_file_range（Python 3.8+/Linux 4.5+，NFS 等支持服务端复制/reflink 时甚至不经过网络），
+    不支持时退回 os.sendfile；两者都不可用时抛 OSError/AttributeError，由调用方退回 shutil.copy2
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        in_fd, out_fd = fsrc.fileno(), fdst.fileno()
+        offset = 0
+        if hasattr(os, 'copy_file_range'):
+            try:
+                while True:
+                    copied = os.copy_file_range(in_fd, out_fd, 1 << 30, offset, offset)
+                    if copied == 0:
+                        break
+                    offset += copied
+            except OSError as e:
+                if offset or e.errno not in COPY_RANGE_FALLBACK_ERRNOS:
+                    raise
+            else:
+                shutil.copystat(src, dst)
+                return
+        while True:
+            sent = os.sendfile(out_fd, in_fd, offset, 1 << 30)
+            if sent == 0:
+                break
+            offset += sent
+    shutil.copystat(src, dst)
+
+def fsync_path(path: str, directory: bool = False):
+    """对文件（或目录）做 fsync；平台不支持（如 Windows 没有 O_DIRECTORY）或失败时忽略"""
+    try:
+        fd = os.open(path, os.O_RDONLY | (os.O_DIRECTORY if directory else 0))
+    except (OSError, AttributeError):
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+# 目录 fd 缓存：同一目录下大量文件重命名后都要 fsync 目录，复用已打开的 fd，不必每次 open/close
+# 缓存的 fd 运行期间不关闭（fsync 在锁外进行，不能被别的线程中途关掉）；缓存满了以后的新目录退回 fsync_path
+DIR_FD_CACHE_SIZE = 256
+_dir_fds: Dict[str, int] = {}
+_dir_fds_lock = threading.Lock()
+
+def fsync_dir(directory: str):
+    """fsync 目录（重命名持久化），优先使用缓存的目录 fd；失败时忽略"""
+    fd = _dir_fds.get(directory)
+    if fd is None:
+        with _dir_fds_lock:
+            fd = _dir_fds.get(directory)
+            if fd is None:
+                if len(_dir_fds) >= DIR_FD_CACHE_SIZE:
+                    fsync_path(directory, directory=True)
+                    return
+                try:
+                    fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+                except (OSError, AttributeError):
+                    return
+                _dir_fds[directory] = fd
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+
+def close_dir_fds():
+    """关闭所有缓存的目录 fd（程序退出前调用）"""
+    with _dir_fds_lock:
+        for fd in _dir_fds.values():
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        _dir_fds.clear()
 
 def safe_rename(src: str, dst: str) -> bool:
-    """安全重命名文件，支持跨文件系统"""
+    """
+    安全重命名文件，支持跨文件系统
+    持久化顺序：fsync(临时文件) -> 原子重命名 -> fsync(所在目录)，崩溃后不会留下空的或缺失的最终文件
+    """
+    fsync_path(src)
     try:
-        # 先尝试直接重命名（同文件系统）
-        os.rename(src, dst)
-        return True
+        # 先尝试直接原子替换（同文件系统，目标已存在时直接覆盖）
+        os.replace(src, dst)
     except OSError as e:
-        # 如果是跨文件系统错误，使用 copy + delete
-        if e.errno == 18:  # EXDEV: Invalid cross-device link
+        if e.errno != errno.EXDEV:  # 只处理跨文件系统（Invalid cross-device link）
+            return False
+        # 跨文件系统：内核态复制（copy_file_range / sendfile）后删除源文件，不支持时才退回 shutil.copy2
+        try:
             try:
+                _kernel_copy(src, dst)
+            except (OSError, AttributeError):
                 shutil.copy2(src, dst)
-                os.remove(src)
-                return True
-            except (OSError, IOError):
-                return False
-        return False
+            fsync_path(dst)
+            os.remove(src)
+        except (OSError, IOError):
+            return False
+    fsync_dir(os.path.dirname(dst) or '.')
+    return True
+
+# fallocate(FALLOC_FL_KEEP_SIZE)：只分配磁盘空间、不改变文件大小
+# os.posix_fallocate 会把文件撑到目标大小，破坏"临时文件大小 = 已下载字节数"的续传约定，所以直接调 libc
+FALLOC_FL_KEEP_SIZE = 0x01
+try:
+    import ctypes
+    _libc_fallocate = ctypes.CDLL(None, use_errno=True).fallocate
+    _libc_fallocate.argtypes = (ctypes.c_int, ctypes.c_int, ctypes.c_longlong, ctypes.c_longlong)
+    _libc_fallocate.restype = ctypes.c_int
+except (ImportError, OSError, AttributeError):
+    _libc_fallocate = None
+
+def preallocate(fd: int, offset: int, length: int):
+    """
+    为 [offset, offset+length) 预先分配连续空间，分段乱序写入时不再逐个 extent 分配、产生碎片
+    尽力而为：文件系统不支持（NFS、tmpfs 等）时静默跳过
+    """
+    if _libc_fallocate is None or length <= 0:
+        return
+    _libc_fallocate(fd, FALLOC_FL_KEEP_SIZE, offset, length)
+
+def ranged_download(s3, bucket: str, key: str, temp_local: str, start: int, size: int, callback=None,
+                    etag: str = ''):
+    """
+    分段下载 [start, size)：按 MULTIPART_CHUNKSIZE 切分，多个 Range GET 并行下载，用 os.pwrite 写到各自偏移
+    单个分段遇到网络错误或读流中断先就地重试（最多 PART_RETRIES 次），不牵连其他分段；仍失败时取消尚未开始的分段
+    分段可以乱序完成；结束时把文件截断到连续完成的前缀，保证"文件大小 = 已下载字节数"，下次仍可从末尾续传
+    开始写分段之前先把 .meta 记为 start：进程被强杀时临时文件里可能有乱序写入留下的空洞，
+    此时文件大小与 .meta 记录不符，下次校验失败会重新下载，而不是把带空洞的文件当成断点或完整文件
+    """
+    offsets = list(range(start, size, MULTIPART_CHUNKSIZE))
+    done = set()
+    save_download_meta(temp_local, etag, size, start)
+    fd = os.open(temp_local, os.O_WRONLY | os.O_CREAT, 0o644)
+    preallocate(fd, start, size - start)
+
+    def fetch(offset: int):
+        end = min(offset + MULTIPART_CHUNKSIZE, size)
+        for attempt in range(PART_RETRIES):
+            pos = offset
+            try:
+                with _s3_slots:
+                    body = s3.get_object(Bucket=bucket, Key=key, Range=f"bytes={offset}-{end - 1}")["Body"]
+                    for chunk in body.iter_chunks(1024 * 1024):
+                        view = memoryview(chunk)
+                        while view:
+                            n = os.pwrite(fd, view, pos)
+                            pos += n
+                            view = view[n:]
+                        if callback:
+                            callback(len(chunk))
+                if pos != end:
+                    raise PartLengthMismatch(f"分段长度不匹配: 期望 {end - offset}, 实际 {pos - offset}")
+                done.add(offset)
+                return
+            except Exception as e:
+                if callback and pos > offset:
+                    callback(offset - pos)  # 撤回这次失败已计入进度的字节
+                # 读流中断也归为网络错误（见 _resolve_network_handler）
+                if attempt == PART_RETRIES - 1 or _shutdown_event.is_set() or not is_network_error(e):
+                    raise
+
+    with ThreadPoolExecutor(max_workers=PART_CONCURRENCY) as ex:
+        try:
+            for fut in [ex.submit(fetch, o) for o in offsets]:
+                fut.result()
+        except BaseException:
+            # 失败分段之后的数据会被截断丢弃，不必再下载
+            ex.shutdown(wait=True, cancel_futures=True)
+            raise
+        finally:
+            contiguous = start
+            for o in offsets:
+                if o not in done:
+                    break
+                contiguous = min(o + MULTIPART_CHUNKSIZE, size)
+            os.ftruncate(fd, contiguous)
+            os.close(fd)
+            save_download_meta(temp_local, etag, size, contiguous)
+
+_monotonic = time.monotonic
+PROGRESS_PRINT_INTERVAL = 0.5  # 进度刷新间隔（秒）
 
 class ProgressCallback:
-    """下载进度回调，显示进度和网速"""
+    """
+    下载进度回调，显示进度和网速
+    分段并行下载时多个线程同时回调：热路径只把字节数追加到 deque（线程安全，无需加锁），
+    到了刷新时间由抢到打印锁的那个线程汇总并打印，其他线程直接返回
+    """
     def __init__(self, total_size: int, filename: str, initial: int = 0):
         self.total_size = max(total_size, 1)  # 防止除零
         self.filename = filename
         self.downloaded = initial  # 支持断点续传
-        self.start_time = time.time()
+        self.start_time = time.monotonic()  # 单调时钟，不受系统时间跳变影响
         self.last_print_time = 0
         self.last_downloaded = initial
-        self._lock = threading.Lock()  # 线程安全
+        self._next_print = 0.0  # 下次允许打印的时刻；快速路径只需和它比较一次
+        self._pending = deque()
+        self._append = self._pending.append  # 预绑定，热路径省去两次属性查找
+        self._print_lock = threading.Lock()
+    
+    def _drain(self):
+        """把各线程追加的字节数汇总到 downloaded（持有打印锁时调用）"""
+        pending = self._pending
+        total = 0
+        try:
+            while True:
+                total += pending.popleft()
+        except IndexError:
+            pass
+        self.downloaded += total
     
     def __call__(self, bytes_amount):
-        with self._lock:
-            self.downloaded += bytes_amount
-            now = time.time()
-            
-            # 每0.5秒更新一次显示
-            if now - self.last_print_time < 0.5:
+        # 快速路径：追加字节数 + 一次时间比较，不加锁、不分配
+        self._append(bytes_amount)
+        now = _monotonic()
+        if now < self._next_print:
+            return
+        
+        # 每0.5秒更新一次显示；抢不到锁说明别的线程正在打印
+        if not self._print_lock.acquire(blocking=False):
+            return
+        try:
+            if now < self._next_print:
                 return
+            self._drain()
             
             elapsed = now - self.start_time
             if elapsed > 0:
@@ -309,14 +848,40 @@ class ProgressCallback:
                       f"速度: {human(int(speed))}/s | 剩余: {eta}    ", end="", flush=True)
             
             self.last_print_time = now
+            self._next_print = now + PROGRESS_PRINT_INTERVAL
             self.last_downloaded = self.downloaded
+        finally:
+            self._print_lock.release()
     
     def finish(self):
         """下载完成，打印最终统计"""
-        elapsed = time.time() - self.start_time
+        with self._print_lock:
+            self._drain()
+        elapsed = time.monotonic() - self.start_time
         avg_speed = self.downloaded / elapsed if elapsed > 0 else 0
         print(f"\r  完成: {human(self.total_size)} | 平均速度: {human(int(avg_speed))}/s | 耗时: {elapsed:.1f}s    ")
 
+class FolderStat:
+    """单个文件夹的统计；__slots__ 避免每个文件夹一个 dict，文件夹很多时显著省内存"""
+    __slots__ = ('total_files', 'total_size', 'downloaded_files', 'downloaded_size', 'last_update')
+    
+    def __init__(self):
+        self.total_files = 0
+        self.total_size = 0
+        self.downloaded_files = 0
+        self.downloaded_size = 0
+        self.last_update = time.time()
+
+def progress_text(total: int, downloaded: int) -> str:
+    """文件夹进度字符串："已完成" 或 "下载中 32%" 或 "等待中" """
+    if downloaded == 0:
+        return "等待中"
+    elif downloaded >= total:
+        return "已完成"
+    else:
+        progress = int(downloaded / total * 100)
+        return f"下载中 {progress}%"
+
 class FolderProgressTracker:
     """
     文件夹级别的下载进度跟踪器
@@ -332,18 +897,69 @@ class FolderProgressTracker:
         self.csv_path = csv_path
         self.folder_depth = folder_depth
         
-        # 文件夹统计：{folder_path: {total_files, total_size, downloaded_files, downloaded_size}}
-        self.folders: Dict[str, dict] = defaultdict(lambda: {
-            'total_files': 0,
-            'total_size': 0,
-            'downloaded_files': 0,
-            'downloaded_size': 0,
-            'last_update': time.time()
-        })
+        # 文件夹统计：{folder_path: FolderStat}
+        self.folders: Dict[str, FolderStat] = {}
         
         self._last_write_time = 0
         self._write_interval = 10  # 每10秒写入一次
+        self._dirty_threshold = 500  # 累计这么多次更新就提前写入，不必等满间隔
         self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        
+        # 更新不直接改 folders：add_file / mark_downloaded 只把 (folder, 文件数, 字节数, 已下载文件数, 已下载字节数, 时间)
+        # 追加到 deque（线程安全，无需加锁），读取方在 _lock 内先 _merge 再读，更新路径上没有锁竞争
+        self._pending = deque()
+        self._append = self._pending.append
+        
+        # 单个后台线程定期写 CSV，下载线程只更新内存中的统计，不做任何 CSV I/O
+        # _wake 在退出或更新次数达到阈值时置位，唤醒写入线程
+        self._stop_event = threading.Event()
+        self._wake = threading.Event()
+        self._writer_thread = None
+        if csv_path:
+            self._writer_thread = threading.Thread(target=self._writer_loop, name="folder-csv-writer", daemon=True)
+            self._writer_thread.start()
+    
+    def _writer_loop(self):
+        while not self._stop_event.is_set():
+            self._wake.wait(self._write_interval)
+            self._wake.clear()
+            if self._stop_event.is_set():
+                break
+            if self._pending:  # 没有变化时不重写整个 CSV
+                self.write_csv(force=True)
+    
+    def _push(self, update: tuple):
+        """追加一条更新；积压达到阈值时唤醒写入线程"""
+        self._append(update)
+        if len(self._pending) == self._dirty_threshold:
+            self._wake.set()
+    
+    def _merge(self):
+        """把积压的更新合并进 folders（持有 _lock 时调用）"""
+        pending = self._pending
+        folders = self.folders
+        try:
+            while True:
+                folder, files, size, dl_files, dl_size, ts = pending.popleft()
+                stat = folders.get(folder)
+                if stat is None:
+                    stat = folders[folder] = FolderStat()
+                stat.total_files += files
+                stat.total_size += size
+                stat.downloaded_files += dl_files
+                stat.downloaded_size += dl_size
+                stat.last_update = ts
+        except IndexError:
+            pass
+    
+    def close(self):
+        """停止后台写入线程并做最后一次写入"""
+        self._stop_event.set()
+        self._wake.set()
+        if self._writer_thread is not None and self._writer_thread is not threading.current_thread():
+            self._writer_thread.join(timeout=self._write_interval)
+        self.write_csv(force=True)
     
     def get_folder_key(self, file_path: str, prefix: str = "") -> str:
         """
@@ -383,15 +999,10 @@ class FolderProgressTracker:
         if not folder:
             return
         
-        with self._lock:
-            self.folders[folder]['total_files'] += 1
-            self.folders[folder]['total_size'] += size
-            
-            if status in ['downloaded', 'already_present']:
-                self.folders[folder]['downloaded_files'] += 1
-                self.folders[folder]['downloaded_size'] += size
-            
-            self.folders[folder]['last_update'] = time.time()
+        if status in ('downloaded', 'already_present'):
+            self._push((folder, 1, size, 1, size, time.time()))
+        else:
+            self._push((folder, 1, size, 0, 0, time.time()))
     
     def mark_downloaded(self, file_path: str, size: int, prefix: str = ""):
         """
@@ -401,14 +1012,7 @@ class FolderProgressTracker:
         if not folder:
             return
         
-        with self._lock:
-            self.folders[folder]['downloaded_files'] += 1
-            self.folders[folder]['downloaded_size'] += size
-            self.folders[folder]['last_update'] = time.time()
-        
-        # 定期写入 CSV
-        if time.time() - self._last_write_time > self._write_interval:
-            self.write_csv()
+        self._push((folder, 0, 0, 1, size, time.time()))
     
     def get_progress(self, folder: str) -> str:
         """
@@ -417,20 +1021,12 @@ class FolderProgressTracker:
         Returns:
             "已完成" 或 "下载中 32%" 或 "等待中"
         """
-        if folder not in self.folders:
+        with self._lock:
+            self._merge()
+            stat = self.folders.get(folder)
+        if stat is None:
             return "未知"
-        
-        data = self.folders[folder]
-        total = data['total_files']
-        downloaded = data['downloaded_files']
-        
-        if downloaded == 0:
-            return "等待中"
-        elif downloaded >= total:
-            return "已完成"
-        else:
-            progress = int(downloaded / total * 100)
-            return f"下载中 {progress}%"
+        return progress_text(stat.total_files, stat.downloaded_files)
     
     def write_csv(self, force: bool = False):
         """
@@ -439,21 +1035,39 @@ class FolderProgressTracker:
         Args:
             force: 强制写入（忽略时间间隔）
         """
-        if not force and time.time() - self._last_write_time < self._write_interval:
+        if not force and time.monotonic() - self._last_write_time < self._write_interval:
             return
         
         if not self.csv_path:
             return
         
+        # 锁内只做快照，排序、格式化和写盘都在锁外进行，不阻塞 mark_downloaded
         with self._lock:
+            self._merge()
+            snapshot = [(folder, d.total_files, d.total_size, d.downloaded_files,
+                         d.downloaded_size, d.last_update)
+                        for folder, d in self.folders.items()]
+        snapshot.sort()
+        
+        ts_cache = {}  # 同一秒内更新的文件夹共用一次 strftime
+        def fmt_ts(t: float) -> str:
+            sec = int(t)
+            ts = ts_cache.get(sec)
+            if ts is None:
+                ts = ts_cache[sec] = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(sec))
+            return ts
+        
+        rows = ((folder, total_files, total_size, human(total_size),
+                 downloaded_files, downloaded_size, human(downloaded_size),
+                 progress_text(total_files, downloaded_files), fmt_ts(last_update))
+                for folder, total_files, total_size, downloaded_files, downloaded_size, last_update in snapshot)
+        
+        # 写文件本身仍需串行（共用同一个临时文件）
+        with self._write_lock:
             try:
-                with open(self.csv_path, 'w', newline='', encoding='utf-8') as f:
-                    # 获取文件锁
-                    try:
-                        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
-                    except (IOError, OSError):
-                        return  # 无法获取锁，跳过本次写入
-                    
+                # 先写到同目录的临时文件，再原子替换：读者永远看到完整的 CSV，无需锁住正式文件
+                tmp_path = self.csv_path + '.tmp'
+                with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
                     writer = csv.writer(f)
                     
                     # 写入表头
@@ -468,31 +1082,14 @@ class FolderProgressTracker:
                         'progress',
                         'last_update'
                     ])
-                    
-                    # 写入数据（按文件夹路径排序）
-                    for folder in sorted(self.folders.keys()):
-                        data = self.folders[folder]
-                        
-                        total_size = data['total_size']
-                        downloaded_size = data['downloaded_size']
-                        progress = self.get_progress(folder)
-                        
-                        writer.writerow([
-                            folder,
-                            data['total_files'],
-                            total_size,
-                            human(total_size),
-                            data['downloaded_files'],
-                            downloaded_size,
-                            human(downloaded_size),
-                            progress,
-                            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(data['last_update']))
-                        ])
+                    # 写入数据（按文件夹路径排序），一次 writerows
+                    writer.writerows(rows)
                     
                     f.flush()
                     os.fsync(f.fileno())
+                os.replace(tmp_path, self.csv_path)
                 
-                self._last_write_time = time.time()
+                self._last_write_time = time.monotonic()
             
             except IOError as e:
                 pass  # 静默失败，不影响下载
@@ -500,13 +1097,17 @@ class FolderProgressTracker:
     def get_summary(self) -> dict:
         """获取总体统计"""
         with self._lock:
+            self._merge()
             total_folders = len(self.folders)
-            completed_folders = sum(1 for data in self.folders.values() 
-                                   if data['downloaded_files'] >= data['total_files'])
-            total_files = sum(data['total_files'] for data in self.folders.values())
-            downloaded_files = sum(data['downloaded_files'] for data in self.folders.values())
-            total_size = sum(data['total_size'] for data in self.folders.values())
-            downloaded_size = sum(data['downloaded_size'] for data in self.folders.values())
+            # 一次遍历累加所有字段
+            completed_folders = total_files = downloaded_files = total_size = downloaded_size = 0
+            for stat in self.folders.values():
+                if stat.downloaded_files >= stat.total_files:
+                    completed_folders += 1
+                total_files += stat.total_files
+                downloaded_files += stat.downloaded_files
+                total_size += stat.total_size
+                downloaded_size += stat.downloaded_size
             
             return {
                 'total_folders': total_folders,
@@ -537,7 +1138,10 @@ class FolderProgressTracker:
         print("="*80)
 
 class CSVBatchWriter:
-    """批量写入CSV，减少I/O，带备份机制和文件锁"""
+    """
+    批量写入CSV，减少I/O，带备份机制和文件锁
+    整个运行期间只打开一次文件、只加一次锁，flush 时直接写入已打开的句柄；fsync 每 CSV_FSYNC_EVERY 次才做一次
+    """
     def __init__(self, path: str, batch_size: int = CSV_BATCH_SIZE):
         self.path = path
         self.batch_size = batch_size
@@ -545,29 +1149,47 @@ class CSVBatchWriter:
         self.backup_path = path + '.backup' if path else None
         self.write_failures = 0
         self._lock = threading.Lock()  # 线程锁
-        self._last_flush_time = time.time()  # 上次刷新时间
+        self._last_flush_time = time.monotonic()  # 上次刷新时间
+        self._fd = None
+        self._writer = None
+        self._flush_count = 0
+    
+    def _open(self, mode: str = "a"):
+        """打开（或重新打开）CSV 并加独占锁，之后一直持有"""
+        f = open(self.path, mode, newline="", encoding="utf-8", buffering=1 << 20)
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            f.close()
+            # 无法获取锁，文件被占用（如 Excel 打开）
+            raise IOError("CSV文件被其他程序占用")
+        self._fd = f
+        self._writer = csv.writer(f)
+    
+    def _close_fd(self):
+        if self._fd is not None:
+            try:
+                self._fd.close()  # 关闭时锁自动释放
+            except IOError:
+                pass
+            self._fd = None
+            self._writer = None
     
     def write_header(self):
         if not self.path:
             return
-        try:
-            with open(self.path, "w", newline="", encoding="utf-8") as f:
-                # 获取文件锁（独占写锁）
-                try:
-                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
-                except (IOError, OSError):
-                    # 无法获取锁，可能被其他程序打开
-                    print(f"警告: CSV文件被占用，跳过写入头")
-                    return
-                
-                csv.writer(f).writerow([
+        with self._lock:
+            self._close_fd()
+            try:
+                self._open("w")
+                self._writer.writerow([
                     "timestamp_iso", "bucket", "key", "size_bytes", "size_human",
                     "etag", "last_modified_iso", "local_path", "status"
                 ])
-                # 锁会在 with 块结束时自动释放
-            self.write_failures = 0
-        except IOError as e:
-            print(f"警告: 无法写入CSV头 {self.path}: {e}")
+                self._fd.flush()
+                self.write_failures = 0
+            except IOError as e:
+                print(f"警告: 无法写入CSV头 {self.path}: {e}")
     
     def append(self, row: list):
         if not self.path:
@@ -577,68 +1199,78 @@ class CSVBatchWriter:
             # 改进的刷新策略：
             # 1. buffer 达到批量大小
             # 2. 或者距离上次刷新超过 30 秒
-            now = time.time()
+            now = time.monotonic()
             if len(self.buffer) >= self.batch_size or (now - self._last_flush_time) > 30:
-                self.flush()
+                self._flush_locked()
     
-    def flush(self):
-        if not self.path or not self.buffer:
+    def flush(self, force: bool = False):
+        """写出缓冲区；force=True 时同时 fsync（退出前调用）"""
+        if not self.path:
             return
-        
         with self._lock:
-            # 先尝试写入主文件
-            success = False
-            try:
-                with open(self.path, "a", newline="", encoding="utf-8") as f:
-                    # 尝试获取文件锁（非阻塞）
-                    try:
-                        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
-                    except (IOError, OSError):
-                        # 无法获取锁，文件被占用（如 Excel 打开）
-                        raise IOError("CSV文件被其他程序占用")
-                    
-                    w = csv.writer(f)
-                    w.writerows(self.buffer)
-                    # 强制刷新到磁盘
-                    f.flush()
-                    os.fsync(f.fileno())
-                    # 锁会在 with 块结束时自动释放
-                success = True
-                self.write_failures = 0
-                self._last_flush_time = time.time()
-            except IOError as e:
-                self.write_failures += 1
-                # 只在第一次失败时打印警告，避免刷屏
-                if self.write_failures == 1 or self.write_failures % 10 == 0:
-                    print(f"警告: CSV写入失败 ({self.write_failures}次): {e}")
-                
-                # 如果连续失败，尝试写入备份文件
-                if self.write_failures >= 3 and self.backup_path:
-                    try:
-                        with open(self.backup_path, "a", newline="", encoding="utf-8") as f:
-                            try:
-                                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
-                            except (IOError, OSError):
-                                pass  # 备份文件不强制要求锁
-                            w = csv.writer(f)
-                            w.writerows(self.buffer)
-                            f.flush()
-                            os.fsync(f.fileno())
-                        if self.write_failures == 3:  # 只在第一次使用备份时提示
-                            print(f"已写入备份文件: {self.backup_path}")
-                        success = True
-                        self._last_flush_time = time.time()
-                    except IOError:
-                        if self.write_failures == 3:
-                            print(f"警告: 备份文件写入也失败")
+            self._flush_locked(force)
+    
+    def close(self):
+        self.flush(force=True)
+        with self._lock:
+            self._close_fd()
+    
+    def _flush_locked(self, force: bool = False):
+        """调用方需持有 self._lock"""
+        if not self.buffer:
+            if force and self._fd is not None:
+                self._fd.flush()
+                os.fdatasync(self._fd.fileno())
+            return
+        
+        # 先尝试写入主文件
+        success = False
+        try:
+            if self._fd is None:
+                self._open("a")
+            self._writer.writerows(self.buffer)
+            self._fd.flush()
+            self._flush_count += 1
+            # 追加写用 fdatasync 即可（数据与文件长度落盘），省去 mtime 等元数据的额外刷盘
+            if force or self._flush_count % CSV_FSYNC_EVERY == 0:
+                os.fdatasync(self._fd.fileno())
+            success = True
+            self.write_failures = 0
+            self._last_flush_time = time.monotonic()
+        except IOError as e:
+            self._close_fd()  # 下次 flush 时重新打开
+            self.write_failures += 1
+            # 只在第一次失败时打印警告，避免刷屏
+            if self.write_failures == 1 or self.write_failures % 10 == 0:
+                print(f"警告: CSV写入失败 ({self.write_failures}次): {e}")
             
-            # 只有成功写入才清空buffer
-            if success:
-                self.buffer.clear()
-            elif len(self.buffer) > 1000:
-                # 如果buffer过大（超过1000条），强制清空避免内存溢出
-                print(f"警告: CSV buffer过大，强制清空 {len(self.buffer)} 条记录")
-                self.buffer.clear()
+            # 如果连续失败，尝试写入备份文件
+            if self.write_failures >= 3 and self.backup_path:
+                try:
+                    with open(self.backup_path, "a", newline="", encoding="utf-8") as f:
+                        try:
+                            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        except (IOError, OSError):
+                            pass  # 备份文件不强制要求锁
+                        w = csv.writer(f)
+                        w.writerows(self.buffer)
+                        f.flush()
+                        os.fsync(f.fileno())
+                    if self.write_failures == 3:  # 只在第一次使用备份时提示
+                        print(f"已写入备份文件: {self.backup_path}")
+                    success = True
+                    self._last_flush_time = time.monotonic()
+                except IOError:
+                    if self.write_failures == 3:
+                        print(f"警告: 备份文件写入也失败")
+        
+        # 只有成功写入才清空buffer
+        if success:
+            self.buffer.clear()
+        elif len(self.buffer) > 1000:
+            # 如果buffer过大（超过1000条），强制清空避免内存溢出
+            print(f"警告: CSV buffer过大，强制清空 {len(self.buffer)} 条记录")
+            self.buffer.clear()
 
 def download_with_retry(s3, bucket: str, key: str, local: str, size: int) -> bool:
     """带断点续传、智能重试和进度显示的下载，成功返回True"""
@@ -650,7 +1282,7 @@ def download_with_retry(s3, bucket: str, key: str, local: str, size: int) -> boo
     file_retry_count = 0
     
     while True:
-        if _shutdown_requested:
+        if _shutdown_event.is_set():
             return False
         
         # 检查是否可以断点续传
@@ -726,11 +1358,9 @@ def download_with_retry(s3, bucket: str, key: str, local: str, size: int) -> boo
                 else:
                     print(f"  {delay}秒后重试...")
                 
-                # 可中断的等待
-                for _ in range(delay):
-                    if _shutdown_requested:
-                        return False
-                    time.sleep(1)
+                # 可中断的等待：收到退出信号时立即返回
+                if _shutdown_event.wait(delay):
+                    return False
                 
                 # 网络错误不删除临时文件，保留断点
                 continue
@@ -749,7 +1379,7 @@ def download_with_retry(s3, bucket: str, key: str, local: str, size: int) -> boo
                         pass
                     return False
                 
-                time.sleep(5)
+                _shutdown_event.wait(5)
                 # 文件错误删除临时文件重新下载
                 try:
                     if os.path.exists(temp_local):
@@ -757,46 +1387,51 @@ def download_with_retry(s3, bucket: str, key: str, local: str, size: int) -> boo
                 except OSError:
                     pass
 
-def download_with_retry(s3, bucket: str, key: str, local: str, size: int, etag: Optional[str] = None) -> bool:
-    """带断点续传、智能重试和进度显示的下载，成功返回True"""
+def download_with_retry(s3, bucket: str, key: str, local: str, size: int, etag: Optional[str] = None,
+                        tm=None) -> bool:
+    """带断点续传、智能重试和进度显示的下载，成功返回True；tm 为共用的 TransferManager（可选）"""
     temp_local = local + ".tmp"
     show_progress = size >= PROGRESS_THRESHOLD
     support_resume = size >= RESUME_THRESHOLD
     
     network_retry_count = 0
     file_retry_count = 0
-    retry_start_time = time.time()
+    retry_start_time = time.monotonic()
     
     # 创建文件锁
-    if not create_file_lock(temp_local):
+    lock_fd = acquire_file_lock(temp_local)
+    if lock_fd is None:
         print(f"  文件被其他进程锁定，跳过")
         return False
     
     try:
         while True:
-            if _shutdown_requested:
+            if _shutdown_event.is_set():
                 return False
             
             # 检查全局重试时间上限
-            if time.time() - retry_start_time > MAX_RETRY_TIME:
+            if time.monotonic() - retry_start_time > MAX_RETRY_TIME:
                 print(f"  重试超时（{MAX_RETRY_TIME/3600:.1f}小时），已跳过")
                 return False
             
             # 检查磁盘空间（需要2倍空间：临时文件+最终文件）
             if not check_disk_space(os.path.dirname(local) or '.', size * 2):
                 print(f"  磁盘空间不足（需要 {human(size*2)} + {MIN_DISK_SPACE_GB}GB 缓冲）")
-                time.sleep(60)  # 等待1分钟后重试
+                if _shutdown_event.wait(60):  # 等待1分钟后重试
+                    return False
                 continue
             
             # 检查是否可以断点续传
             downloaded_size = 0
-            if support_resume and os.path.exists(temp_local):
+            st = stat_or_none(temp_local) if support_resume else None
+            if st is not None:
                 # 验证部分文件的完整性
-                if verify_partial_file(temp_local, size, etag):
-                    downloaded_size = os.path.getsize(temp_local)
+                if verify_partial_file(temp_local, size, etag, st.st_size):
+                    downloaded_size = st.st_size
                     if downloaded_size >= size:
-                        # 已下载完成，直接重命名
+                        # 已下载完成，直接重命名（目录 fsync 之后再删元数据）
                         if safe_rename(temp_local, local):
+                            remove_quietly(temp_local + '.meta')
                             return True
                         else:
                             print(f"  重命名失败，重新下载")
@@ -806,13 +1441,7 @@ def download_with_retry(s3, bucket: str, key: str, local: str, size: int, etag:
                 else:
                     # 部分文件损坏，删除重新下载
                     print(f"  临时文件校验失败，重新下载")
-                    try:
-                        os.remove(temp_local)
-                        meta_file = temp_local + '.meta'
-                        if os.path.exists(meta_file):
-                            os.remove(meta_file)
-                    except OSError:
-                        pass
+                    remove_quietly(temp_local, temp_local + '.meta')
                     downloaded_size = 0
             
             try:
@@ -820,32 +1449,27 @@ def download_with_retry(s3, bucket: str, key: str, local: str, size: int, etag:
                 if show_progress:
                     callback = ProgressCallback(size, os.path.basename(key), initial=downloaded_size)
                 
-                # 使用 Range 请求实现断点续传
-                if downloaded_size > 0:
-                    extra_args = {'Range': f'bytes={downloaded_size}-'}
-                    with open(temp_local, 'ab') as f:
-                        s3.download_fileobj(
-                            Bucket=bucket,
-                            Key=key,
-                            Fileobj=f,
-                            ExtraArgs=extra_args,
-                            Callback=callback
-                        )
+                # 使用 Range 请求实现断点续传，剩余部分分段并行下载
+                # 大文件（含全新下载）走自己的分段下载：失败时已完成的连续部分留在临时文件里，可以续传
+                if downloaded_size > 0 or (support_resume and size > MULTIPART_THRESHOLD):
+                    ranged_download(s3, bucket, key, temp_local, downloaded_size, size, callback, etag or '')
+                elif tm is not None:
+                    subscribers = [ProgressCallbackInvoker(callback)] if callback else None
+                    with _s3_slots:
+                        tm.download(bucket, key, temp_local, subscribers=subscribers).result()
                 else:
-                    # 全新下载
-                    if callback:
-                        s3.download_file(bucket, key, temp_local, Callback=callback)
-                    else:
-                        s3.download_file(bucket, key, temp_local)
+                    with _s3_slots:
+                        s3.download_file(bucket, key, temp_local, Callback=callback, Config=TRANSFER_CONFIG)
                 
                 # 下载成功，显示完成信息
                 if show_progress and callback:
                     callback.finish()
                 
                 # 验证文件大小
-                if not os.path.exists(temp_local):
+                st = stat_or_none(temp_local)
+                if st is None:
                     raise OSError("临时文件不存在")
-                temp_size = os.path.getsize(temp_local)
+                temp_size = st.st_size
                 if temp_size != size:
                     raise OSError(f"文件大小不匹配: 期望 {size}, 实际 {temp_size}")
                 
@@ -854,13 +1478,8 @@ def download_with_retry(s3, bucket: str, key: str, local: str, size: int, etag:
                 
                 # 重命名为最终文件
                 if safe_rename(temp_local, local):
-                    # 清理元数据文件
-                    try:
-                        meta_file = temp_local + '.meta'
-                        if os.path.exists(meta_file):
-                            os.remove(meta_file)
-                    except OSError:
-                        pass
+                    # 重命名已持久化（含目录 fsync），此时再清理元数据文件
+                    remove_quietly(temp_local + '.meta')
                     return True
                 else:
                     raise OSError("文件重命名失败")
@@ -888,15 +1507,13 @@ def download_with_retry(s3, bucket: str, key: str, local: str, size: int, etag:
                         print(f"  {delay}秒后重试...")
                     
                     # 保存当前进度元数据
-                    if os.path.exists(temp_local):
-                        current_size = os.path.getsize(temp_local)
-                        save_download_meta(temp_local, etag or '', size, current_size)
+                    st = stat_or_none(temp_local)
+                    if st is not None:
+                        save_download_meta(temp_local, etag or '', size, st.st_size)
                     
-                    # 可中断的等待
-                    for _ in range(delay):
-                        if _shutdown_requested:
-                            return False
-                        time.sleep(1)
+                    # 可中断的等待：收到退出信号时立即返回
+                    if _shutdown_event.wait(delay):
+                        return False
                     
                     # 网络错误不删除临时文件，保留断点
                     continue
@@ -912,29 +1529,137 @@ def download_with_retry(s3, bucket: str, key: str, local: str, size: int, etag:
                     if file_retry_count >= MAX_FILE_RETRIES:
                         print(f"  文件错误，已跳过")
                         # 清理临时文件
-                        try:
-                            if os.path.exists(temp_local):
-                                os.remove(temp_local)
-                            meta_file = temp_local + '.meta'
-                            if os.path.exists(meta_file):
-                                os.remove(meta_file)
-                        except OSError:
-                            pass
+                        remove_quietly(temp_local, temp_local + '.meta')
                         return False
                     
-                    time.sleep(5)
+                    _shutdown_event.wait(5)
                     # 文件错误删除临时文件重新下载
-                    try:
-                        if os.path.exists(temp_local):
-                            os.remove(temp_local)
-                        meta_file = temp_local + '.meta'
-                        if os.path.exists(meta_file):
-                            os.remove(meta_file)
-                    except OSError:
-                        pass
+                    remove_quietly(temp_local, temp_local + '.meta')
+    finally:
+        # 释放文件锁
+        release_file_lock(temp_local, lock_fd)
+
+def iter_pages_async(bucket: str, prefix: str, region: str, out_prefix: str, prefix_len: int):
+    """
+    后台线程里用 aioboto3 的异步分页器列举，页放进有界队列，调用方照常同步迭代
+    每页到达后把该页涉及的本地目录交给线程并发预读（_dir_sizes），本地检查与后续页的网络请求重叠；
+    调用方处理当前页时，后台已经在请求后面的页
+    """
+    q = queue.Queue(maxsize=LIST_PREFETCH_PAGES)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    async def produce():
+        warming = set()
+        async with aioboto3.Session().client("s3", config=S3_CONFIG, region_name=region) as s3:
+            async for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+                dirs = {os.path.dirname(out_prefix + (key[prefix_len:].lstrip("/") if prefix_len else key))
+                        for key in (obj["Key"] for obj in page.get("Contents") or [])}
+                for d in dirs:
+                    task = asyncio.ensure_future(asyncio.to_thread(_dir_sizes, d))
+                    warming.add(task)
+                    task.add_done_callback(warming.discard)
+                if not await asyncio.to_thread(put, page):
+                    break
+        if warming:
+            await asyncio.gather(*warming)
+
+    def run():
+        try:
+            asyncio.run(produce())
+        except Exception as e:
+            put(e)  # 交给调用方在迭代时抛出
+        put(None)
+
+    threading.Thread(target=run, name="async-list", daemon=True).start()
+    try:
+        while True:
+            item = q.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+def make_exclude_filter(exclude: Tuple[str, ...]):
+    """
+    生成后缀过滤函数 excluded(key) -> bool；exclude 为小写后缀元组
+    全部是 ".json" 这种单段扩展名时：rfind 找最后一个点，只把扩展名转小写后查集合（O(1)，不复制整个 key）；
+    含 ".tar.gz" 或不带点的后缀时，退回对 key 末尾做 endswith
+    """
+    if not exclude:
+        return lambda key: False
+    if all(e.startswith('.') and e.count('.') == 1 for e in exclude):
+        exts = frozenset(e[1:] for e in exclude)
+        def excluded(key: str) -> bool:
+            dot = key.rfind('.')
+            return dot >= 0 and key[dot + 1:].lower() in exts
+        return excluded
+    tail = max(map(len, exclude))
+    return lambda key: key[-tail:].lower().endswith(exclude)
+
+def list_cache_path(out_dir: str, bucket: str, prefix: str) -> str:
+    """列举缓存文件路径，按 (bucket, prefix) 区分"""
+    tag = hashlib.sha1(f"{bucket}/{prefix}".encode()).hexdigest()[:16]
+    return os.path.join(out_dir, f".s3list.{tag}.cache")
+
+def load_list_cache(path: str, ttl: float):
+    """缓存存在且未过期时返回分页迭代器，否则返回 None"""
+    st = stat_or_none(path)
+    if st is None or time.time() - st.st_mtime >= ttl:
+        return None
+
+    def pages():
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            page = []
+            for line in f:
+                key, size, etag = json.loads(line)
+                page.append({"Key": key, "Size": size, "ETag": etag})
+                if len(page) >= LIST_CACHE_PAGE_SIZE:
+                    yield {"Contents": page}
+                    page = []
+            if page:
+                yield {"Contents": page}
+    return pages()
+
+def cached_pages(pages, path: str):
+    """
+    边转发分页边写入缓存；只有完整列举结束才 os.replace 成正式缓存，
+    中途停止（配额满、中断、列举出错）的不完整结果会被丢弃
+    """
+    tmp = path + ".tmp"
+    try:
+        f = gzip.open(tmp, "wt", encoding="utf-8")
+    except OSError as e:
+        print(f"警告: 无法写入列举缓存 {tmp}: {e}")
+        yield from pages
+        return
+    completed = False
+    try:
+        for page in pages:
+            for obj in page.get("Contents") or []:
+                f.write(json.dumps([obj["Key"], obj["Size"], obj.get("ETag") or ""]) + "\n")
+            yield page
+        completed = True
     finally:
-        # 清理文件锁
-        remove_file_lock(temp_local)
+        f.close()
+        if completed:
+            try:
+                os.replace(tmp, path)
+            except OSError:
+                remove_quietly(tmp)
+        else:
+            remove_quietly(tmp)
 
 def validate_args(args) -> bool:
     """验证参数有效性"""
@@ -944,6 +1669,9 @@ def validate_args(args) -> bool:
     if not args.bucket:
         print("错误: --bucket 不能为空")
         return False
+    if args.workers < 1:
+        print("错误: --workers 必须大于 0")
+        return False
     if not args.out:
         print("错误: --out 不能为空")
         return False
@@ -965,7 +1693,7 @@ def validate_args(args) -> bool:
     return True
 
 def main():
-    global _csv_writer
+    global _csv_writer, _s3_slots
     
     # 注册信号处理（包括 SIGHUP）
     signal.signal(signal.SIGINT, signal_handler)
@@ -989,28 +1717,61 @@ def main():
                     help="统计阶段跳过CSV写入（加快速度）")
     ap.add_argument("--folder-depth", type=int, default=1,
                     help="CSV统计的文件夹深度（1=最外层，2=第二层，默认1）")
+    ap.add_argument("--workers", type=int, default=16,
+                    help="同时下载的文件数，同时决定连接池大小（默认16）")
+    ap.add_argument("--max-inflight", type=int, default=0,
+                    help="同时进行的 S3 请求数上限（含分段请求），避免连接重置风暴（默认0=不额外限制）")
+    ap.add_argument("--list-ttl", type=float, default=0,
+                    help="列举结果缓存有效期（秒），有效期内重跑不再列举S3（默认0=不使用缓存）")
+    ap.add_argument("--refresh-list", action="store_true",
+                    help="忽略已有列举缓存，重新列举并刷新缓存")
+    ap.add_argument("--local-stat-cache", action="store_true",
+                    help=f"在输出目录保存/复用本地目录索引（{LOCAL_STAT_CACHE_NAME}），目录未增删文件时不再读目录，仅逐个核对大小与 mtime")
+    ap.add_argument("--async-list", action="store_true",
+                    help="用 aioboto3 在后台异步列举并预读本地目录，与统计/下载重叠（需安装 aioboto3）")
     args = ap.parse_args()
 
     if not validate_args(args):
         sys.exit(1)
+    if args.async_list and not HAS_AIOBOTO3:
+        print("警告: 未安装 aioboto3，--async-list 不可用，改用同步列举")
+    if args.max_inflight > 0:
+        _s3_slots = threading.BoundedSemaphore(args.max_inflight)
+    if args.local_stat_cache:
+        load_local_stat_cache(args.out)
 
     exclude = tuple(e.strip().lower() for e in args.exclude_ext.split(",") if e.strip())
     cap_bytes = int(args.cap_gb * 1024**3)
     prefix_len = len(args.prefix) if args.prefix else 0
+    # 列举循环是逐 key 的热路径：后缀过滤只看扩展名，拼路径用字符串拼接代替 os.path.join
+    excluded = make_exclude_filter(exclude)
+    out_prefix = os.path.join(args.out, '')
 
     try:
-        s3 = boto3.client("s3", config=S3_CONFIG, region_name=args.region)
+        s3 = make_s3_client(args.region, args.workers, args.max_inflight)
     except Exception as e:
         print(f"错误: 无法创建S3客户端: {e}")
         sys.exit(1)
     
     paginator = s3.get_paginator("list_objects_v2")
     
-    try:
-        pages = paginator.paginate(Bucket=args.bucket, Prefix=args.prefix)
-    except (ClientError, BotoCoreError) as e:
-        print(f"错误: 无法访问S3 bucket {args.bucket}: {e}")
-        sys.exit(1)
+    cache_path = list_cache_path(args.out, args.bucket, args.prefix)
+    pages = None
+    if args.list_ttl > 0 and not args.refresh_list:
+        pages = load_list_cache(cache_path, args.list_ttl)
+        if pages is not None:
+            print(f"使用列举缓存: {cache_path}")
+    if pages is None:
+        try:
+            if args.async_list and HAS_AIOBOTO3:
+                pages = iter_pages_async(args.bucket, args.prefix, args.region, out_prefix, prefix_len)
+            else:
+                pages = paginator.paginate(Bucket=args.bucket, Prefix=args.prefix)
+        except (ClientError, BotoCoreError) as e:
+            print(f"错误: 无法访问S3 bucket {args.bucket}: {e}")
+            sys.exit(1)
+        if args.list_ttl > 0 or args.refresh_list:
+            pages = cached_pages(pages, cache_path)
 
     # 第一遍：统计（流式，不存大列表）
     total_to_dl, total_size, already_cnt = 0, 0, 0
@@ -1020,22 +1781,22 @@ def main():
         shown = 0
         try:
             for page in pages:
-                if _shutdown_requested:
+                if _shutdown_event.is_set():
                     break
                 for obj in page.get("Contents") or []:
                     key, size = obj["Key"], obj["Size"]
                     if not key or key.endswith("/"):  # 跳过目录
                         continue
-                    if key.lower().endswith(exclude):
+                    if excluded(key):
                         continue
                     rel = key[prefix_len:].lstrip("/") if prefix_len else key
                     # 安全检查：防止路径遍历攻击
-                    if ".." in rel or rel.startswith("/"):
+                    if rel.startswith("/") or UNSAFE_REL_RE.search(rel):
                         continue
-                    local = os.path.join(args.out, rel)
+                    local = out_prefix + rel
                     
                     # 如果本地已存在且大小一致，就不占配额，直接标记为 already_present
-                    if os.path.exists(local) and os.path.getsize(local) == size:
+                    if local_size(local) == size:
                         already_cnt += 1
                         continue
                     if total_size + size <= cap_bytes:
@@ -1051,9 +1812,11 @@ def main():
         print(f"已存在跳过: {already_cnt}")
         if total_to_dl > 20:
             print(f"... 其余 {total_to_dl - 20} 个省略")
+        if args.local_stat_cache:
+            save_local_stat_cache(args.out)
         return
 
-    # 正式下载：先统计，再下载
+    # 正式下载：列举与下载流水线进行，不再先统计出完整的待下载列表
     # 使用文件夹级别的进度跟踪器
     folder_tracker = FolderProgressTracker(args.csv, folder_depth=args.folder_depth) if args.csv else None
     _csv_writer = folder_tracker  # 保存引用用于信号处理（兼容旧代码）
@@ -1064,35 +1827,43 @@ def main():
     now_iso = datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
     downloaded_cnt, downloaded_size, failed_cnt = 0, 0, 0
 
-    # 第一遍：统计需要下载的文件
-    print("正在统计文件...")
-    to_download = []  # (key, size, local, etag)
-    already_present = []  # 已存在的文件（用于延迟写入CSV）
-    try:
+    # 清理历史临时文件（须在开始下载之前）
+    print("正在清理历史临时文件...")
+    cleaned = cleanup_temp_files(args.out)
+    if cleaned > 0:
+        print(f"已清理 {cleaned} 个历史临时文件")
+    
+    if _shutdown_event.is_set():
+        if folder_tracker:
+            folder_tracker.close()
+        print("用户中断")
+        return
+
+    def iter_to_download():
+        """边列举边筛选，逐个产出 (key, size, local, etag)；配额在这里累计，额满后不再产出"""
+        nonlocal total_to_dl, total_size, already_cnt
         for page in pages:
-            if _shutdown_requested:
-                break
+            if _shutdown_event.is_set():
+                return
             for obj in page.get("Contents") or []:
-                if _shutdown_requested:
-                    break
                 key = obj["Key"]
                 size = obj["Size"]
                 etag = (obj.get("ETag") or "").strip('"')
                 
                 if not key or key.endswith("/"):
                     continue
-                if key.lower().endswith(exclude):
+                if excluded(key):
                     continue
 
                 rel = key[prefix_len:].lstrip("/") if prefix_len else key
                 # 安全检查：防止路径遍历攻击
-                if ".." in rel or rel.startswith("/"):
+                if rel.startswith("/") or UNSAFE_REL_RE.search(rel):
                     print(f"  跳过不安全路径: {key}")
                     continue
-                local = os.path.join(args.out, rel)
+                local = out_prefix + rel
                 
                 # 如果本地已存在且大小一致，就不占配额，直接标记为 already_present
-                if os.path.exists(local) and os.path.getsize(local) == size:
+                if local_size(local) == size:
                     already_cnt += 1
                     
                     # 添加到文件夹统计
@@ -1106,53 +1877,29 @@ def main():
 
                 total_size += size
                 total_to_dl += 1
-                to_download.append((key, size, local, etag))
                 
                 # 添加到文件夹统计（待下载）
                 if folder_tracker:
                     folder_tracker.add_file(key, size, args.prefix, status='pending')
-                
-    except (ClientError, BotoCoreError) as e:
-        print(f"错误: 列举S3对象失败: {e}")
-        if folder_tracker:
-            folder_tracker.write_csv(force=True)
-        sys.exit(1)
+                yield key, size, local, etag
 
-    print(f"将下载: {total_to_dl} 文件, {human(total_size)}（上限 {args.cap_gb} GB）")
-    print(f"已存在跳过: {already_cnt}")
-    
-    # 写入初始统计
-    if folder_tracker:
-        folder_tracker.write_csv(force=True)
-        folder_tracker.print_summary()
-    
-    # 清理历史临时文件
-    print("正在清理历史临时文件...")
-    cleaned = cleanup_temp_files(args.out)
-    if cleaned > 0:
-        print(f"已清理 {cleaned} 个历史临时文件")
-    
-    if _shutdown_requested:
-        if folder_tracker:
-            folder_tracker.write_csv(force=True)
-        print("用户中断")
-        return
-
-    # 第二遍：下载
-    for i, (key, size, local, etag) in enumerate(to_download):
-        if _shutdown_requested:
-            print("用户中断，停止下载")
-            break
+    # 下载（线程池并发；计数只在主线程中更新，无需加锁）
+    print("正在列举并下载...")
+    last_reap = time.monotonic()
+    futures = {}  # 只保存在途任务：future -> (key, size)
+    list_failed = False
 
+    def finish(fut):
+        nonlocal downloaded_cnt, downloaded_size, failed_cnt
+        key, size = futures.pop(fut)
+        if fut.cancelled():
+            return
         try:
-            ensure_dir(local)
-        except OSError:
-            failed_cnt += 1
-            continue
-            
-        print(f"[{i+1}/{total_to_dl}] {key} ({human(size)})")
-        
-        if download_with_retry(s3, args.bucket, key, local, size, etag):
+            ok = fut.result()
+        except Exception as e:
+            print(f"  {key} 下载异常: {e}")
+            ok = False
+        if ok:
             downloaded_cnt += 1
             downloaded_size += size
             
@@ -1162,13 +1909,59 @@ def main():
         else:
             failed_cnt += 1
 
+    with make_transfer_manager(s3, args.workers) as tm, ThreadPoolExecutor(max_workers=args.workers) as ex:
+        try:
+            for key, size, local, etag in iter_to_download():
+                if _shutdown_event.is_set():
+                    break
+
+                # 定期回收空闲连接
+                if time.monotonic() - last_reap >= CONNECTION_REAP_INTERVAL:
+                    reap_idle_connections(s3)
+                    last_reap = time.monotonic()
+
+                try:
+                    ensure_dir(local)
+                except OSError:
+                    failed_cnt += 1
+                    continue
+                    
+                print(f"[{total_to_dl}] {key} ({human(size)})")
+                fut = ex.submit(download_with_retry, s3, args.bucket, key, local, size, etag, tm)
+                futures[fut] = (key, size)
+                
+                # 在途任务过多时先处理已完成的（背压：下载跟不上时列举也随之暂停）
+                if len(futures) >= args.workers * 2:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        finish(fut)
+        except (ClientError, BotoCoreError) as e:
+            # 已提交的下载继续完成，随后以错误码退出
+            print(f"错误: 列举S3对象失败: {e}")
+            list_failed = True
+        
+        if _shutdown_event.is_set():
+            print("用户中断，停止下载")
+            ex.shutdown(wait=False, cancel_futures=True)
+        
+        for fut in as_completed(list(futures)):
+            finish(fut)
+    close_dir_fds()
+    if args.local_stat_cache:
+        save_local_stat_cache(args.out)
+
+    print(f"列举完成: 需下载 {total_to_dl} 文件, {human(total_size)}（上限 {args.cap_gb} GB）, "
+          f"已存在跳过 {already_cnt}")
+
     # 最终写入CSV
     if folder_tracker:
-        folder_tracker.write_csv(force=True)
+        folder_tracker.close()
         folder_tracker.print_summary()
     
     print(f"\n完成: 下载 {downloaded_cnt} 文件 ({human(downloaded_size)}), "
           f"跳过 {already_cnt} 已存在, 失败 {failed_cnt}")
+    if list_failed:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
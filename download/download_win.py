@@ -1,5 +1,6 @@
 
 import os, argparse, csv, datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import boto3
 from botocore import UNSIGNED
 from botocore.config import Config
@@ -9,31 +10,41 @@ def human(n: int) -> str:
     while s>=1024 and i<len(u)-1: s/=1024; i+=1
     return f"{s:.2f} {u[i]}"
 
+_dir_seen = set()  # 已创建/确认存在的目录；ensure_dir 只在主线程调用，无需加锁
+
 def ensure_dir(p: str):
-    os.makedirs(os.path.dirname(p), exist_ok=True)
-
-def write_csv_header_if_needed(csv_path: str):
-    if not csv_path: return
-    need_header = (not os.path.exists(csv_path)) or (os.path.getsize(csv_path)==0)
-    if need_header:
-        with open(csv_path, "w", newline="", encoding="utf-8") as f:
-            w = csv.writer(f)
-            w.writerow([
-                "timestamp_iso",
-                "bucket",
-                "key",
-                "size_bytes",
-                "size_human",
-                "etag",
-                "last_modified_iso",
-                "local_path",
-                "status"  # downloaded | already_present
-            ])
-
-def append_csv_row(csv_path: str, row: list):
-    if not csv_path: return
-    with open(csv_path, "a", newline="", encoding="utf-8") as f:
-        csv.writer(f).writerow(row)
+    d = os.path.dirname(p)
+    if d in _dir_seen: return
+    os.makedirs(d, exist_ok=True)
+    _dir_seen.add(d)
+
+def stat_or_none(p: str):
+    """一次 stat 同时得到"是否存在"和大小，不存在返回 None"""
+    try:
+        return os.stat(p)
+    except OSError:
+        return None
+
+CSV_FLUSH_EVERY = 1000  # 每写多少行 flush 一次
+
+def open_csv(csv_path: str, append: bool):
+    """整个运行期间只打开一次 CSV（1MB 缓冲），返回 (文件句柄, csv.writer)；未指定路径时返回 (None, None)"""
+    if not csv_path: return None, None
+    f = open(csv_path, "a" if append else "w", newline="", encoding="utf-8", buffering=1 << 20)
+    w = csv.writer(f)
+    if f.tell() == 0:
+        w.writerow([
+            "timestamp_iso",
+            "bucket",
+            "key",
+            "size_bytes",
+            "size_human",
+            "etag",
+            "last_modified_iso",
+            "local_path",
+            "status"  # downloaded | already_present
+        ])
+    return f, w
 
 def main():
     ap = argparse.ArgumentParser("Download from S3 with total-size cap, export CSV for downloaded files")
@@ -46,12 +57,19 @@ def main():
     ap.add_argument("--dryrun", action="store_true")
     ap.add_argument("--csv", help="CSV path to log downloaded/already_present files of THIS RUN")
     ap.add_argument("--append", action="store_true", help="append to CSV if exists (default overwrite)")
+    ap.add_argument("--workers", type=int, default=16, help="concurrent download threads")
     args = ap.parse_args()
 
     exclude = tuple(e.strip().lower() for e in args.exclude_ext.split(",") if e.strip())
+    # 都是 ".json" 这种单段扩展名时改用集合查找；含 ".tar.gz" 等多段后缀时仍用 endswith
+    exclude_exts = ({e[1:] for e in exclude}
+                    if exclude and all(e.startswith(".") and e.count(".") == 1 for e in exclude) else None)
     cap_bytes = int(args.cap_gb * 1024**3)
 
-    s3 = boto3.client("s3", config=Config(signature_version=UNSIGNED), region_name=args.region)
+    workers = max(1, args.workers)
+    # 连接池与并发线程数匹配，避免线程间抢连接
+    s3 = boto3.client("s3", config=Config(signature_version=UNSIGNED, max_pool_connections=workers * 2),
+                      region_name=args.region)
     paginator = s3.get_paginator("list_objects_v2")
     pages = paginator.paginate(Bucket=args.bucket, Prefix=args.prefix)
 
@@ -66,14 +84,19 @@ def main():
             etag = (obj.get("ETag") or "").strip('"')
             last_modified = obj.get("LastModified")  # datetime or None
  
-            # 后缀过滤
-            if key.lower().endswith(exclude):
+            # 后缀过滤：只取最后一个点之后的扩展名转小写，查集合
+            if exclude_exts:
+                dot = key.rfind(".")
+                if dot >= 0 and key[dot + 1:].lower() in exclude_exts:
+                    continue
+            elif exclude and key.lower().endswith(exclude):
                 continue
 
             # 如果本地已存在且大小一致，就不占配额，直接标记为 already_present
             rel = key[len(args.prefix):].lstrip("/") if args.prefix else key
             local = os.path.join(args.out, rel)
-            if os.path.exists(local) and os.path.getsize(local) == size:
+            st = stat_or_none(local)
+            if st is not None and st.st_size == size:
                 selected.append((key, size, etag, last_modified, local, "already_present"))
                 continue
 
@@ -99,30 +122,47 @@ def main():
         return
 
     # CSV 头（覆盖/追加）
-    if args.csv and not args.append and os.path.exists(args.csv):
-        os.remove(args.csv)
-    write_csv_header_if_needed(args.csv)
+    csv_fp, writer = open_csv(args.csv, args.append)
 
     now_iso = datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
 
-    # 先把 already_present 也记到 CSV（方便合并统计）
-    for key, size, etag, lm, local, status in already:
-        append_csv_row(args.csv, [
-            now_iso, args.bucket, key, size, human(size),
-            etag, (lm.isoformat() if hasattr(lm, "isoformat") else ""),
-            os.path.abspath(local), "already_present"
-        ])
-
-    # 正式下载 & 记录 CSV
-    for key, size, etag, lm, local, status in to_dl:
-        ensure_dir(local)
-        print("Downloading:", key, "->", local, f"({human(size)})")
-        s3.download_file(args.bucket, key, local)
-        append_csv_row(args.csv, [
-            now_iso, args.bucket, key, size, human(size),
-            etag, (lm.isoformat() if hasattr(lm, "isoformat") else ""),
-            os.path.abspath(local), "downloaded"
-        ])
+    def row(key, size, etag, lm, local, status):
+        return [now_iso, args.bucket, key, size, human(size),
+                etag, (lm.isoformat() if hasattr(lm, "isoformat") else ""),
+                os.path.abspath(local), status]
+
+    try:
+        # 先把 already_present 也记到 CSV（方便合并统计），一次 writerows
+        if writer:
+            writer.writerows(row(*x) for x in already)
+
+        # 正式下载 & 记录 CSV：下载在线程池中并发进行，CSV 只在主线程中写入
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            futures = {}
+            for item in to_dl:
+                key, size, etag, lm, local, status = item
+                ensure_dir(local)
+                print("Downloading:", key, "->", local, f"({human(size)})")
+                futures[ex.submit(s3.download_file, args.bucket, key, local)] = item
+            failed = 0
+            for n, fut in enumerate(as_completed(futures), 1):
+                key, size, etag, lm, local, status = futures[fut]
+                try:
+                    fut.result()
+                except Exception as e:
+                    # 单个文件失败不中断整批，其他文件照常记录 CSV
+                    failed += 1
+                    print(f"  {key} 下载失败，已跳过: {e}")
+                    continue
+                if writer:
+                    writer.writerow(row(key, size, etag, lm, local, "downloaded"))
+                    if n % CSV_FLUSH_EVERY == 0:
+                        csv_fp.flush()
+        if failed:
+            print(f"下载失败 {failed} 个文件（未记录到 CSV）")
+    finally:
+        if csv_fp:
+            csv_fp.close()
 
 if __name__ == "__main__":
     main()
@@ -3,6 +3,9 @@ import random
 import re
 import argparse
 
+# 文件名格式：scene_xxxx_(IMG|BLG|AGL).(png|tif)，模块加载时编译一次
+SCENE_PATTERN = re.compile(r'scene_(\d{4})_(IMG|BLG|AGL)\.(png|tif)$', re.IGNORECASE)
+
 def split_dataset(data_dir, ratios=(0.8, 0.1, 0.1), output_dir='.'):
     """
     划分数据集并生成文件列表
@@ -17,21 +20,19 @@ def split_dataset(data_dir, ratios=(0.8, 0.1, 0.1), output_dir='.'):
     if abs(sum(ratios) - 1.0) > 1e-6:
         raise ValueError("比例总和必须为1.0")
     
-    # 获取所有符合条件的文件名
-    pattern = re.compile(r'scene_(\d{4})_(IMG|BLG|AGL)\.(png|tif)$', re.IGNORECASE)
-
-    files = sorted([
-        f for f in os.listdir(data_dir) 
-        if pattern.match(f)
-    ],key = lambda x : int(pattern.match(x).group(1))
-    )
+    # 一次遍历目录，每个文件名只匹配一次，直接收集唯一的场景ID（避免不同后缀的相同场景被拆分）
+    scene_ids = set()
+    with os.scandir(data_dir) as it:
+        for entry in it:
+            m = SCENE_PATTERN.match(entry.name)
+            if m:
+                scene_ids.add(m.group(1))
     
-    if not files:
+    if not scene_ids:
         print("未找到scene_xxxx格式的文件")
         return
     
-    # 提取所有唯一的场景ID（避免不同后缀的相同场景被拆分）
-    scene_ids = sorted({pattern.match(f).group(1) for f in files})
+    scene_ids = sorted(scene_ids)
 
     random_seed = 42
     random.seed(random_seed)
@@ -3,7 +3,29 @@ import tqdm
 import numpy as np
 from PIL import Image
 import re
-
+import warnings
+from functools import lru_cache
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool
+
+# 可选依赖：DSM 着色的融合内核需要 numba，未安装时退回 NumPy 实现
+try:
+    from numba import njit, prange
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+# 可选依赖：直接解码成 NumPy 数组，省去 PIL 中间对象和一次整图复制；未安装时退回 PIL
+try:
+    import tifffile
+    HAS_TIFFFILE = True
+except ImportError:
+    HAS_TIFFFILE = False
+try:
+    import imageio.v3 as iio
+    HAS_IMAGEIO = True
+except ImportError:
+    HAS_IMAGEIO = False
 
 
 Vaihingen_COLOR_MAP = [
@@ -14,7 +36,109 @@ Vaihingen_COLOR_MAP = [
     [255, 255, 0],  # 汽车 Car (RGB: 255, 255, 0)
     [255, 0, 0]  # 背景 Clutter/background (RGB: 255, 0, 0)
 ]
+# 类别索引图保存为调色板（P 模式）PNG 用的调色板，补齐到256色
+Vaihingen_PALETTE = bytes(c for color in Vaihingen_COLOR_MAP for c in color).ljust(768, b'\0')
+PNG_COMPRESS_LEVEL = 1  # zlib 最快档：文件稍大，但编码快得多
+# 从 Label 文件名解析场景编号的正则，模块加载时编译一次
+POTSDAM_PATTERN = re.compile(r'(\d+)_(\d+)')
+GAMUS_PATTERN = re.compile(r'(.*_)(\w+)\.(\w+)')
+
+
+def _jet_colors(normalized):
+    """jet 颜色映射（蓝-青-绿-黄-红 渐变），输入0-1的归一化数组，返回 (..., 3) 的0-1浮点RGB"""
+    rgb_image = np.zeros((*normalized.shape, 3))
+    rgb_image[..., 0] = np.clip(np.minimum(4*normalized-1.5, -4*normalized+4.5), 0, 1)  # Red
+    rgb_image[..., 1] = np.clip(np.minimum(4*normalized-0.5, -4*normalized+3.5), 0, 1)  # Green
+    rgb_image[..., 2] = np.clip(np.minimum(4*normalized+0.5, -4*normalized+2.5), 0, 1)  # Blue
+    return rgb_image
+
+def _thermal_colors(normalized):
+    """thermal 颜色映射，输入0-1的归一化数组，返回 (..., 3) 的0-1浮点RGB"""
+    # 经典热成像色彩：黑色-深蓝-紫色-红色-黄色-白色
+    rgb_image = np.zeros((*normalized.shape, 3))
+    
+    # 阶段1: 黑色到深蓝 (0-0.2)
+    mask1 = normalized < 0.2
+    progress = normalized[mask1] / 0.2
+    rgb_image[mask1, 0] = 0.0  # Red: 0
+    rgb_image[mask1, 1] = 0.0  # Green: 0
+    rgb_image[mask1, 2] = progress * 0.5  # Blue: 0 -> 0.5
+    
+    # 阶段2: 深蓝到紫色 (0.2-0.4)
+    mask2 = (normalized >= 0.2) & (normalized < 0.4)
+    progress = (normalized[mask2] - 0.2) / 0.2
+    rgb_image[mask2, 0] = progress * 0.5  # Red: 0 -> 0.5
+    rgb_image[mask2, 1] = 0.0  # Green: 0
+    rgb_image[mask2, 2] = 0.5 + progress * 0.3  # Blue: 0.5 -> 0.8
+    
+    # 阶段3: 紫色到红色 (0.4-0.6)
+    mask3 = (normalized >= 0.4) & (normalized < 0.6)
+    progress = (normalized[mask3] - 0.4) / 0.2
+    rgb_image[mask3, 0] = 0.5 + progress * 0.5  # Red: 0.5 -> 1.0
+    rgb_image[mask3, 1] = 0.0  # Green: 0
+    rgb_image[mask3, 2] = 0.8 - progress * 0.8  # Blue: 0.8 -> 0
+    
+    # 阶段4: 红色到黄色 (0.6-0.8)
+    mask4 = (normalized >= 0.6) & (normalized < 0.8)
+    progress = (normalized[mask4] - 0.6) / 0.2
+    rgb_image[mask4, 0] = 1.0  # Red: 1.0
+    rgb_image[mask4, 1] = progress  # Green: 0 -> 1.0
+    rgb_image[mask4, 2] = 0.0  # Blue: 0
+    
+    # 阶段5: 黄色到白色 (0.8-1.0)
+    mask5 = normalized >= 0.8
+    progress = (normalized[mask5] - 0.8) / 0.2
+    rgb_image[mask5, 0] = 1.0  # Red: 1.0
+    rgb_image[mask5, 1] = 1.0  # Green: 1.0
+    rgb_image[mask5, 2] = progress  # Blue: 0 -> 1.0
+    return rgb_image
 
+def _build_lut(color_fn):
+    """在256个量化级别上计算一次颜色映射，得到 (256, 3) 的uint8调色板"""
+    return (color_fn(np.linspace(0.0, 1.0, 256)) * 255).astype(np.uint8)
+
+_COLORMAP_LUTS = {
+    'jet': _build_lut(_jet_colors),
+    'thermal': _build_lut(_thermal_colors),
+}
+
+if HAS_NUMBA:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _thermal_kernel(norm, out):
+        """热成像着色：每个像素只访问一次，分段公式内联，直接写 uint8（与 _thermal_colors 一样 x*255 截断取整）"""
+        for i in prange(norm.shape[0]):
+            for j in range(norm.shape[1]):
+                v = norm[i, j]
+                if v < 0.2:
+                    r, g, b = 0.0, 0.0, v / 0.2 * 0.5
+                elif v < 0.4:
+                    p = (v - 0.2) / 0.2
+                    r, g, b = p * 0.5, 0.0, 0.5 + p * 0.3
+                elif v < 0.6:
+                    p = (v - 0.4) / 0.2
+                    r, g, b = 0.5 + p * 0.5, 0.0, 0.8 - p * 0.8
+                elif v < 0.8:
+                    p = (v - 0.6) / 0.2
+                    r, g, b = 1.0, p, 0.0
+                else:
+                    p = (v - 0.8) / 0.2
+                    r, g, b = 1.0, 1.0, p
+                out[i, j, 0] = np.uint8(r * 255)
+                out[i, j, 1] = np.uint8(g * 255)
+                out[i, j, 2] = np.uint8(b * 255)
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _jet_kernel(norm, out):
+        """jet 着色的融合版本"""
+        for i in prange(norm.shape[0]):
+            for j in range(norm.shape[1]):
+                v = norm[i, j]
+                r = min(max(min(4 * v - 1.5, -4 * v + 4.5), 0.0), 1.0)
+                g = min(max(min(4 * v - 0.5, -4 * v + 3.5), 0.0), 1.0)
+                b = min(max(min(4 * v + 0.5, -4 * v + 2.5), 0.0), 1.0)
+                out[i, j, 0] = np.uint8(r * 255)
+                out[i, j, 1] = np.uint8(g * 255)
+                out[i, j, 2] = np.uint8(b * 255)
 
 def DSM2RGB(dsm_array, colormap='viridis'):
     """
@@ -27,76 +151,44 @@ def DSM2RGB(dsm_array, colormap='viridis'):
     Returns:
         RGB图像数组 (numpy array, shape: H x W x 3)
     """
-    # 处理无效值（如果有的话）
-    valid_mask = np.isfinite(dsm_array)
-
-    if not np.any(valid_mask):
-        # 如果全是无效值，返回黑色图像
-        return np.zeros((*dsm_array.shape, 3), dtype=np.uint8)
-    
-    # 获取有效值的范围
-    min_val = np.min(dsm_array[valid_mask])
-    max_val = np.max(dsm_array[valid_mask])
+    # 获取有效值的范围：nanmin/nanmax 各遍历一遍，不再构造有效值掩码和有效值副本
+    with np.errstate(invalid='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # 全是 NaN 时 nanmin 会告警，下面单独处理
+        min_val = np.nanmin(dsm_array)
+        max_val = np.nanmax(dsm_array)
+
+    if not (np.isfinite(min_val) and np.isfinite(max_val)):
+        # 含 ±inf（或全是 NaN）时，按有效值掩码计算范围
+        valid_mask = np.isfinite(dsm_array)
+        if not np.any(valid_mask):
+            # 如果全是无效值，返回黑色图像
+            return np.zeros((*dsm_array.shape, 3), dtype=np.uint8)
+        min_val = np.min(dsm_array[valid_mask])
+        max_val = np.max(dsm_array[valid_mask])
     
     # 避免除零
     if max_val == min_val:
         normalized = np.zeros_like(dsm_array)
     else:
-        # 归一化到0-1范围
-        normalized = (dsm_array - min_val) / (max_val - min_val)
-        # 处理无效值
-        normalized[~valid_mask] = 0
+        # 归一化到0-1范围，无效值（NaN/±inf）原地置0
+        normalized = (dsm_array - min_val) * (1.0 / (max_val - min_val))
+        np.nan_to_num(normalized, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
     
-    # 应用不同的颜色映射
-    if colormap == 'jet':
-        # 蓝-青-绿-黄-红 渐变
-        rgb_image = np.zeros((*dsm_array.shape, 3))
-        rgb_image[:,:,0] = np.clip(np.minimum(4*normalized-1.5, -4*normalized+4.5), 0, 1)  # Red
-        rgb_image[:,:,1] = np.clip(np.minimum(4*normalized-0.5, -4*normalized+3.5), 0, 1)  # Green
-        rgb_image[:,:,2] = np.clip(np.minimum(4*normalized+0.5, -4*normalized+2.5), 0, 1)  # Blue
-
-        
-    elif colormap == 'thermal':
-        # 经典热成像色彩：黑色-深蓝-紫色-红色-黄色-白色
-        rgb_image = np.zeros((*dsm_array.shape, 3))
-        
-        # 阶段1: 黑色到深蓝 (0-0.2)
-        mask1 = normalized < 0.2
-        progress = normalized[mask1] / 0.2
-        rgb_image[mask1, 0] = 0.0  # Red: 0
-        rgb_image[mask1, 1] = 0.0  # Green: 0
-        rgb_image[mask1, 2] = progress * 0.5  # Blue: 0 -> 0.5
-        
-        # 阶段2: 深蓝到紫色 (0.2-0.4)
-        mask2 = (normalized >= 0.2) & (normalized < 0.4)
-        progress = (normalized[mask2] - 0.2) / 0.2
-        rgb_image[mask2, 0] = progress * 0.5  # Red: 0 -> 0.5
-        rgb_image[mask2, 1] = 0.0  # Green: 0
-        rgb_image[mask2, 2] = 0.5 + progress * 0.3  # Blue: 0.5 -> 0.8
-        
-        # 阶段3: 紫色到红色 (0.4-0.6)
-        mask3 = (normalized >= 0.4) & (normalized < 0.6)
-        progress = (normalized[mask3] - 0.4) / 0.2
-        rgb_image[mask3, 0] = 0.5 + progress * 0.5  # Red: 0.5 -> 1.0
-        rgb_image[mask3, 1] = 0.0  # Green: 0
-        rgb_image[mask3, 2] = 0.8 - progress * 0.8  # Blue: 0.8 -> 0
-        
-        # 阶段4: 红色到黄色 (0.6-0.8)
-        mask4 = (normalized >= 0.6) & (normalized < 0.8)
-        progress = (normalized[mask4] - 0.6) / 0.2
-        rgb_image[mask4, 0] = 1.0  # Red: 1.0
-        rgb_image[mask4, 1] = progress  # Green: 0 -> 1.0
-        rgb_image[mask4, 2] = 0.0  # Blue: 0
-        
-        # 阶段5: 黄色到白色 (0.8-1.0)
-        mask5 = normalized >= 0.8
-        progress = (normalized[mask5] - 0.8) / 0.2
-        rgb_image[mask5, 0] = 1.0  # Red: 1.0
-        rgb_image[mask5, 1] = 1.0  # Green: 1.0
-        rgb_image[mask5, 2] = progress  # Blue: 0 -> 1.0
-
-    else:  # 默认灰度
-        rgb_image = np.stack([normalized] * 3, axis=-1)
+    # 有 numba 时用融合内核：一次遍历直接生成 uint8 图像，不产生逐阶段的掩码和 float64 中间结果
+    if HAS_NUMBA and colormap in ('jet', 'thermal') and normalized.ndim == 2:
+        rgb_image = np.empty((*normalized.shape, 3), dtype=np.uint8)
+        kernel = _jet_kernel if colormap == 'jet' else _thermal_kernel
+        kernel(np.ascontiguousarray(normalized, dtype=np.float64), rgb_image)
+        return rgb_image
+
+    # 应用不同的颜色映射：输出本来就是8位，把归一化值量化成0-255后查256项调色板，一次索引得到uint8图像
+    lut = _COLORMAP_LUTS.get(colormap)
+    if lut is not None:
+        idx = np.clip(normalized * 255.0, 0, 255).astype(np.uint8)
+        return lut[idx]
+
+    # 默认灰度
+    rgb_image = np.stack([normalized] * 3, axis=-1)
     
     # 转换为0-255的uint8格式
     rgb_image = (rgb_image * 255).astype(np.uint8)
@@ -104,237 +196,278 @@ def DSM2RGB(dsm_array, colormap='viridis'):
     return rgb_image
 
 def Label2RGB(label, COLOR_MAP):
-    height, width = label.shape[0], label.shape[1]
-    temp_mask = np.zeros(shape=(height, width))
-    temp_mask = np.stack([temp_mask]*3,axis=-1)
-    for index, color in enumerate(COLOR_MAP):
-        locations = label==index
-        locations = np.stack([locations]*3, axis=-1)
-        temp_mask = np.where(locations, color, temp_mask)
-    return temp_mask.astype(dtype=np.uint8)
+    # 调色板补齐到256项（多出的类别值保持黑色），一次花式索引直接得到 H x W x 3 的uint8图像
+    palette = np.zeros((256, 3), dtype=np.uint8)
+    palette[:len(COLOR_MAP)] = COLOR_MAP
+    return palette[label.astype(np.uint8, copy=False)]
+
+@lru_cache(maxsize=4)
+def _color_lut(colors):
+    """24位打包颜色 (r<<16|g<<8|b) -> 类别索引 的查找表（16MB），不在颜色表中的颜色映射为0"""
+    lut = np.zeros(1 << 24, dtype=np.int8)
+    for index, (r, g, b) in enumerate(colors):
+        lut[(r << 16) | (g << 8) | b] = index
+    return lut
 
 def RGB2Label(label, COLOR_MAP):
-    height, width = label.shape[0], label.shape[1]
-    temp_mask = np.zeros(shape=(height, width))
-    for index, color in enumerate(COLOR_MAP):
-        locations = np.all(label == color, axis=-1)
-        temp_mask[locations] = index
-    return temp_mask.astype(dtype=np.int8)
+    # 把RGB打包成一个24位整数，查表一次得到类别，只遍历图像一遍（原先每个类别各扫一遍）
+    lut = _color_lut(tuple(map(tuple, COLOR_MAP)))
+    packed = label[..., 0].astype(np.uint32) << 16
+    packed |= label[..., 1].astype(np.uint32) << 8
+    packed |= label[..., 2]
+    return lut[packed]
+
+
+def read_image(path, index=False):
+    """
+    读取图像为 NumPy 数组：TIF 优先用 tifffile，其他格式优先用 imageio，都没有时用 PIL
+    index=True 表示类别索引图：imageio 会把调色板 PNG 展开成 RGB，这类文件仍用 PIL 读取以保留索引值
+    """
+    if HAS_TIFFFILE and path.lower().endswith(('.tif', '.tiff')):
+        return tifffile.imread(path)
+    if HAS_IMAGEIO and not index:
+        return iio.imread(path)
+    return np.array(Image.open(path))
+
+def list_files(path):
+    """用 os.scandir 列出目录下的文件名（跳过子目录），类型信息来自目录读取本身"""
+    with os.scandir(path) as it:
+        return [e.name for e in it if e.is_file()]
+
+def tile_views(arr, split_size, stride, rows, cols):
+    """
+    用 sliding_window_view 生成切片视图，形状 (行数, 列数, split_size, split_size[, C])，不复制数据
+    先裁到 rows x cols 个切片覆盖的范围，使 DSM/RGB/Label 三者的切片一一对应
+    """
+    arr = arr[:(rows - 1) * stride + split_size, :(cols - 1) * stride + split_size]
+    window = (split_size, split_size) + arr.shape[2:]
+    view = np.lib.stride_tricks.sliding_window_view(arr, window)[::stride, ::stride]
+    # 通道维的窗口取满，滑动结果只有一个位置，去掉这些长度为1的维
+    return view[(slice(None), slice(None)) + (0,) * (arr.ndim - 2)]
+
+
+class TileWriter:
+    """
+    切片的保存放到线程池里进行：PNG/TIF 编码（zlib 会释放 GIL）和写盘与主线程切下一块重叠
+    在途任务最多 max_pending 个，超出时先等最早的完成，避免切片积压占满内存；保存出错会在主线程抛出
+    切片视图是不连续的，PIL 会先在内部复制成连续数组；这里改为复制到可复用的连续缓冲区，
+    每个在途任务占一块，保存完成后归还，稳定后不再为切片分配内存
+    """
+    def __init__(self, max_workers=8, max_pending=64):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.pending = deque()
+        self.max_pending = max_pending
+        self.free_buffers = {}  # (shape, dtype) -> deque 空闲缓冲区；归还在工作线程里进行，deque 的 append/pop 线程安全
+
+    def _buffer(self, shape, dtype):
+        free = self.free_buffers.setdefault((shape, dtype), deque())
+        try:
+            return free.pop(), free
+        except IndexError:
+            return np.empty(shape, dtype=dtype), free
+
+    @staticmethod
+    def _save(arr, path, palette=None):
+        if palette is not None:
+            # 类别索引图：8位灰度图挂上调色板即为 P 模式，像素值（类别索引）不变，PNG 更小、编码更快
+            img = Image.fromarray(arr)
+            img.putpalette(palette)
+        else:
+            img = Image.fromarray(arr)
+        if path.endswith('.png'):
+            img.save(path, compress_level=PNG_COMPRESS_LEVEL, optimize=False)
+        else:
+            img.save(path)
+
+    def save(self, arr, path, palette=None):
+        if len(self.pending) >= self.max_pending:
+            self.pending.popleft().result()
+        # 调色板图直接复制成 uint8，类型转换和连续化一次完成
+        buf, free = self._buffer(arr.shape, np.dtype(np.uint8) if palette is not None else arr.dtype)
+        np.copyto(buf, arr, casting='unsafe')
+        fut = self.pool.submit(self._save, buf, path, palette)
+        fut.add_done_callback(lambda _: free.append(buf))
+        self.pending.append(fut)
+
+    def close(self):
+        try:
+            while self.pending:
+                self.pending.popleft().result()
+        finally:
+            self.pool.shutdown(wait=True)
+
+
+def tile_grid(paths, split_size, stride):
+    """只读文件头拿到尺寸（PIL 打开时不解码像素），算出切片的行数和列数"""
+    min_x = min_y = None
+    for path in paths:
+        with Image.open(path) as img:
+            width, height = img.size
+        min_x = height if min_x is None else min(min_x, height)
+        min_y = width if min_y is None else min(min_y, width)
+    #方块可移动的距离除以每次移动的距离，得出第二个方块及以后的数量，最终数量要加上第一个方块
+    return ((min_x-split_size) // stride ) +1, ((min_y-split_size) // stride ) +1
+
+def _process_one(args):
+    """
+    在子进程中处理一个源文件：读取 RGB/DSM/Label，切片并保存，返回 (文件名, 写出的切片数)
+    切片编号从 idx_base 起连续分配，各文件的编号区间由父进程预先算好，互不重叠
+    """
+    (file, paths, out_dirs, exts, idx_base, split_size, stride, range_x, range_y,
+     color_map, palette) = args
+    #进行数据的读取
+    rgb_path, dsm_path, label_path = paths
+    image = read_image(rgb_path)
+    dsm = read_image(dsm_path)
+    mask = read_image(label_path, index=color_map is None)
+    if color_map is not None:
+        # 将像素值进行对应的转换
+        mask = RGB2Label(label=mask, COLOR_MAP=color_map)
+
+    dsm_dir, rgb_dir, label_dir = out_dirs
+    dsm_ext, rgb_ext, label_ext = exts
+    writer = TileWriter(max_workers=2)  # 各进程已并行，进程内少开几个保存线程
+    save = writer.save  # 循环里直接调用，省去每个切片的属性查找
+    num = idx_base
+    try:
+        dsm_tiles = tile_views(dsm, split_size, stride, range_x, range_y)
+        image_tiles = tile_views(image, split_size, stride, range_x, range_y)
+        mask_tiles = tile_views(mask, split_size, stride, range_x, range_y)
+        for dsm_row, image_row, mask_row in zip(dsm_tiles, image_tiles, mask_tiles):
+            for split_dsm, split_image, split_mask in zip(dsm_row, image_row, mask_row):
+                save(split_dsm, dsm_dir + f'{num}{dsm_ext}')
+                save(split_image, rgb_dir + f'{num}{rgb_ext}')
+                save(split_mask, label_dir + f'{num}{label_ext}', palette=palette)
+                num += 1
+    finally:
+        writer.close()
+    return file, num - idx_base
+
+def split_dataset(dataset, split_size, cover_size, processes=None):
+    """
+    按文件并行切片：先只读文件头算出每个文件的切片数，给各文件分配不重叠的起始编号，
+    再用进程池并行完成解码、标签转换、切片和编码，切片文件名仍为连续的 str(num) + 后缀
+    """
+    # 创建目标目录
+    os.makedirs(os.path.join(dataset.target_path, 'DSM'), exist_ok=True)
+    os.makedirs(os.path.join(dataset.target_path, 'RGB'), exist_ok=True)
+    os.makedirs(os.path.join(dataset.target_path, 'Label'), exist_ok=True)
+    # 输出目录前缀只拼一次，循环里每个切片只做一次字符串拼接
+    out_dirs = (os.path.join(dataset.target_path, 'DSM', ''),
+                os.path.join(dataset.target_path, 'RGB', ''),
+                os.path.join(dataset.target_path, 'Label', ''))
+    stride = split_size - cover_size  # 相邻切片起点的间隔
+
+    # 第一遍：按文件顺序分配编号区间，编号与串行处理时一致
+    tasks = []
+    num = 0
+    for file in dataset.file_flag:
+        paths = dataset.source_paths(file)
+        if paths is None:
+            continue
+        range_x, range_y = tile_grid(paths, split_size, stride)
+        if range_x <= 0 or range_y <= 0:
+            continue  # 图像比切片还小
+        tasks.append((file, paths, out_dirs, dataset.TILE_EXTS, num, split_size, stride,
+                      range_x, range_y, dataset.COLOR_MAP, dataset.PALETTE))
+        num += range_x * range_y
+
+    # 第二遍：各文件互相独立，交给进程池，完成顺序不影响文件名
+    num_tif = 0
+    tqdm_flag = tqdm.tqdm(total=len(tasks))
+    with Pool(processes=processes or os.cpu_count()) as pool:
+        for file, count in pool.imap_unordered(_process_one, tasks):
+            num_tif += count
+            tqdm_flag.set_description(file, refresh=False)  # 文件名显示在进度条上，不再逐个打印
+            tqdm_flag.update()
+    print(f'the number of png is {num_tif}')
+    tqdm_flag.close()
 
 
 class Vaihingen:
+    TILE_EXTS = ('.tif', '.png', '.png')  # DSM, RGB, Label 切片的后缀
+    COLOR_MAP = Vaihingen_COLOR_MAP  # Label 为彩色图，切片前转成类别索引
+    PALETTE = Vaihingen_PALETTE
+
     def __init__(self, dataset_path, target_path):
         self.dataset_path = dataset_path
         self.target_path = target_path
         self.DSM_path = os.path.join(dataset_path, 'DSM')
         self.RGB_path = os.path.join(dataset_path, 'RGB')
         self.Label_path = os.path.join(dataset_path, 'Label')
-        self.file_flag = os.listdir(self.Label_path)
-
-    def start_dealWith(self, split_size, cover_size):
-        # 创建目标目录
-        os.makedirs(os.path.join(self.target_path, 'DSM'), exist_ok=True)
-        os.makedirs(os.path.join(self.target_path, 'RGB'), exist_ok=True)
-        os.makedirs(os.path.join(self.target_path, 'Label'), exist_ok=True)
-        
-        num_tif = 0
-        num = 0
-        tqdm_flag = tqdm.tqdm(self.file_flag, total=len(self.file_flag))
-        for file in tqdm_flag:
-            print(f'Processing file: {file}')
-            #进行数据的读取
-            image = np.array(Image.open(os.path.join(self.RGB_path, file)))
-            dsm = np.array(Image.open(os.path.join(self.DSM_path, 'dsm_09cm_matching_'+ file.split('_')[-1].split('.')[0] + '.tif')))
-            label = np.array(Image.open(os.path.join(self.Label_path, file)))
-            
-            # 将像素值进行对应的转换
-            mask = RGB2Label(label=label, COLOR_MAP=Vaihingen_COLOR_MAP)
-            # 开始进行切割
-            # cover_size = 256
-            min_x = min(image.shape[0], dsm.shape[0], mask.shape[0])
-            min_y = min(image.shape[1], dsm.shape[1], mask.shape[1])
-            range_x = ((min_x-split_size) // (split_size-cover_size) ) +1
-            range_y = ((min_y-split_size) // (split_size-cover_size) ) +1
-
-            #原先版本，无重叠切割
-            # for x in range(range_x):
-            #     for y in range(range_y):
-            #         split_dsm = dsm[x * split_size:(x + 1) * split_size, y * split_size:(y + 1) * split_size]
-            #         split_image = image[x * split_size:(x + 1) * split_size, y * split_size:(y + 1) * split_size]
-            #         split_mask = mask[x * split_size:(x + 1) * split_size, y * split_size:(y + 1) * split_size]
-            #         # Image.fromarray(split_dsm).save(os.path.join(self.target_path, 'DSM', str(num) + '.tif'))
-            #         # Image.fromarray(split_image).save(os.path.join(self.target_path, 'RGB', str(num) + '.png'))
-            #         # Image.fromarray(split_mask).save(os.path.join(self.target_path, 'Label', str(num) + '.png'))
-            #         num += 1
-            # num_tif += (x+1)*(y+1)
-
-            for x in range(range_x):
-                for y in range(range_y):
-                    split_dsm = dsm[x * (split_size-cover_size):x * (split_size-cover_size) + split_size, y * (split_size-cover_size):y * (split_size-cover_size) + split_size]
-                    split_image = image[x * (split_size-cover_size):x * (split_size-cover_size) + split_size, y * (split_size-cover_size):y * (split_size-cover_size) + split_size]
-                    split_mask = mask[x * (split_size-cover_size):x * (split_size-cover_size) + split_size, y * (split_size-cover_size):y * (split_size-cover_size) + split_size]
-                    Image.fromarray(split_dsm).save(os.path.join(self.target_path, 'DSM', str(num) + '.tif'))
-                    Image.fromarray(split_image).save(os.path.join(self.target_path, 'RGB', str(num) + '.png'))
-                    Image.fromarray(split_mask).save(os.path.join(self.target_path, 'Label', str(num) + '.png'))
-                    num += 1
-            num_tif += (x+1)*(y+1)
-
-
-        print(f'the number of png is {num_tif}')
-        tqdm_flag.close()
+        self.file_flag = list_files(self.Label_path)
+
+    def source_paths(self, file):
+        """返回 (RGB, DSM, Label) 的完整路径"""
+        return (os.path.join(self.RGB_path, file),
+                os.path.join(self.DSM_path, 'dsm_09cm_matching_'+ file.split('_')[-1].split('.')[0] + '.tif'),
+                os.path.join(self.Label_path, file))
+
+    def start_dealWith(self, split_size, cover_size, processes=None):
+        split_dataset(self, split_size, cover_size, processes)
 
 class Potsdam:
+    TILE_EXTS = ('.tif', '.png', '.png')
+    COLOR_MAP = None
+    PALETTE = None
+
     def __init__(self, dataset_path, target_path):
         self.dataset_path = dataset_path
         self.target_path = target_path
         self.DSM_path = os.path.join(dataset_path, 'DSM')
         self.RGB_path = os.path.join(dataset_path, 'RGB')
         self.Label_path = os.path.join(dataset_path, 'Label')
-        self.file_flag = os.listdir(self.Label_path)
-
-    def start_dealWith(self, split_size, cover_size):
-        # 创建目标目录
-        os.makedirs(os.path.join(self.target_path, 'DSM'), exist_ok=True)
-        os.makedirs(os.path.join(self.target_path, 'RGB'), exist_ok=True)
-        os.makedirs(os.path.join(self.target_path, 'Label'), exist_ok=True)
-
-
-        regex = re.compile(r'(\d+)_(\d+)')
-        num_tif = 0
-        num = 0
-
-        tqdm_flag = tqdm.tqdm(self.file_flag, total=len(self.file_flag))
-        for file in tqdm_flag:
-            print(f'Processing file: {file}')
-            #进行数据的读取
-            result = regex.search(file)
-            if result:
-                dsm_path = fr'dsm_potsdam_{int(result.group(1)):02d}_{int(result.group(2)):02d}.tif'
-                rgb_path = fr'top_potsdam_{result.group()}_RGB.tif'
-                label_path = file
-
-            image = np.array(Image.open(os.path.join(self.RGB_path, rgb_path)))
-            dsm = np.array(Image.open(os.path.join(self.DSM_path, dsm_path)))
-            label = np.array(Image.open(os.path.join(self.Label_path, label_path)))
-            
-            # 将像素值进行对应的转换
-            #mask = RGB2Label(label=label, COLOR_MAP=Vaihingen_COLOR_MAP)
-            # 开始进行切割
-            #cover_size = 256
-            # min_x = min(image.shape[0], dsm.shape[0], mask.shape[0])
-            # min_y = min(image.shape[1], dsm.shape[1], mask.shape[1])
-            min_x = min(image.shape[0], dsm.shape[0], label.shape[0])
-            min_y = min(image.shape[1], dsm.shape[1], label.shape[1])
-            range_x = ((min_x-split_size) // (split_size-cover_size) ) +1  #方块可移动的距离除以每次移动的距离，得出第二个方块及以后的数量，最终数量要加上第一个方块
-            range_y = ((min_y-split_size) // (split_size-cover_size) ) +1
-
-            #原先版本，无重叠切割
-            # for x in range(range_x):
-            #     for y in range(range_y):
-            #         split_dsm = dsm[x * split_size:(x + 1) * split_size, y * split_size:(y + 1) * split_size]
-            #         split_image = image[x * split_size:(x + 1) * split_size, y * split_size:(y + 1) * split_size]
-            #         split_mask = mask[x * split_size:(x + 1) * split_size, y * split_size:(y + 1) * split_size]
-            #         # Image.fromarray(split_dsm).save(os.path.join(self.target_path, 'DSM', str(num) + '.tif'))
-            #         # Image.fromarray(split_image).save(os.path.join(self.target_path, 'RGB', str(num) + '.png'))
-            #         # Image.fromarray(split_mask).save(os.path.join(self.target_path, 'Label', str(num) + '.png'))
-            #         num += 1
-            # num_tif += (x+1)*(y+1)
-
-            for x in range(range_x):
-                for y in range(range_y):
-                    split_dsm = dsm[x * (split_size-cover_size):x * (split_size-cover_size) + split_size, y * (split_size-cover_size):y * (split_size-cover_size) + split_size]
-                    split_image = image[x * (split_size-cover_size):x * (split_size-cover_size) + split_size, y * (split_size-cover_size):y * (split_size-cover_size) + split_size]
-                    split_mask = label[x * (split_size-cover_size):x * (split_size-cover_size) + split_size, y * (split_size-cover_size):y * (split_size-cover_size) + split_size]
-                    Image.fromarray(split_dsm).save(os.path.join(self.target_path, 'DSM', str(num) + '.tif'))
-                    Image.fromarray(split_image).save(os.path.join(self.target_path, 'RGB', str(num) + '.png'))
-                    Image.fromarray(split_mask).save(os.path.join(self.target_path, 'Label', str(num) + '.png'))
-                    num += 1
-            num_tif += (x+1)*(y+1)
-
-
-        print(f'the number of png is {num_tif}')
-        tqdm_flag.close()
+        self.file_flag = list_files(self.Label_path)
+
+    def source_paths(self, file):
+        """返回 (RGB, DSM, Label) 的完整路径，文件名不符合命名规则时返回 None"""
+        result = POTSDAM_PATTERN.search(file)
+        if not result:
+            return None
+        dsm_path = fr'dsm_potsdam_{int(result.group(1)):02d}_{int(result.group(2)):02d}.tif'
+        rgb_path = fr'top_potsdam_{result.group()}_RGB.tif'
+        return (os.path.join(self.RGB_path, rgb_path),
+                os.path.join(self.DSM_path, dsm_path),
+                os.path.join(self.Label_path, file))
+
+    def start_dealWith(self, split_size, cover_size, processes=None):
+        split_dataset(self, split_size, cover_size, processes)
 
 class Gamus:
+    TILE_EXTS = ('.png', '.jpg', '.png')
+    COLOR_MAP = None
+    PALETTE = None
+
     def __init__(self, dataset_path, target_path):
         self.dataset_path = dataset_path
         self.target_path = target_path
         self.DSM_path = os.path.join(dataset_path, 'DSM')
         self.RGB_path = os.path.join(dataset_path, 'RGB')
         self.Label_path = os.path.join(dataset_path, 'Label')
-        self.file_flag = os.listdir(self.Label_path)
-
-    def start_dealWith(self, split_size, cover_size):
-        # 创建目标目录
-        os.makedirs(os.path.join(self.target_path, 'DSM'), exist_ok=True)
-        os.makedirs(os.path.join(self.target_path, 'RGB'), exist_ok=True)
-        os.makedirs(os.path.join(self.target_path, 'Label'), exist_ok=True)
-
-
-        regex = re.compile(r'(.*_)(\w+)\.(\w+)')
-        num_tif = 0
-        num = 0
-
-        tqdm_flag = tqdm.tqdm(self.file_flag, total=len(self.file_flag))
-        for file in tqdm_flag:
-            print(f'Processing file: {file}')
-            #进行数据的读取
-            result = regex.search(file)
-            if result:
-                dsm_path = fr'{result.group(1)}AGL.png'
-                rgb_path_1 = fr'{result.group(1)}RGB.jpg'
-                rgb_path_2 = fr'{result.group(1)}IMG.jpg'
-                if os.path.exists(os.path.join(self.RGB_path,rgb_path_1)):
-                    rgb_path = rgb_path_1
-                elif os.path.exists(os.path.join(self.RGB_path,rgb_path_2)):
-                    rgb_path = rgb_path_2
-                else:
-                    print(f"{rgb_path_1}不存在")
-                label_path = file
-
-            image = np.array(Image.open(os.path.join(self.RGB_path, rgb_path)))
-            dsm = np.array(Image.open(os.path.join(self.DSM_path, dsm_path)))
-            label = np.array(Image.open(os.path.join(self.Label_path, label_path)))
-
-            
-            # 将像素值进行对应的转换
-            #mask = RGB2Label(label=label, COLOR_MAP=Vaihingen_COLOR_MAP)
-            # 开始进行切割
-            #cover_size = 256
-            # min_x = min(image.shape[0], dsm.shape[0], mask.shape[0])
-            # min_y = min(image.shape[1], dsm.shape[1], mask.shape[1])
-            min_x = min(image.shape[0], dsm.shape[0], label.shape[0])
-            min_y = min(image.shape[1], dsm.shape[1], label.shape[1])
-            range_x = ((min_x-split_size) // (split_size-cover_size) ) +1  #方块可移动的距离除以每次移动的距离，得出第二个方块及以后的数量，最终数量要加上第一个方块
-            range_y = ((min_y-split_size) // (split_size-cover_size) ) +1
-            print(range_x)
-
-            #原先版本，无重叠切割
-            # for x in range(range_x):
-            #     for y in range(range_y):
-            #         split_dsm = dsm[x * split_size:(x + 1) * split_size, y * split_size:(y + 1) * split_size]
-            #         split_image = image[x * split_size:(x + 1) * split_size, y * split_size:(y + 1) * split_size]
-            #         split_mask = mask[x * split_size:(x + 1) * split_size, y * split_size:(y + 1) * split_size]
-            #         # Image.fromarray(split_dsm).save(os.path.join(self.target_path, 'DSM', str(num) + '.tif'))
-            #         # Image.fromarray(split_image).save(os.path.join(self.target_path, 'RGB', str(num) + '.png'))
-            #         # Image.fromarray(split_mask).save(os.path.join(self.target_path, 'Label', str(num) + '.png'))
-            #         num += 1
-            # num_tif += (x+1)*(y+1)
-
-            for x in range(range_x):
-                for y in range(range_y):
-                    split_dsm = dsm[x * (split_size-cover_size):x * (split_size-cover_size) + split_size, y * (split_size-cover_size):y * (split_size-cover_size) + split_size]
-                    split_image = image[x * (split_size-cover_size):x * (split_size-cover_size) + split_size, y * (split_size-cover_size):y * (split_size-cover_size) + split_size]
-                    split_mask = label[x * (split_size-cover_size):x * (split_size-cover_size) + split_size, y * (split_size-cover_size):y * (split_size-cover_size) + split_size]
-                    Image.fromarray(split_dsm).save(os.path.join(self.target_path, 'DSM', str(num) + '.png'))
-                    Image.fromarray(split_image).save(os.path.join(self.target_path, 'RGB', str(num) + '.jpg'))
-                    Image.fromarray(split_mask).save(os.path.join(self.target_path, 'Label', str(num) + '.png'))
-                    num += 1
-            num_tif += (x+1)*(y+1)
-
-
-        print(f'the number of png is {num_tif}')
-        tqdm_flag.close()
+        self.file_flag = list_files(self.Label_path)
+        self._rgb_names = set(list_files(self.RGB_path))  # 一次列目录，之后查集合代替逐个 stat
+
+    def source_paths(self, file):
+        """返回 (RGB, DSM, Label) 的完整路径，RGB 图（*_RGB.jpg 或 *_IMG.jpg）不存在时返回 None"""
+        result = GAMUS_PATTERN.search(file)
+        if not result:
+            return None
+        dsm_path = fr'{result.group(1)}AGL.png'
+        rgb_path_1 = fr'{result.group(1)}RGB.jpg'
+        rgb_path_2 = fr'{result.group(1)}IMG.jpg'
+        if rgb_path_1 in self._rgb_names:
+            rgb_path = rgb_path_1
+        elif rgb_path_2 in self._rgb_names:
+            rgb_path = rgb_path_2
+        else:
+            print(f"{rgb_path_1}不存在")
+            return None
+        return (os.path.join(self.RGB_path, rgb_path),
+                os.path.join(self.DSM_path, dsm_path),
+                os.path.join(self.Label_path, file))
+
+    def start_dealWith(self, split_size, cover_size, processes=None):
+        split_dataset(self, split_size, cover_size, processes)
 
 class Visual_RGB:
     def __init__(self, dataset_path, target_path):
@@ -342,27 +475,25 @@ class Visual_RGB:
         self.target_path = target_path
         self.DSM_path = os.path.join(dataset_path, 'DSM')
         self.Label_path = os.path.join(dataset_path, 'Label')
-        self.Label_flag = os.listdir(self.Label_path)
-        self.DSM_flag = os.listdir(self.DSM_path)
+        self.Label_flag = list_files(self.Label_path)
+        self.DSM_flag = list_files(self.DSM_path)
  
     def Label2RGB(self):
         os.makedirs(os.path.join(self.target_path, 'Label_RGB'), exist_ok=True)
         tqdm_flag = tqdm.tqdm(self.Label_flag,total=len(self.Label_flag))
         for file in tqdm_flag:
-            label_np = np.array(Image.open(os.path.join(self.Label_path, file)))
+            label_np = read_image(os.path.join(self.Label_path, file), index=True)
             rgb_image = Label2RGB(label_np, Vaihingen_COLOR_MAP)
             Image.fromarray(rgb_image).save(os.path.join(self.target_path, 'Label_RGB', file.replace('.png', '_rgb.png')))
-            print(f"Label RGB visualization saved for {file}")
         tqdm_flag.close()
 
     def DSM2RGB(self):
         os.makedirs(os.path.join(self.target_path,'DSM_RGB'), exist_ok=True)
         tqdm_flag = tqdm.tqdm(self.DSM_flag,total=len(self.DSM_flag))
         for file in tqdm_flag:
-            dsm = np.array(Image.open(os.path.join(self.DSM_path, file)))
+            dsm = read_image(os.path.join(self.DSM_path, file))
             rgb_image = DSM2RGB(dsm, colormap='thermal')
             Image.fromarray(rgb_image).save(os.path.join(self.target_path, 'DSM_RGB', file.replace('.tif', '_dsm_rgb.png')))
-            print(f"DSM RGB visualization saved for {file}")
         tqdm_flag.close()
 
 
@@ -388,7 +519,7 @@ class Rename:
                     new_name_RGB = f'scene_{int(i):04d}_IMG.tif'
                     new_path_RGB = os.path.join(self.RGB_path,new_name_RGB)
                     os.rename(old_path_RGB,new_path_RGB)
-                    print(f"Processing img  {old_path_RGB} to {new_path_RGB}")
+                    tqdm.tqdm.write(f"Processing img  {old_path_RGB} to {new_path_RGB}")
 
             if mode == 'Label'or mode =='all':
                 old_path_Label = os.path.join(self.Label_path,f'scene_{int(i):04d}_BLG.png')
@@ -396,7 +527,7 @@ class Rename:
                     new_name_Label = f'scene_{int(i):04d}_BLG.tif'
                     new_path_Label = os.path.join(self.Label_path,new_name_Label)
                     os.rename(old_path_Label,new_path_Label)
-                    print(f"Processing label  {old_path_Label} to {new_path_Label}")
+                    tqdm.tqdm.write(f"Processing label  {old_path_Label} to {new_path_Label}")
 
             # if mode == 'DSM'or mode =='all':
             #     old_path_DSM = os.path.join(self.DSM_path,f'{i}.tif')
@@ -52,6 +52,10 @@ WAIT_AFTER_FILE_CONFIRM_MIN = 2.0
 WAIT_AFTER_FILE_CONFIRM_MAX = 3.0
 # 说明：等待文件加载完成，如果电脑慢可以增加
 
+# 文件加载完成的最长等待时间（秒）
+FILE_LOAD_TIMEOUT = 30
+# 说明：提供了 button_templates/file_loaded.png 时，导入后轮询该标志，出现即继续，不再使用上面的固定等待
+
 # 点击渲染按钮后的等待时间（秒）
 WAIT_AFTER_RENDER_MIN = 2
 WAIT_AFTER_RENDER_MAX = 3
@@ -92,9 +96,7 @@ PATH_INPUT_INTERVAL = 0.05
 
 # ==================== PyAutoGUI 基础配置 ====================
 
-# 每个 PyAutoGUI 操作后的默认暂停时间（秒）
-PYAUTOGUI_PAUSE = 0.05  # 极小暂停，加快速度
-# 说明：全局暂停时间，影响所有操作，设置过大会严重拖慢速度
+# 说明：PyAutoGUI 的全局暂停固定为 0，各步骤之间的等待由上面的 WAIT_* 参数控制
 
 # 是否启用安全模式（鼠标移到左上角停止）
 PYAUTOGUI_FAILSAFE = True
@@ -4,17 +4,25 @@ Google Earth 批量视频渲染自动化脚本 - 窗口锁定版本
 特性：窗口句柄锁定、图像识别、随机鼠标轨迹
 """
 
+import os
 import pyautogui
 import time
+import ctypes
+import threading
+from ctypes import wintypes
 import random
 import numpy as np
 from pathlib import Path
 import cv2
 import logging
+import logging.handlers
+import queue
+import atexit
 import pygetwindow as gw
 import win32gui
 import win32con
 import win32api
+import win32ui
 
 # 尝试导入 pyperclip，如果没有则使用备用方案
 try:
@@ -31,16 +39,172 @@ except ImportError:
     print("⚠️ 未找到 config.py，使用默认配置")
     config = None
 
-# 配置日志
+# 配置日志：记录日志只是放入队列，由后台线程写文件和控制台，重试循环里的日志不会等待磁盘
+_log_queue = queue.SimpleQueue()
+_log_listener = logging.handlers.QueueListener(
+    _log_queue,
+    logging.FileHandler('batch_render.log', encoding='utf-8'),
+    logging.StreamHandler(),
+    respect_handler_level=True
+)
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('batch_render.log', encoding='utf-8'),
-        logging.StreamHandler()
+    handlers=[logging.handlers.QueueHandler(_log_queue)],
+    force=True
+)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+# 鼠标轨迹抖动用的随机数生成器，整条轨迹的抖动一次生成
+_rng = np.random.default_rng()
+
+# 二次缓动函数的查找表（256 项 float32，1KB），按 t 查表代替分支和 np.where 的两路计算
+_EASE_T = np.linspace(0, 1, 256, dtype=np.float32)
+EASE_LUT = np.where(_EASE_T < 0.5, 2 * _EASE_T * _EASE_T, -1 + (4 - 2 * _EASE_T) * _EASE_T)
+
+# 导入菜单的三级菜单项，按点击顺序排列
+IMPORT_MENU_STEPS = ('file_menu', 'import_menu_item', 'earth_studio_project')
+
+# click_button 每隔多少次重试检查一次鼠标是否在左上角（安全停止）
+FAILSAFE_CHECK_EVERY = 3
+
+# 可选的"文件加载完成"标志模板（button_templates/file_loaded.png），存在时导入后轮询它代替固定等待
+FILE_LOADED_TEMPLATE = 'file_loaded'
+
+# ==================== SendInput 鼠标批量移动 ====================
+INPUT_MOUSE = 0
+MOUSEEVENTF_MOVE = 0x0001
+MOUSEEVENTF_VIRTUALDESK = 0x4000
+MOUSEEVENTF_ABSOLUTE = 0x8000
+
+
+class MOUSEINPUT(ctypes.Structure):
+    _fields_ = [
+        ('dx', wintypes.LONG),
+        ('dy', wintypes.LONG),
+        ('mouseData', wintypes.DWORD),
+        ('dwFlags', wintypes.DWORD),
+        ('time', wintypes.DWORD),
+        ('dwExtraInfo', ctypes.c_size_t),
     ]
+
+
+class INPUT(ctypes.Structure):
+    # MOUSEINPUT 是 INPUT 联合体中最大的成员，只声明它即可保证结构体大小与系统一致
+    _fields_ = [('type', wintypes.DWORD), ('mi', MOUSEINPUT)]
+
+
+def send_mouse_path(xs, ys):
+    """
+    把整条轨迹一次性交给 SendInput，代替逐点调用 pyautogui.moveTo
+    :param xs: 轨迹 X 坐标序列（屏幕像素）
+    :param ys: 轨迹 Y 坐标序列（屏幕像素）
+    """
+    # 绝对坐标需归一化到 0-65535，按整个虚拟桌面换算，多显示器下同样适用
+    left = win32api.GetSystemMetrics(win32con.SM_XVIRTUALSCREEN)
+    top = win32api.GetSystemMetrics(win32con.SM_YVIRTUALSCREEN)
+    width = max(win32api.GetSystemMetrics(win32con.SM_CXVIRTUALSCREEN) - 1, 1)
+    height = max(win32api.GetSystemMetrics(win32con.SM_CYVIRTUALSCREEN) - 1, 1)
+    dxs = np.rint((np.asarray(xs) - left) * (65535 / width)).astype(np.int32)
+    dys = np.rint((np.asarray(ys) - top) * (65535 / height)).astype(np.int32)
+
+    n = len(dxs)
+    inputs = (INPUT * n)()
+    flags = MOUSEEVENTF_MOVE | MOUSEEVENTF_ABSOLUTE | MOUSEEVENTF_VIRTUALDESK
+    for item, dx, dy in zip(inputs, dxs.tolist(), dys.tolist()):
+        item.type = INPUT_MOUSE
+        item.mi.dx = dx
+        item.mi.dy = dy
+        item.mi.dwFlags = flags
+    sent = ctypes.windll.user32.SendInput(n, inputs, ctypes.sizeof(INPUT))
+    if sent != n:
+        logging.warning(f"SendInput 只发送了 {sent}/{n} 个鼠标事件")
+
+
+# ==================== 前台窗口变化事件 ====================
+EVENT_SYSTEM_FOREGROUND = 0x0003
+WINEVENT_OUTOFCONTEXT = 0x0000
+WinEventProc = ctypes.WINFUNCTYPE(
+    None, wintypes.HANDLE, wintypes.DWORD, wintypes.HWND,
+    wintypes.LONG, wintypes.LONG, wintypes.DWORD, wintypes.DWORD
 )
 
+# ==================== 金字塔模板匹配 ====================
+PYRAMID_LEVELS = 2  # 最多在原图基础上缩小两级（边长 1/4）
+PYRAMID_MIN_SIZE = 8  # 模板缩小后短边不足该像素数就不再继续缩小，避免特征丢失
+PYRAMID_MARGIN = 8  # 逐级细化时，搜索区域在上一级结果四周各扩展的像素
+
+# OpenCV 透明 API：有 OpenCL 设备时，大图的 matchTemplate 通过 UMat 交给 GPU；没有时自动走 CPU
+USE_OPENCL = cv2.ocl.haveOpenCL()
+cv2.ocl.setUseOpenCL(USE_OPENCL)
+UMAT_MIN_PIXELS = 512 * 512  # 小区域（ROI 细化、金字塔顶层）上传 GPU 的开销大于收益，仍在 CPU 上匹配
+
+
+def build_pyramid(image, levels):
+    """用 cv2.pyrDown 逐级缩小，返回 [原图, 1/2, 1/4, ...]"""
+    pyramid = [image]
+    for _ in range(levels):
+        pyramid.append(cv2.pyrDown(pyramid[-1]))
+    return pyramid
+
+
+def template_pyramid(template):
+    """为模板建金字塔，层数受 PYRAMID_LEVELS 和 PYRAMID_MIN_SIZE 限制"""
+    levels = 0
+    while levels < PYRAMID_LEVELS and min(template.shape[:2]) >> (levels + 1) >= PYRAMID_MIN_SIZE:
+        levels += 1
+    return build_pyramid(template, levels)
+
+
+def _match(haystack, template, template_umat=None):
+    """
+    TM_CCOEFF_NORMED 匹配，返回 (最高得分, 左上角坐标)；搜索区域比模板小时返回 None
+    template_umat 为加载模板时缓存的 UMat，走 OpenCL 时只需上传截图
+    """
+    if haystack.shape[0] < template.shape[0] or haystack.shape[1] < template.shape[1]:
+        return None
+    if USE_OPENCL and haystack.shape[0] * haystack.shape[1] >= UMAT_MIN_PIXELS:
+        if template_umat is None:
+            template_umat = cv2.UMat(template)
+        # 结果图留在 UMat 上，minMaxLoc 同样支持 UMat，只取回最值
+        result = cv2.matchTemplate(cv2.UMat(haystack), template_umat, cv2.TM_CCOEFF_NORMED)
+    else:
+        result = cv2.matchTemplate(haystack, template, cv2.TM_CCOEFF_NORMED)
+    _, max_val, _, max_loc = cv2.minMaxLoc(result)
+    return max_val, max_loc
+
+
+def match_template_pyramid(haystack, tpl_pyramid, tpl_umats=None):
+    """
+    由粗到细的模板匹配：在最小一级整图搜索得到候选位置，
+    再逐级放大，只在候选位置附近（模板大小 + 2*PYRAMID_MARGIN）的小区域内细化
+    :param tpl_umats: 与 tpl_pyramid 逐级对应的缓存 UMat（可选）
+    :return: (原图上的得分, 左上角坐标) 或 None
+    """
+    levels = len(tpl_pyramid) - 1
+    if tpl_umats is None:
+        tpl_umats = [None] * len(tpl_pyramid)
+    hay_pyramid = build_pyramid(haystack, levels)
+    found = _match(hay_pyramid[levels], tpl_pyramid[levels], tpl_umats[levels])
+    if found is None:
+        return None
+    score, (x, y) = found
+    for level in range(levels - 1, -1, -1):
+        hay = hay_pyramid[level]
+        tpl_h, tpl_w = tpl_pyramid[level].shape[:2]
+        x0 = max(x * 2 - PYRAMID_MARGIN, 0)
+        y0 = max(y * 2 - PYRAMID_MARGIN, 0)
+        x1 = min(x * 2 + tpl_w + PYRAMID_MARGIN, hay.shape[1])
+        y1 = min(y * 2 + tpl_h + PYRAMID_MARGIN, hay.shape[0])
+        found = _match(hay[y0:y1, x0:x1], tpl_pyramid[level], tpl_umats[level])
+        if found is None:
+            return None
+        score, (x, y) = found
+        x += x0
+        y += y0
+    return score, (x, y)
+
 
 class WindowLockedRenderer:
     def __init__(self, esp_folder, button_images_folder='button_templates'):
@@ -53,14 +217,51 @@ class WindowLockedRenderer:
         self.button_images_folder = Path(button_images_folder)
         self.target_window = None
         self.window_handle = None
+        self._tpl_cache = {}  # 按钮名 -> (灰度模板金字塔, 逐级的 UMat)，每个模板只读盘解码、上传一次
+        self._last_loc = {}  # 按钮名 -> 上次匹配到的 (x, y, w, h)，相对截图区域左上角
+        self._grab = None  # 截图用的 (屏幕DC句柄, 源DC, 内存DC, 位图)，窗口尺寸不变时复用
+        self._grab_size = None
+        self._gray = None  # 灰度截图缓冲区，与截图位图一起复用
         
         # 设置 PyAutoGUI 安全参数
+        # 不使用全局 PAUSE：它会在每次 pyautogui 调用后都插入等待，需要的停顿由各步骤的 WAIT_* 显式控制
+        pyautogui.PAUSE = 0
+        pyautogui.FAILSAFE = config.PYAUTOGUI_FAILSAFE if config else True
+        
+        # 鼠标移动和点击每次都要用的参数，初始化时从 config 读取一次
         if config:
-            pyautogui.PAUSE = config.PYAUTOGUI_PAUSE
-            pyautogui.FAILSAFE = config.PYAUTOGUI_FAILSAFE
+            self._mouse_move_min = config.MOUSE_MOVE_DURATION_MIN
+            self._mouse_move_max = config.MOUSE_MOVE_DURATION_MAX
+            self._jitter = config.MOUSE_JITTER_RANGE
+            self._click_offset = config.CLICK_OFFSET_RANGE
+            self._pause_min = config.MOUSE_CLICK_PAUSE_MIN
+            self._pause_max = config.MOUSE_CLICK_PAUSE_MAX
+            self._confidence = config.BUTTON_CONFIDENCE
         else:
-            pyautogui.PAUSE = 0.5
-            pyautogui.FAILSAFE = True
+            # 默认快速移动：0.2-0.4秒
+            self._mouse_move_min, self._mouse_move_max = 0.2, 0.4
+            self._jitter = 2
+            self._click_offset = 5
+            self._pause_min, self._pause_max = 0.1, 0.3
+            self._confidence = 0.8
+        
+        # 窗口激活状态的短时缓存：TTL 内不重复查询前台窗口；前台窗口一变化就由事件钩子作废缓存
+        self._last_active_check = 0.0
+        self._active_ttl = 0.25
+        # 窗口区域的短时缓存：一次点击按钮的多次重试期间窗口不会移动；前台窗口变化或重新激活时作废
+        self._region = None
+        self._region_ts = 0.0
+        self._region_ttl = 0.5
+        self._on_foreground = WinEventProc(self._handle_foreground_event)  # 回调对象需一直持有
+        self._watch_thread_id = None
+        self._start_foreground_watch()
+        
+        # 把系统定时器精度调到 1ms：Windows 默认约 15.6ms，点击前 0.02-0.05 秒这类短暂停会被拉长且抖动
+        self._timer_period = False
+        try:
+            self._timer_period = ctypes.windll.winmm.timeBeginPeriod(1) == 0
+        except Exception as e:
+            logging.warning(f"设置定时器精度失败: {e}")
         
         logging.info(f"初始化完成，ESP 文件夹: {self.esp_folder}")
     
@@ -144,11 +345,8 @@ class WindowLockedRenderer:
             return False
         
         try:
-            # 重新获取窗口句柄（防止句柄失效）
-            try:
-                self.window_handle = self.target_window._hWnd
-            except:
-                # 如果获取失败，尝试重新查找窗口
+            # 检查窗口句柄是否仍然有效，只有失效时才枚举全部窗口重新查找
+            if not self.window_handle or not win32gui.IsWindow(self.window_handle):
                 logging.warning("窗口句柄失效，尝试重新查找窗口...")
                 all_windows = gw.getAllWindows()
                 for window in all_windows:
@@ -201,6 +399,7 @@ class WindowLockedRenderer:
                     logging.error(f"点击激活也失败: {e2}")
                     return False
             
+            self._region_ts = 0.0  # 恢复/激活可能改变窗口位置和大小
             logging.info("窗口已激活并置顶")
             return True
         
@@ -208,8 +407,48 @@ class WindowLockedRenderer:
             logging.error(f"激活窗口失败: {e}")
             return False
     
+    def _start_foreground_watch(self):
+        """在后台线程注册 EVENT_SYSTEM_FOREGROUND 钩子并运行消息循环（事件回调依赖消息循环投递）"""
+        ready = threading.Event()
+        
+        def run():
+            user32 = ctypes.windll.user32
+            user32.SetWinEventHook.restype = wintypes.HANDLE
+            hook = user32.SetWinEventHook(
+                EVENT_SYSTEM_FOREGROUND, EVENT_SYSTEM_FOREGROUND, 0,
+                self._on_foreground, 0, 0, WINEVENT_OUTOFCONTEXT
+            )
+            if hook:
+                self._watch_thread_id = win32api.GetCurrentThreadId()
+            ready.set()
+            if not hook:
+                logging.warning("注册前台窗口事件钩子失败，窗口激活状态只按 TTL 缓存")
+                return
+            try:
+                win32gui.PumpMessages()
+            finally:
+                user32.UnhookWinEvent(wintypes.HANDLE(hook))
+        
+        threading.Thread(target=run, name='foreground-watch', daemon=True).start()
+        ready.wait(1.0)
+    
+    def _handle_foreground_event(self, hook, event, hwnd, id_object, id_child, thread_id, event_time):
+        """前台窗口切换到别的窗口时，作废激活状态和窗口区域缓存"""
+        if hwnd != self.window_handle:
+            self._last_active_check = 0.0
+            self._region_ts = 0.0
+    
     def ensure_window_active(self):
-        """确保窗口处于激活状态"""
+        """确保窗口处于激活状态；最近一次确认在 TTL 内且期间前台窗口没有变化时直接返回"""
+        if time.monotonic() - self._last_active_check < self._active_ttl:
+            return True
+        active = self._check_window_active()
+        if active:
+            self._last_active_check = time.monotonic()
+        return active
+    
+    def _check_window_active(self):
+        """检查前台窗口，必要时重新激活"""
         try:
             # 检查窗口是否仍然存在
             if not self.target_window or not self.window_handle:
@@ -235,37 +474,34 @@ class WindowLockedRenderer:
     
     def get_window_region(self):
         """
-        获取窗口区域坐标
+        获取窗口区域坐标（结果缓存 0.5 秒）
         :return: (left, top, width, height)
         """
-        if not self.target_window:
+        if not self.target_window or not self.window_handle:
             return None
         
+        now = time.monotonic()
+        if self._region is not None and now - self._region_ts < self._region_ttl:
+            return self._region
+        
         try:
-            # 尝试刷新窗口信息
-            try:
-                # 重新获取窗口对象
-                all_windows = gw.getAllWindows()
-                for window in all_windows:
-                    if window._hWnd == self.window_handle:
-                        self.target_window = window
-                        break
-            except:
-                pass
-            
-            return (
-                self.target_window.left,
-                self.target_window.top,
-                self.target_window.width,
-                self.target_window.height
-            )
+            # 直接按句柄读取窗口矩形，一次系统调用，不再枚举全部窗口
+            left, top, right, bottom = win32gui.GetWindowRect(self.window_handle)
+            self._region = (left, top, right - left, bottom - top)
+            self._region_ts = now
+            return self._region
         except Exception as e:
             logging.error(f"获取窗口区域失败: {e}")
             return None
     
     def get_esp_files(self):
         """获取所有 ESP 文件并排序"""
-        esp_files = sorted(self.esp_folder.glob('*.esp'))
+        # os.scandir 的条目自带文件类型，按文件名字符串排序后再拼成 Path
+        # Windows 上 glob 和 Path 排序都不区分大小写，这里保持一致
+        with os.scandir(self.esp_folder) as it:
+            names = [e.name for e in it if e.name.lower().endswith('.esp') and e.is_file(follow_symlinks=False)]
+        names.sort(key=str.lower)
+        esp_files = [self.esp_folder / name for name in names]
         logging.info(f"找到 {len(esp_files)} 个 ESP 文件")
         return esp_files
     
@@ -277,82 +513,225 @@ class WindowLockedRenderer:
         :param duration: 移动持续时间（秒），从 config 读取
         """
         if duration is None:
-            if config:
-                duration = random.uniform(config.MOUSE_MOVE_DURATION_MIN, config.MOUSE_MOVE_DURATION_MAX)
-            else:
-                # 默认快速移动：0.2-0.4秒
-                duration = random.uniform(0.2, 0.4)
+            duration = random.uniform(self._mouse_move_min, self._mouse_move_max)
         
         current_x, current_y = pyautogui.position()
         
-        # 使用缓动函数模拟自然移动
+        # 使用缓动函数模拟自然移动，用 NumPy 一次算出整条轨迹
         steps = int(duration * 100)
-        for i in range(steps):
-            t = i / steps
-            eased_t = self._ease_in_out_quad(t)
-            
-            x = current_x + (target_x - current_x) * eased_t
-            y = current_y + (target_y - current_y) * eased_t
-            
-            # 添加微小随机抖动
-            jitter = config.MOUSE_JITTER_RANGE if config else 2
-            x += random.uniform(-jitter, jitter)
-            y += random.uniform(-jitter, jitter)
-            pyautogui.moveTo(x, y, duration=0)
-            time.sleep(duration / steps)
+        eased_t = self._ease_in_out_quad(np.arange(steps) / steps)
+        
+        # 添加微小随机抖动
+        jitter = self._jitter
+        xs = current_x + (target_x - current_x) * eased_t + _rng.uniform(-jitter, jitter, steps)
+        ys = current_y + (target_y - current_y) * eased_t + _rng.uniform(-jitter, jitter, steps)
         
-        # 确保最终到达目标位置（使用极短时间）
-        pyautogui.moveTo(target_x, target_y, duration=0)
+        # 整条轨迹一次 SendInput 发出
+        if steps:
+            send_mouse_path(xs, ys)
+        
+        # 确保最终到达目标位置：SetCursorPos 按像素精确定位，不经过绝对坐标的归一化换算
+        win32api.SetCursorPos((int(target_x), int(target_y)))
     
     def _ease_in_out_quad(self, t):
-        """二次缓动函数"""
-        if t < 0.5:
-            return 2 * t * t
-        else:
-            return -1 + (4 - 2 * t) * t
+        """二次缓动函数，t 为 0-1 的数组；查表取最近的一项，误差不超过 1/255 的移动距离"""
+        return EASE_LUT[(t * 255 + 0.5).astype(np.intp)]
     
-    def find_button_in_window(self, button_template_path, confidence=None):
+    def _grab_window(self, region):
         """
-        在锁定的窗口中查找按钮
-        :param button_template_path: 按钮模板图片路径
+        用 BitBlt 只复制窗口所在的屏幕区域，直接得到 BGRA 的 NumPy 数组
+        pyautogui.screenshot 会先抓整个桌面再裁剪；这里内存DC和位图跨调用复用，窗口尺寸变化时才重建
+        从屏幕DC而不是窗口DC复制：浏览器这类硬件加速窗口从窗口DC复制常得到黑图
+        """
+        left, top, width, height = region
+        if self._grab_size != (width, height):
+            self.release_capture()
+            screen_dc = win32gui.GetDC(0)
+            src_dc = win32ui.CreateDCFromHandle(screen_dc)
+            mem_dc = src_dc.CreateCompatibleDC()
+            bitmap = win32ui.CreateBitmap()
+            bitmap.CreateCompatibleBitmap(src_dc, width, height)
+            mem_dc.SelectObject(bitmap)
+            self._grab = (screen_dc, src_dc, mem_dc, bitmap)
+            self._grab_size = (width, height)
+        _, src_dc, mem_dc, bitmap = self._grab
+        mem_dc.BitBlt((0, 0), (width, height), src_dc, (left, top), win32con.SRCCOPY)
+        data = bitmap.GetBitmapBits(True)
+        return np.frombuffer(data, dtype=np.uint8).reshape(height, width, 4)
+    
+    def _grab_gray(self, region):
+        """截取窗口并转成单通道灰度图：匹配只处理 1/4 的字节（BGRA 4 通道 -> 1 通道），灰度缓冲区复用"""
+        bgra = self._grab_window(region)
+        if self._gray is None or self._gray.shape != bgra.shape[:2]:
+            self._gray = np.empty(bgra.shape[:2], dtype=np.uint8)
+        return cv2.cvtColor(bgra, cv2.COLOR_BGRA2GRAY, dst=self._gray)
+    
+    def release_capture(self):
+        """释放截图用的 DC 和位图"""
+        if self._grab is None:
+            return
+        screen_dc, src_dc, mem_dc, bitmap = self._grab
+        self._grab = None
+        self._grab_size = None
+        try:
+            mem_dc.DeleteDC()
+            src_dc.DeleteDC()
+            win32gui.ReleaseDC(0, screen_dc)
+            win32gui.DeleteObject(bitmap.GetHandle())
+        except Exception as e:
+            logging.warning(f"释放截图资源失败: {e}")
+    
+    def close(self):
+        """结束时调用：释放截图资源，停止前台窗口监听，恢复系统定时器精度"""
+        self.release_capture()
+        if self._watch_thread_id:
+            win32api.PostThreadMessage(self._watch_thread_id, win32con.WM_QUIT, 0, 0)
+            self._watch_thread_id = None
+        if self._timer_period:
+            ctypes.windll.winmm.timeEndPeriod(1)
+            self._timer_period = False
+    
+    def _load_template(self, button_template_path):
+        """
+        读取按钮模板（灰度）并建好金字塔，结果按文件名缓存
+        :return: (金字塔各级 ndarray 列表, 对应的 UMat 列表；未启用 OpenCL 时为 None)
+        """
+        cached = self._tpl_cache.get(button_template_path.name)
+        if cached is None:
+            # np.fromfile + imdecode 可以读取中文路径，cv2.imread 在 Windows 上不行
+            data = np.fromfile(str(button_template_path), dtype=np.uint8)
+            template = cv2.imdecode(data, cv2.IMREAD_GRAYSCALE)
+            if template is None:
+                raise ValueError(f"无法解码按钮模板: {button_template_path}")
+            pyramid = template_pyramid(template)
+            # 模板在加载时包成 UMat 一次，匹配时只上传截图
+            umats = [cv2.UMat(level) for level in pyramid] if USE_OPENCL else None
+            cached = self._tpl_cache[button_template_path.name] = (pyramid, umats)
+        return cached
+    
+    def _match_last_location(self, haystack, name, template):
+        """在按钮上次命中位置周围 (x-w, y-h, 3w, 3h) 的区域内匹配，返回 (得分, 截图上的左上角)；没有记录时得分为 -1"""
+        last = self._last_loc.get(name)
+        if last is None:
+            return -1.0, None
+        x, y, w, h = last
+        x0 = max(x - w, 0)
+        y0 = max(y - h, 0)
+        found = _match(haystack[y0:y + 2 * h, x0:x + 2 * w], template)
+        if found is None:
+            return -1.0, None
+        score, (roi_x, roi_y) = found
+        return score, (x0 + roi_x, y0 + roi_y)
+    
+    def _capture_gray(self):
+        """截取窗口区域的灰度图，返回 (灰度图, 区域左上角的屏幕坐标)；无法获取窗口区域时截全屏"""
+        region = self.get_window_region()
+        if region and region[2] > 0 and region[3] > 0:
+            return self._grab_gray(region), (region[0], region[1])
+        return cv2.cvtColor(np.asarray(pyautogui.screenshot()), cv2.COLOR_RGB2GRAY), (0, 0)
+    
+    def _match_any(self, screenshot_gray, templates, confidence):
+        """
+        在同一张灰度截图上匹配多个模板，截图和灰度转换只做一次
+        :param screenshot_gray: 灰度截图
+        :param templates: 模板文件名 -> _load_template 的结果
         :param confidence: 匹配置信度 (0-1)
-        :return: 按钮中心坐标 (x, y) 或 None
+        :return: 模板文件名 -> (得分, 左上角 x, 左上角 y)，只包含达到置信度的模板
+        """
+        hits = {}
+        for name, (template, template_umats) in templates.items():
+            tpl_h, tpl_w = template[0].shape
+            if screenshot_gray.shape[0] < tpl_h or screenshot_gray.shape[1] < tpl_w:
+                logging.warning(f"搜索区域小于按钮模板: {name}")
+                continue
+            
+            # 同一对话框里按钮位置不变：先在上次命中位置附近（3 倍模板大小）搜索
+            max_val, max_loc = self._match_last_location(screenshot_gray, name, template[0])
+            if max_val < confidence:
+                # 先走金字塔；粗搜索可能落在错误的候选上，未达到置信度时再在原图整图确认一次
+                max_val, max_loc = match_template_pyramid(screenshot_gray, template, template_umats) or (-1.0, None)
+                if max_val < confidence and len(template) > 1:
+                    max_val, max_loc = _match(screenshot_gray, template[0], template_umats and template_umats[0])
+            
+            if max_val >= confidence:
+                self._last_loc[name] = (max_loc[0], max_loc[1], tpl_w, tpl_h)
+                hits[name] = (max_val, max_loc[0], max_loc[1])
+        return hits
+    
+    def find_buttons_in_window(self, button_template_paths, confidence=None):
+        """
+        截一次图，在锁定的窗口中查找多个按钮
+        :param button_template_paths: 按钮模板图片路径列表
+        :param confidence: 匹配置信度 (0-1)
+        :return: 模板文件名 -> 按钮中心坐标 (x, y)，未找到的按钮不在结果中
         """
         if confidence is None:
-            confidence = config.BUTTON_CONFIDENCE if config else 0.8
+            confidence = self._confidence
         
         # 确保窗口激活
         self.ensure_window_active()
         
+        templates = {path.name: self._load_template(path) for path in button_template_paths}
+        haystack, (offset_x, offset_y) = self._capture_gray()
+        centers = {}
+        for name, (_, x, y) in self._match_any(haystack, templates, confidence).items():
+            tpl_h, tpl_w = templates[name][0][0].shape
+            centers[name] = (offset_x + x + tpl_w // 2, offset_y + y + tpl_h // 2)
+        return centers
+    
+    def find_button_in_window(self, button_template_path, confidence=None, log_miss=True):
+        """
+        在锁定的窗口中查找按钮
+        :param button_template_path: 按钮模板图片路径
+        :param confidence: 匹配置信度 (0-1)
+        :param log_miss: 未找到时是否记录警告（轮询等待时关闭）
+        :return: 按钮中心坐标 (x, y) 或 None
+        """
         try:
-            # 获取窗口区域
-            region = self.get_window_region()
-            
-            if region:
-                # 只在窗口区域内搜索
-                location = pyautogui.locateOnScreen(
-                    str(button_template_path),
-                    confidence=confidence,
-                    region=region
-                )
-            else:
-                # 如果无法获取窗口区域，在全屏搜索
-                location = pyautogui.locateOnScreen(
-                    str(button_template_path),
-                    confidence=confidence
-                )
-            
-            if location:
-                center = pyautogui.center(location)
-                logging.info(f"找到按钮: {button_template_path.name} at ({center.x}, {center.y})")
-                return center.x, center.y
-            else:
-                logging.warning(f"未找到按钮: {button_template_path.name}")
-                return None
-        
+            position = self.find_buttons_in_window([button_template_path], confidence).get(button_template_path.name)
         except Exception as e:
             logging.error(f"查找按钮时出错: {e}")
             return None
+        
+        if position:
+            logging.info(f"找到按钮: {button_template_path.name} at ({position[0]}, {position[1]})")
+            return position
+        if log_miss:
+            logging.warning(f"未找到按钮: {button_template_path.name}")
+        return None
+    
+    def _import_menu_start_step(self):
+        """
+        上一次导入中途失败时，菜单可能仍然展开着，此时再点"文件"会把菜单收起
+        截一次图同时查找三级菜单项，返回应从第几步开始（0=文件菜单，1=导入，2=Earth Studio项目）
+        """
+        paths = [self.button_images_folder / f"{name}.png" for name in IMPORT_MENU_STEPS]
+        try:
+            visible = self.find_buttons_in_window(paths)
+        except Exception as e:
+            logging.warning(f"检查菜单状态失败: {e}，从文件菜单开始")
+            return 0
+        for step in range(len(paths) - 1, 0, -1):
+            if paths[step].name in visible:
+                return step
+        return 0
+    
+    def wait_for_button(self, button_name, timeout, interval=0.2):
+        """
+        轮询等待按钮出现，出现即返回
+        :param button_name: 按钮名称
+        :param timeout: 最长等待时间（秒）
+        :param interval: 轮询间隔（秒）
+        :return: 超时前是否出现
+        """
+        button_template = self.button_images_folder / f"{button_name}.png"
+        deadline = time.monotonic() + timeout
+        while True:
+            if self.find_button_in_window(button_template, log_miss=False):
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(interval)
     
     def click_button(self, button_name, max_retries=10):
         """
@@ -372,8 +751,8 @@ class WindowLockedRenderer:
         
         for attempt in range(max_retries):
             # 检查安全模式：鼠标在左上角则停止
-            mouse_x, mouse_y = pyautogui.position()
-            if mouse_x == 0 and mouse_y == 0:
+            # 鼠标移动走 SendInput，不经过 pyautogui 自带的 FAILSAFE 检查，所以这里保留手动检查，每 K 次重试查一次
+            if attempt % FAILSAFE_CHECK_EVERY == 0 and win32api.GetCursorPos() == (0, 0):
                 logging.warning("⚠️ 检测到鼠标在左上角，触发安全停止！")
                 raise pyautogui.FailSafeException("用户触发安全停止")
             
@@ -385,7 +764,7 @@ class WindowLockedRenderer:
             if position:
                 x, y = position
                 # 添加小范围随机偏移
-                offset = config.CLICK_OFFSET_RANGE if config else 5
+                offset = self._click_offset
                 x += random.randint(-offset, offset)
                 y += random.randint(-offset, offset)
                 
@@ -393,13 +772,11 @@ class WindowLockedRenderer:
                 self.random_mouse_move(x, y)
                 
                 # 点击前的停顿
-                if config:
-                    pause = random.uniform(config.MOUSE_CLICK_PAUSE_MIN, config.MOUSE_CLICK_PAUSE_MAX)
-                else:
-                    pause = random.uniform(0.1, 0.3)
-                time.sleep(pause)
+                time.sleep(random.uniform(self._pause_min, self._pause_max))
                 
-                pyautogui.click()
+                # 直接发送左键按下/抬起，省去 pyautogui.click 的封装开销
+                win32api.mouse_event(win32con.MOUSEEVENTF_LEFTDOWN, 0, 0, 0, 0)
+                win32api.mouse_event(win32con.MOUSEEVENTF_LEFTUP, 0, 0, 0, 0)
                 logging.info(f"✅ 成功点击按钮 '{button_name}'")
                 return True
             
@@ -413,6 +790,27 @@ class WindowLockedRenderer:
         logging.error(f"❌ 无法找到或点击按钮 '{button_name}'，已重试 {max_retries} 次")
         return False
     
+    def _find_file_dialog_edit(self):
+        """
+        查找当前前台文件对话框（#32770）的文件名输入框
+        标准打开对话框中输入框位于 ComboBoxEx32 -> ComboBox -> Edit；旧式对话框则是直接的 Edit 子控件
+        :return: 输入框句柄或 None
+        """
+        try:
+            dialog = win32gui.GetForegroundWindow()
+            if not dialog or win32gui.GetClassName(dialog) != '#32770':
+                return None
+            combo_ex = win32gui.FindWindowEx(dialog, 0, 'ComboBoxEx32', None)
+            if combo_ex:
+                combo = win32gui.FindWindowEx(combo_ex, 0, 'ComboBox', None)
+                edit = win32gui.FindWindowEx(combo, 0, 'Edit', None) if combo else 0
+                if edit:
+                    return edit
+            return win32gui.FindWindowEx(dialog, 0, 'Edit', None) or None
+        except Exception as e:
+            logging.warning(f"查找文件对话框输入框失败: {e}")
+            return None
+    
     def import_esp_file(self, esp_file_path):
         """
         导入 ESP 文件
@@ -425,23 +823,30 @@ class WindowLockedRenderer:
         # 确保窗口激活
         self.ensure_window_active()
         
+        # 菜单仍展开时从最深一级可见的菜单项继续
+        start_step = self._import_menu_start_step()
+        if start_step > 0:
+            logging.info(f"菜单已展开，从步骤 {start_step + 1}/5 继续")
+        
         # 1. 点击"文件"菜单
-        logging.info("步骤 1/5: 点击文件菜单")
-        if not self.click_button('file_menu'):
-            return False
-        if config:
-            time.sleep(random.uniform(config.WAIT_AFTER_FILE_MENU_MIN, config.WAIT_AFTER_FILE_MENU_MAX))
-        else:
-            time.sleep(random.uniform(0.5, 1.0))
+        if start_step <= 0:
+            logging.info("步骤 1/5: 点击文件菜单")
+            if not self.click_button('file_menu'):
+                return False
+            if config:
+                time.sleep(random.uniform(config.WAIT_AFTER_FILE_MENU_MIN, config.WAIT_AFTER_FILE_MENU_MAX))
+            else:
+                time.sleep(random.uniform(0.5, 1.0))
         
         # 2. 点击"导入"
-        logging.info("步骤 2/5: 点击导入选项")
-        if not self.click_button('import_menu_item'):
-            return False
-        if config:
-            time.sleep(random.uniform(config.WAIT_AFTER_IMPORT_MIN, config.WAIT_AFTER_IMPORT_MAX))
-        else:
-            time.sleep(random.uniform(0.5, 1.0))
+        if start_step <= 1:
+            logging.info("步骤 2/5: 点击导入选项")
+            if not self.click_button('import_menu_item'):
+                return False
+            if config:
+                time.sleep(random.uniform(config.WAIT_AFTER_IMPORT_MIN, config.WAIT_AFTER_IMPORT_MAX))
+            else:
+                time.sleep(random.uniform(0.5, 1.0))
         
         # 3. 点击"Earth Studio项目"
         logging.info("步骤 3/5: 点击 Earth Studio 项目")
@@ -457,8 +862,13 @@ class WindowLockedRenderer:
         file_path_str = str(esp_file_path.absolute())
         logging.info(f"文件路径: {file_path_str}")
         
-        # 使用剪贴板粘贴路径（每次都重新复制）
-        if HAS_PYPERCLIP:
+        # 优先直接把路径写入文件对话框的输入框（WM_SETTEXT），不经过剪贴板
+        edit_hwnd = self._find_file_dialog_edit()
+        if edit_hwnd:
+            win32gui.SendMessage(edit_hwnd, win32con.WM_SETTEXT, 0, file_path_str)
+            logging.info("✅ 路径已写入输入框")
+        # 找不到输入框时退回剪贴板粘贴路径（每次都重新复制）
+        elif HAS_PYPERCLIP:
             # 每次都重新复制到剪贴板
             pyperclip.copy(file_path_str)
             time.sleep(0.2)
@@ -469,7 +879,7 @@ class WindowLockedRenderer:
             
             logging.info("✅ 路径已粘贴")
         else:
-            logging.error("❌ 未安装 pyperclip，无法输入路径")
+            logging.error("❌ 未找到文件对话框输入框且未安装 pyperclip，无法输入路径")
             return False
         
         if config:
@@ -483,14 +893,24 @@ class WindowLockedRenderer:
             logging.warning("未找到打开按钮，尝试按 Enter 键")
             pyautogui.press('enter')
         
-        # 等待文件加载
-        if config:
-            wait_time = random.uniform(config.WAIT_AFTER_FILE_CONFIRM_MIN, config.WAIT_AFTER_FILE_CONFIRM_MAX)
+        # 等待文件加载：提供了加载完成标志模板时轮询它，出现即继续；否则按固定时间等待
+        # （渲染按钮在加载前就一直可见，不能作为加载完成的标志）
+        if (self.button_images_folder / f"{FILE_LOADED_TEMPLATE}.png").exists():
+            timeout = config.FILE_LOAD_TIMEOUT if config else 30
+            logging.info(f"等待文件加载（最长 {timeout} 秒）...")
+            start = time.monotonic()
+            if self.wait_for_button(FILE_LOADED_TEMPLATE, timeout):
+                logging.info(f"文件加载完成，用时 {time.monotonic() - start:.1f} 秒")
+            else:
+                logging.warning("等待文件加载超时，继续执行")
         else:
-            wait_time = random.uniform(2.0, 3.0)
-        
-        logging.info(f"等待文件加载 {wait_time:.1f} 秒...")
-        time.sleep(wait_time)
+            if config:
+                wait_time = random.uniform(config.WAIT_AFTER_FILE_CONFIRM_MIN, config.WAIT_AFTER_FILE_CONFIRM_MAX)
+            else:
+                wait_time = random.uniform(2.0, 3.0)
+            
+            logging.info(f"等待文件加载 {wait_time:.1f} 秒...")
+            time.sleep(wait_time)
         
         logging.info(f"✅ 文件导入完成: {esp_file_path.name}")
         return True
@@ -628,6 +1048,7 @@ def main():
     
     if not renderer.find_earth_studio_window():
         print("❌ 未选择窗口，退出")
+        renderer.close()
         return
     
     print(f"\n✅ 已锁定窗口: {renderer.target_window.title}")
@@ -664,7 +1085,10 @@ def main():
     print("\n开始执行！\n")
     
     # 开始批量处理
-    renderer.batch_process(start_index=start_idx, end_index=end_idx)
+    try:
+        renderer.batch_process(start_index=start_idx, end_index=end_idx)
+    finally:
+        renderer.close()
 
 
 if __name__ == "__main__":